@@ -15,6 +15,7 @@ from django.contrib.messages import constants as msg
 from dotenv import load_dotenv
 from datetime import timedelta
 import os
+import tempfile
 
 load_dotenv()
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -54,6 +55,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'utils.supportmiddleware.SQLInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -95,10 +97,71 @@ WSGI_APPLICATION = 'HOTEL.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
+# DB_ENGINE=postgresql usa o servidor configurado pelas variáveis DB_*,
+# o padrão é o sqlite local
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite3')
+# tempo máximo esperando um lock antes de levantar OperationalError, usado
+# como busy_timeout no sqlite e lock_timeout no postgresql
+DB_LOCK_TIMEOUT = int(os.getenv('DB_LOCK_TIMEOUT', 5000))  # ms
+# fecha no início da requisição conexões persistentes que não respondem mais
+DB_HEALTH_CHECKS = bool(int(os.getenv('DB_HEALTH_CHECKS', 1)))
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'hotel'),
+            'USER': os.getenv('DB_USER', 'hotel'),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', 60)),  # seconds
+            # necessário atrás de um pool externo em transaction mode (pgbouncer)
+            'DISABLE_SERVER_SIDE_CURSORS': bool(int(os.getenv('DB_DISABLE_SERVER_SIDE_CURSORS', 0))),
+            'OPTIONS': {
+                'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 5)),  # seconds
+                'options': f'-c lock_timeout={DB_LOCK_TIMEOUT}',
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', 60)),  # seconds
+            # banco de testes em arquivo para que os testes concorrentes tenham o
+            # mesmo lock (WAL e busy_timeout) de produção, o banco em memória
+            # compartilhado falha com "database table is locked" sem esperar.
+            # Fica no diretório temporário junto dos arquivos -wal e -shm
+            'TEST': {'NAME': Path(tempfile.gettempdir()) / 'hotel_test_db.sqlite3'},
+        }
+    }
+
+# pragmas aplicados em cada nova conexão sqlite, veja utils.supportdb
+SQLITE_TUNED = bool(int(os.getenv('SQLITE_TUNED', 1)))
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': DB_LOCK_TIMEOUT,
+    'mmap_size': 128 * 1024 * 1024,  # 128 MB
+    'cache_size': -20000,  # 20 MB
+    'temp_store': 'memory',
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# o LocMemCache é separado por processo: as invalidações do catálogo chegam
+# aos demais processos apenas quando a versão expira (utils.supportcache).
+# Em produção use um backend compartilhado, por exemplo
+# CACHE_BACKEND='django.core.cache.backends.filebased.FileBasedCache' com
+# CACHE_LOCATION apontando para um diretório comum aos processos
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'hotel'),
     }
 }
 
@@ -149,6 +212,9 @@ STATICFILES_DIRS = [BASE_DIR / 'templates/static']
 # media
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# arquivos que não podem ser servidos publicamente, como os comprovantes de
+# pagamento, ficam fora do MEDIA_ROOT e são entregues apenas pelas views
+PRIVATE_STORAGE_ROOT = Path(os.getenv('PRIVATE_STORAGE_ROOT', BASE_DIR / 'private'))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -191,31 +257,53 @@ Q_CLUSTER = {
 # stripe api
 STRIPE_API_KEY_SECRET = os.getenv('STRIPE_API_KEY_SECRET')
 STRIPE_API_KEY_PUBLIC = os.getenv('STRIPE_API_KEY_PUBLIC')
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', 'https://api.stripe.com')
+STRIPE_TIMEOUT = int(os.getenv('STRIPE_TIMEOUT', 10))  # seconds
+STRIPE_MAX_NETWORK_RETRIES = 2
+
+# instrumentação de queries por requisição, veja utils.supportmiddleware
+# fração das requisições instrumentadas, de 0 a 1
+SQL_INSTRUMENTATION_SAMPLE_RATE = float(os.getenv('SQL_INSTRUMENTATION_SAMPLE_RATE', 1 if DEBUG else 0.1))
+# header Server-Timing, fora do DEBUG enviado apenas para usuários staff
+SQL_SERVER_TIMING = bool(int(os.getenv('SQL_SERVER_TIMING', 1 if DEBUG else 0)))
+SQL_QUERY_BUDGET = int(os.getenv('SQL_QUERY_BUDGET', 20))  # queries per request
+SQL_TIME_BUDGET = int(os.getenv('SQL_TIME_BUDGET', 500))  # ms per request
+
+# home
+# janela em dias do ranking de quartos mais reservados (30 ou 90), vazio para o total
+HOME_POPULAR_ROOMS_WINDOW = int(os.getenv('HOME_POPULAR_ROOMS_WINDOW') or 0) or None
 
 # logging
+# a requisição apenas enfileira o registro, a escrita em JSON lines é feita
+# por uma thread, veja utils.supportlogging
+# web e qcluster escrevem no mesmo arquivo, por isso a rotação é externa
+# (logrotate, veja o README). LOG_ROTATE=1 rotaciona no próprio processo e só
+# deve ser usado quando um único processo escreve no log
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG' if DEBUG else 'INFO')
+LOG_ROTATE = bool(int(os.getenv('LOG_ROTATE', 0)))
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
     "handlers": {
         "file": {
             "level": "DEBUG",
-            "class": "logging.FileHandler",
+            "class": "utils.supportlogging.QueueLogHandler",
             "filename": BASE_DIR / "debug.log",
-            'formatter': 'verbose',
+            "max_bytes": 10 * 1024 * 1024,  # 10 MB
+            "when": "midnight",
+            "backup_count": 7,
+            "queue_size": 10000,
+            "rotate": LOG_ROTATE,
         },
     },
     "loggers": {
         "djangoLogger": {
             "handlers": ["file"],
-            "level": "DEBUG",
+            "level": LOG_LEVEL,
             "propagate": False,
         },
     },
-    'formatters': {
-        'verbose': {
-            'format': '%(asctime)s [%(levelname)s] %(pathname)s %(funcName)s.%(lineno)d | %(message)s'
-        },
-    },
 }
 
 # django axes
@@ -226,3 +314,10 @@ AXES_LOCKOUT_CALLABLE = 'clients.views.axes_locked_out'
 # google reCAPTCHA
 G_RECAPTCHA_KEY_SITE = os.getenv('G_RECAPTCHA_KEY_SITE')
 G_RECAPTCHA_KEY_SECRET = os.getenv('G_RECAPTCHA_KEY_SECRET')
+G_RECAPTCHA_VERIFY_URL = os.getenv('G_RECAPTCHA_VERIFY_URL', 'https://www.google.com/recaptcha/api/siteverify')
+G_RECAPTCHA_TIMEOUT = float(os.getenv('G_RECAPTCHA_TIMEOUT', 3))  # seconds
+# 1 aceita o captcha quando o google está indisponível, 0 recusa
+G_RECAPTCHA_FAIL_OPEN = bool(int(os.getenv('G_RECAPTCHA_FAIL_OPEN', 0)))
+G_RECAPTCHA_BREAKER_THRESHOLD = 5  # consecutive failures to open the circuit
+G_RECAPTCHA_BREAKER_COOLDOWN = 30  # seconds
+G_RECAPTCHA_VERDICT_TTL = 60 * 2  # 2 minutes
@@ -27,7 +27,7 @@ class SignUp(View):
     
     def get(self, request):
         if request.user.is_authenticated:
-            self.logger.info(f'user already logged in. Redirecting to {self._redirect.url}')
+            self.logger.info('user already logged in. Redirecting to %s', self._redirect.url)
             return self._redirect
         
         return render(request, self.template_name)
@@ -42,8 +42,8 @@ class SignUp(View):
         birthdate = self.request.POST.get('nascimento')
         cpf = self.request.POST.get('cpf', '').strip()
         captcha = request.POST.get('g-recaptcha-response')
-        if not support.verify_captcha(captcha):
-            self.logger.debug(f'captcha response: {captcha}')
+        if not support.verify_captcha(captcha, request.session):
+            self.logger.debug('captcha response: %s', captcha)
             messages.error(request, INVALID_RECAPTCHA_MESSAGE)
             return redirect(request.META.get('HTTP_REFERER', 'signup'))
 
@@ -67,7 +67,7 @@ class SignUp(View):
             client.full_clean()
         except ValidationError as e:
             messages.error(request, e.messages[0])
-            self.logger.error(str(e.error_dict))
+            self.logger.error('%s', e.error_dict)
             return render(request, self.template_name)
         
         client.set_password(client.password)
@@ -75,7 +75,7 @@ class SignUp(View):
 
         login(request, client)
         _redirect = self._redirect
-        self.logger.debug(f'redirecting to {_redirect.url}')
+        self.logger.debug('redirecting to %s', _redirect.url)
         return _redirect
 
 
@@ -91,21 +91,21 @@ class SignIn(View):
         next_url = request.GET.get("next", self.next_url)
         request.session['next_url'] = next_url
         request.session.save()
-        self.logger.debug(f'next url: {next_url}')
+        self.logger.debug('next url: %s', next_url)
 
         if request.user.is_authenticated:
             self.logger.info('user already logged in redirected to `rooms`')
             return redirect('rooms')
         
-        self.logger.debug(f'rendering {self.template}')
+        self.logger.debug('rendering %s', self.template)
         return render(request, self.template)
     
     def post(self, request: HttpRequest, *args, **kwargs):
         username = request.POST.get('username')
         password = request.POST.get('password')
         captcha = request.POST.get('g-recaptcha-response')
-        if not support.verify_captcha(captcha):
-            self.logger.debug(f'captcha response: {captcha}')
+        if not support.verify_captcha(captcha, request.session):
+            self.logger.debug('captcha response: %s', captcha)
             messages.error(request, INVALID_RECAPTCHA_MESSAGE)
             return redirect(request.META.get('HTTP_REFERER', 'signin'))
 
@@ -118,15 +118,15 @@ class SignIn(View):
         login(request, user)
 
         next_url = request.session.get('next_url')
-        self.logger.info(f'next url in the session: {next_url}')
+        self.logger.info('next url in the session: %s', next_url)
         if next_url:
             deleted = request.session.pop('next_url')
             request.session.save()
-            self.logger.debug(f'delete {deleted} from session')
+            self.logger.debug('delete %s from session', deleted)
         else:
             next_url = self.next_url
 
-        self.logger.info(f'user logged with success. Redirecting to {next_url}')
+        self.logger.info('user logged with success. Redirecting to %s', next_url)
         return redirect(next_url)
 
 
@@ -151,7 +151,7 @@ def _check_perfil_ownership(request, received_pk):
     """função que verifica se o perfil recebido é o mesmo
     perfil que enviou o request."""
     if request.user.is_authenticated and request.user.pk != received_pk:
-        logging.getLogger('djangoLogger').warn(f'{request.user.pk} != {received_pk}')
+        logging.getLogger('djangoLogger').warning('%s != %s', request.user.pk, received_pk)
         raise PermissionDenied
     
 
@@ -187,14 +187,14 @@ class PerfilChangePassword(LoginRequired, View):
         self.template = 'perfil_update_password.html'
     
     def get(self, *args, **kwargs):
-        self.logger.debug(f'rendering {self.template}')    
+        self.logger.debug('rendering %s', self.template)    
         return render(self.request, self.template)
     
     def post(self, request, *args, **kwargs):
         new_pass = self.request.POST.get('new_password')
         pass_repeat = self.request.POST.get('password_repeat')
         captcha = request.POST.get('g-recaptcha-response')
-        if not support.verify_captcha(captcha):
+        if not support.verify_captcha(captcha, request.session):
             messages.error(request, INVALID_RECAPTCHA_MESSAGE)
             default_url = reverse('update_perfil_password', args=(request.user.pk,))
             return redirect(request.META.get('HTTP_REFERER', default_url))
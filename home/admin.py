@@ -19,6 +19,9 @@ class ContactAdmin(admin.ModelAdmin):
     list_filter = [
         'hotel'
     ]
+    list_select_related = [
+        'hotel'
+    ]
     search_fields = [
         'hotel', 'email', 'telefone'
     ]
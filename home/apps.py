@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class HomeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'home'
+
+    def ready(self) -> None:
+        from django.core.signals import request_started
+        from django.db.backends.signals import connection_created
+        from utils.supportdb import apply_sqlite_pragmas, close_unusable_connections
+        from . import signals  # noqa: F401
+
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='sqlite_pragmas')
+        request_started.connect(close_unusable_connections, dispatch_uid='db_health_checks')
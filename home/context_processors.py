@@ -1,14 +1,35 @@
-from .models import Hotel, Contact
+import time
+from .models import Hotel
 from django.conf import settings
-from dotenv import load_dotenv
+
+HOTEL_SNAPSHOT_TTL = 60 * 5  # 5 minutes
+_hotel_snapshot = None
+
+
+def invalidate_hotel_snapshot(*args, **kwargs):
+    """descarta o snapshot do hotel do processo atual. Usado como receiver
+    dos signals de Hotel e Contact"""
+    global _hotel_snapshot
+    _hotel_snapshot = None
 
 
 def hotel(*args, **kwargs):
-    _hotel = Hotel.objects.first()
-    contact = Contact.objects.filter(hotel=_hotel).first()
-    return {'hotel': _hotel, 'hotel_contact': contact}
+    """add o hotel e seu contato ao context a partir de um snapshot mantido
+    em memória pelo processo. O snapshot é descartado quando Hotel ou Contact
+    são alterados e expira após `HOTEL_SNAPSHOT_TTL` segundos para que outros
+    processos também recebam as alterações."""
+    global _hotel_snapshot
+    snapshot = _hotel_snapshot
+    if snapshot is None or snapshot[0] <= time.monotonic():
+        _hotel = Hotel.objects.select_related('hotel_contact').first()
+        contact = getattr(_hotel, 'hotel_contacts', None)
+        snapshot = (
+            time.monotonic() + HOTEL_SNAPSHOT_TTL,
+            {'hotel': _hotel, 'hotel_contact': contact},
+        )
+        _hotel_snapshot = snapshot
+    return snapshot[1]
 
 
 def recaptcha(*args, **kwargs):
-    load_dotenv()
     return {'recaptcha_site_key': settings.G_RECAPTCHA_KEY_SITE}
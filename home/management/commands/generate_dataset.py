@@ -0,0 +1,335 @@
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Any, Iterator
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from clients.models import Client
+from clients.validators import CpfValidator
+from home.models import Contact, Hotel
+from payments.models import Payment
+from reservations.models import Benefit, Class, Reservation, Room, RoomNight
+from reservations.tasks import rebuild_room_popularity
+from reservations.validators import convert_date
+from schedules.models import Scheduling
+from services.models import Service
+from utils.supportmodels import ClientRules, ReserveRules, RoomRules
+
+FIRST_NAMES = [
+    'Ana', 'Bruno', 'Carla', 'Daniel', 'Eduarda', 'Felipe', 'Gabriela', 'Hugo',
+    'Isabela', 'Joao', 'Larissa', 'Marcos', 'Natalia', 'Otavio', 'Paula', 'Rafael',
+    'Sofia', 'Thiago', 'Vitoria', 'Yuri',
+]
+LAST_NAMES = [
+    'Silva', 'Santos', 'Oliveira', 'Souza', 'Rodrigues', 'Ferreira', 'Alves',
+    'Pereira', 'Lima', 'Gomes', 'Costa', 'Ribeiro', 'Martins', 'Carvalho', 'Rocha',
+]
+CLASS_NAMES = ['Standard', 'Superior', 'Luxo', 'Suite', 'Master', 'Familia', 'Executivo']
+BENEFIT_NAMES = [
+    'Wi-Fi', 'Café da manhã', 'Ar condicionado', 'Frigobar', 'TV a cabo', 'Banheira',
+    'Varanda', 'Vista para o mar', 'Cofre', 'Serviço de quarto', 'Estacionamento', 'Academia',
+]
+SERVICE_NAMES = ['Restaurante', 'Spa', 'Piscina', 'Bar', 'Lavanderia', 'Translado']
+AREA_CODES = [11, 21, 27, 31, 41, 48, 51, 61, 71, 81, 85, 92]
+# duração das estadias em dias e seus pesos, estadias curtas são as mais comuns
+STAY_DAYS = [1, 2, 3, 4, 5, 6, 7, 10, 14, 21, ReserveRules.MAX_RESERVATION_DAYS]
+STAY_WEIGHTS = [22, 24, 18, 10, 7, 5, 6, 4, 2, 1, 1]
+# meses de alta temporada, com intervalo menor entre as estadias
+HIGH_SEASON = {1, 2, 7, 12}
+CANCEL_RATE = .08
+
+
+def make_cpf(number: int) -> str:
+    """cpf com os dígitos verificadores calculados por `CpfValidator` a partir
+    de uma base de 9 dígitos derivada de `number`. Números diferentes abaixo de
+    10^9 geram bases diferentes"""
+    base = (number * 104729) % 10 ** 9
+    if len(set(f'{base:09d}')) == 1:
+        base = (base + 1) % 10 ** 9
+    validator = CpfValidator(message='')
+    validator._cpf = f'{base:09d}00'
+    return f'{base:09d}{validator.calculate_first_digit()}{validator.calculate_second_digit()}'
+
+
+def room_number(index: int) -> str:
+    """número do quarto no formato `^\\d{3}[A-Z]?$` para até 27000 quartos"""
+    suffix = '' if index < 1000 else chr(ord('A') + index // 1000 - 1)
+    return f'{index % 1000:03d}{suffix}'
+
+
+def batched(items: Iterator, size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        'gera um volume sintético de hotéis, classes, benefícios, quartos, clientes, '
+        'reservas, pagamentos e agendamentos que respeitam os validators das models. '
+        'O resultado é determinístico para a mesma seed e data de referência.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--today', type=convert_date, default=None, help='data de referência (YYYY-MM-DD)')
+        parser.add_argument('--hotels', type=int, default=1)
+        parser.add_argument('--classes', type=int, default=5)
+        parser.add_argument('--benefits', type=int, default=10)
+        parser.add_argument('--services', type=int, default=3, help='serviços por hotel')
+        parser.add_argument('--rooms', type=int, default=100)
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument('--reservations', type=int, default=10000)
+        parser.add_argument('--occupancy', type=float, default=.6, help='fração dos quartos ocupados hoje')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--room-image', default='test/room_test.jpg')
+        parser.add_argument('--password', default='Hotel@1234', help='senha de todos os clientes gerados')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        if options['rooms'] < 1 or options['clients'] < 1 or options['hotels'] < 1:
+            raise CommandError('at least one hotel, one room and one client are required')
+
+        self.rng = random.Random(options['seed'])
+        self.today = options['today'] or timezone.now().date()
+        self.batch_size = options['batch_size']
+        self.options = options
+        self.counts = {}
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            hotels = self._hotels(options['hotels'], options['services'])
+            classes = self._classes(options['classes'])
+            benefits = self._benefits(options['benefits'])
+            rooms = self._rooms(options['rooms'], hotels, classes, benefits)
+            clients = self._clients(options['clients'])
+        self._reservations(options['reservations'], rooms, clients)
+        self._reset_sequences()
+        # bulk_create não dispara os signals que mantêm a popularidade dos quartos
+        rebuild_room_popularity()
+
+        elapsed = time.perf_counter() - started
+        total = sum(self.counts.values())
+        summary = ', '.join(f'{count} {name}' for name, count in self.counts.items())
+        self.stdout.write(f'{summary} in {elapsed:.1f}s ({total / elapsed:.0f} rows/s)')
+
+    def _next_pk(self, model) -> int:
+        return (model.objects.aggregate(pk=Max('pk'))['pk'] or 0) + 1
+
+    def _create(self, model, objs, name: str | None = None) -> None:
+        """bulk_create em lotes de `batch_size`, cada lote em uma transação"""
+        name = name or model._meta.verbose_name_plural.lower()
+        for batch in batched(iter(objs), self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(batch, batch_size=self.batch_size)
+            self.counts[name] = self.counts.get(name, 0) + len(batch)
+
+    def _hotels(self, amount: int, services: int) -> list[Hotel]:
+        first = self._next_pk(Hotel)
+        hotels = [
+            Hotel(
+                pk=pk, name=f'Hotel {pk}', slogan=f'O melhor descanso da cidade {pk}',
+                presentation_text=f'Hotel {pk} gerado para testes de carga.',
+                logo='test/test_icon.png', icon='test/test_icon.png',
+            )
+            for pk in range(first, first + amount)
+        ]
+        self._create(Hotel, hotels, 'hotels')
+        self._create(Contact, (
+            Contact(
+                hotel=hotel, email=f'contato{hotel.pk}@hotel.example.com',
+                phone=f'{self.rng.choice(AREA_CODES)}3{hotel.pk:07d}',
+                whatsapp=f'{self.rng.choice(AREA_CODES)}9{hotel.pk:08d}',
+                instagram=f'@hotel{hotel.pk}', facebook=f'hotel{hotel.pk}', twitter=f'@hotel{hotel.pk}',
+            )
+            for hotel in hotels
+        ), 'contacts')
+        first_service = self._next_pk(Service)
+        self._create(Service, (
+            Service(
+                name=f'{SERVICE_NAMES[i % len(SERVICE_NAMES)]} {first_service + n}',
+                presentation_text=f'{SERVICE_NAMES[i % len(SERVICE_NAMES)]} {first_service + n} do {hotel.name}.',
+                logo='test/test_icon.png', hotel=hotel,
+            )
+            for n, (hotel, i) in enumerate((hotel, i) for hotel in hotels for i in range(services))
+        ), 'services')
+        return hotels
+
+    def _classes(self, amount: int) -> list[Class]:
+        first = self._next_pk(Class)
+        classes = [
+            Class(pk=pk, name=f'{CLASS_NAMES[i % len(CLASS_NAMES)]} {pk}')
+            for i, pk in enumerate(range(first, first + amount))
+        ]
+        self._create(Class, classes, 'classes')
+        return classes or list(Class.objects.all())
+
+    def _benefits(self, amount: int) -> list[Benefit]:
+        first = self._next_pk(Benefit)
+        benefits = [
+            Benefit(
+                pk=pk, name=f'{BENEFIT_NAMES[i % len(BENEFIT_NAMES)]} {pk}',
+                short_desc=f'{BENEFIT_NAMES[i % len(BENEFIT_NAMES)]} incluso ({pk})',
+                displayable_on_homepage=i < 4,
+            )
+            for i, pk in enumerate(range(first, first + amount))
+        ]
+        self._create(Benefit, benefits, 'benefits')
+        return benefits or list(Benefit.objects.all())
+
+    def _rooms(self, amount: int, hotels: list[Hotel], classes: list[Class], benefits: list[Benefit]) -> list[Room]:
+        if not classes:
+            raise CommandError('rooms need at least one class')
+
+        used = set(Room.objects.values_list('number', flat=True))
+        numbers = (room_number(i) for i in range(100, 27000) if room_number(i) not in used)
+        first = self._next_pk(Room)
+        rooms = []
+        for pk, number in zip(range(first, first + amount), numbers):
+            room_class = self.rng.choice(classes)
+            rooms.append(Room(
+                pk=pk, number=number, room_class=room_class, hotel=self.rng.choice(hotels),
+                adult_capacity=self.rng.randint(RoomRules.MIN_ADULTS, RoomRules.MAX_ADULTS),
+                child_capacity=self.rng.randint(RoomRules.MIN_CHILDREN, RoomRules.MAX_CHILDREN),
+                size=self.rng.randint(RoomRules.MIN_SIZE * 10, RoomRules.MAX_SIZE * 10) / 10,
+                daily_price=Decimal(self.rng.randrange(RoomRules.MIN_DAILY_PRICE, RoomRules.MAX_DAILY_PRICE + 1, 5)),
+                short_desc=f'Quarto {number} da classe {room_class.name}',
+                image=self.options['room_image'],
+            ))
+        if len(rooms) < amount:
+            raise CommandError(f'only {len(rooms)} room numbers are still available')
+
+        self._create(Room, rooms, 'rooms')
+        self._create(Room.benefit.through, (
+            Room.benefit.through(room_id=room.pk, benefit_id=benefit.pk)
+            for room in rooms
+            for benefit in self.rng.sample(benefits, self.rng.randint(0, len(benefits)))
+        ), 'room benefits')
+        return rooms
+
+    def _clients(self, amount: int) -> list[int]:
+        password = make_password(self.options['password'])
+        first = self._next_pk(Client)
+        if first + amount > 10 ** 8:
+            raise CommandError('client phones support up to 10^8 clients')
+
+        def clients() -> Iterator[Client]:
+            for pk in range(first, first + amount):
+                first_name, last_name = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+                age = self.rng.randint(ClientRules.MIN_AGE, 80)
+                yield Client(
+                    pk=pk, username=f'{first_name.lower()}{last_name.lower()}{pk}', password=password,
+                    first_name=first_name, last_name=last_name, email=f'{first_name.lower()}{pk}@email.example.com',
+                    phone=f'{self.rng.choice(AREA_CODES)}9{pk:08d}', cpf=make_cpf(pk),
+                    birthdate=self.today - timedelta(days=age * 365 + self.rng.randint(1, 360)),
+                )
+
+        self._create(Client, clients(), 'clients')
+        return list(range(first, first + amount))
+
+    def _stay(self) -> int:
+        return self.rng.choices(STAY_DAYS, STAY_WEIGHTS)[0]
+
+    def _gap(self, day: date) -> int:
+        """dias livres entre duas estadias, menor na alta temporada"""
+        mean = 1.5 if day.month in HIGH_SEASON else 4
+        return int(self.rng.expovariate(1 / mean))
+
+    def _timeline(self, room: Room, amount: int) -> Iterator[tuple[date, date, str]]:
+        """estadias sem sobreposição de um quarto. Com probabilidade `occupancy`
+        o quarto está ocupado hoje (A) e pode ter agendamentos (S) nos próximos
+        meses. As demais estadias são anteriores, finalizadas (F) ou canceladas
+        (C), voltando no tempo até completar `amount`"""
+        created = 0
+        if amount and self.rng.random() < self.options['occupancy']:
+            checkin = self.today - timedelta(days=self.rng.randint(0, 2))
+            checkout = checkin + timedelta(days=max(self._stay(), (self.today - checkin).days + 1))
+            yield checkin, checkout, 'A'
+            created += 1
+
+            limit = self.today + timedelta(weeks=4 * ReserveRules.ANTICIPATED_MONTHS_CHECKIN)
+            scheduled_checkin = checkout + timedelta(days=self._gap(checkout))
+            while created < amount and scheduled_checkin <= limit and self.rng.random() < .5:
+                scheduled_checkout = scheduled_checkin + timedelta(days=self._stay())
+                yield scheduled_checkin, scheduled_checkout, 'S'
+                created += 1
+                scheduled_checkin = scheduled_checkout + timedelta(days=self._gap(scheduled_checkout))
+            end = checkin
+        else:
+            end = self.today
+
+        while created < amount:
+            checkout = end - timedelta(days=self._gap(end))
+            checkin = checkout - timedelta(days=self._stay())
+            yield checkin, checkout, 'C' if self.rng.random() < CANCEL_RATE else 'F'
+            created += 1
+            end = checkin
+
+    def _reservations(self, amount: int, rooms: list[Room], clients: list[int]) -> None:
+        """gera as reservas de cada quarto com seus pagamentos, noites ocupadas
+        e agendamentos. Cada cliente tem no máximo uma reserva ativa ou agendada
+        enquanto houver clientes livres"""
+        per_room, remainder = divmod(amount, len(rooms))
+        free_clients = iter(self.rng.sample(clients, len(clients)))
+        next_pk = self._next_pk(Reservation)
+        now = timezone.now()
+
+        def rows() -> Iterator[tuple]:
+            nonlocal next_pk
+            for index, room in enumerate(rooms):
+                for checkin, checkout, status in self._timeline(room, per_room + (index < remainder)):
+                    client = next(free_clients, None) if status in Reservation.OCCUPYING_STATUS else None
+                    lead = min(int(self.rng.expovariate(1 / 20)), ReserveRules.ANTICIPATED_MONTHS_CHECKIN * 28)
+                    created_at = min(now, now - timedelta(days=(self.today - checkin).days + lead))
+                    reservation = Reservation(
+                        pk=next_pk, room_id=room.pk, client_id=client or self.rng.choice(clients),
+                        checkin=checkin, checkout=checkout, status=status, active=status == 'A',
+                        amount=room.daily_price * (checkout - checkin).days, created_at=created_at,
+                    )
+                    next_pk += 1
+                    yield reservation
+
+        occupied_rooms = set()
+        for batch in batched(rows(), self.batch_size):
+            with transaction.atomic():
+                Reservation.objects.bulk_create(batch)
+                Payment.objects.bulk_create(
+                    Payment(reservation_id=r.pk, amount=r.amount, status='C' if r.status == 'C' else 'F')
+                    for r in batch
+                )
+                occupying = [r for r in batch if r.status in Reservation.OCCUPYING_STATUS]
+                RoomNight.objects.bulk_create(
+                    RoomNight(room_id=r.room_id, night=night, reservation_id=r.pk)
+                    for r in occupying for night in r.nights
+                )
+                Scheduling.objects.bulk_create(
+                    Scheduling(client_id=r.client_id, reservation_id=r.pk)
+                    for r in occupying if r.status == 'S'
+                )
+            occupied_rooms.update(r.room_id for r in batch if r.status == 'A')
+            for name, count in (
+                ('reservations', len(batch)), ('payments', len(batch)),
+                ('room nights', sum(r.reservation_days for r in occupying)),
+                ('schedulings', sum(r.status == 'S' for r in occupying)),
+            ):
+                self.counts[name] = self.counts.get(name, 0) + count
+
+        Room.objects.filter(pk__in=occupied_rooms).update(available=False)
+
+    def _reset_sequences(self) -> None:
+        """as chaves primárias são atribuídas pelo comando, as sequences do
+        postgresql precisam continuar depois delas. No sqlite não há o que fazer"""
+        models = [Hotel, Contact, Service, Class, Benefit, Room, Client, Reservation, Payment, RoomNight, Scheduling]
+        statements = connection.ops.sequence_reset_sql(no_style(), models)
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
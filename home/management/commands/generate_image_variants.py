@@ -0,0 +1,47 @@
+from typing import Any
+from django.core.management.base import BaseCommand
+from reservations.models import Room
+from reservations.tasks import create_room_image_variants
+from services.models import Service
+from services.tasks import create_service_logo_variants
+from utils import supportimages
+from utils.supporttasks import enqueue_task
+
+# model, campo da imagem, campo das variantes e task que gera as variantes
+TARGETS = {
+    'rooms': (Room, 'image', 'image_variants', create_room_image_variants),
+    'services': (Service, 'logo', 'logo_variants', create_service_logo_variants),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'gera as variantes responsivas das imagens dos quartos e logos dos serviços '
+        'que ainda não as possuem ou cuja imagem mudou'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sync', action='store_true',
+            help='gera as variantes no próprio processo em vez de enfileirar no django-q',
+        )
+        parser.add_argument('--only', choices=list(TARGETS), help='processa apenas quartos ou serviços')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        for target, (model, field, variants_field, task) in TARGETS.items():
+            if options['only'] and options['only'] != target:
+                continue
+
+            pending = [
+                instance.pk for instance in model.objects.exclude(**{field: ''}).only('pk', field, variants_field).order_by('pk')
+                if supportimages.variants_outdated(getattr(instance, field), getattr(instance, variants_field))
+            ]
+            task_path = f'{task.__module__}.{task.__name__}'
+            for pk in pending:
+                if options['sync']:
+                    task(pk)
+                else:
+                    enqueue_task(task_path, pk, task_name=f'{task_path}_{pk}')
+
+            action = 'processed' if options['sync'] else 'enqueued'
+            self.stdout.write(f'{len(pending)} {target} {action}')
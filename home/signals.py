@@ -0,0 +1,8 @@
+from django.db.models.signals import post_save, post_delete
+
+from .context_processors import invalidate_hotel_snapshot
+from .models import Hotel, Contact
+
+for model in (Hotel, Contact):
+    post_save.connect(invalidate_hotel_snapshot, sender=model, dispatch_uid=f'hotel_snapshot_save_{model.__name__}')
+    post_delete.connect(invalidate_hotel_snapshot, sender=model, dispatch_uid=f'hotel_snapshot_delete_{model.__name__}')
@@ -0,0 +1,44 @@
+from django.template import Library
+from utils import supportimages
+
+register = Library()
+
+
+@register.simple_tag
+def srcset(field_file, variants, fmt):
+    """srcset das variantes do formato, vazio caso ainda não tenham sido geradas"""
+    if not field_file or supportimages.variants_outdated(field_file, variants):
+        return ''
+    return supportimages.srcset(variants, fmt, field_file.storage)
+
+
+@register.inclusion_tag('partials/_picture.html')
+def picture(field_file, variants, sizes='100vw', css_class='', alt='', loading='lazy'):
+    """<picture> com um <source> por formato moderno e o <img> de fallback.
+    Enquanto as variantes não são geradas usa a imagem original"""
+    context = {
+        'sizes': sizes, 'css_class': css_class, 'alt': alt, 'loading': loading,
+        'sources': [], 'src': '', 'srcset': '',
+    }
+    if not field_file:
+        return context
+
+    context['src'] = field_file.url
+    if supportimages.variants_outdated(field_file, variants):
+        return context
+
+    storage, formats = field_file.storage, variants.get('formats', {})
+    for fmt, names in formats.items():
+        if fmt in supportimages.MODERN_FORMATS:
+            mime_type = supportimages.FORMATS[fmt][2]
+            context['sources'].append((mime_type, supportimages.srcset(variants, fmt, storage)))
+        elif names:
+            context['srcset'] = supportimages.srcset(variants, fmt, storage)
+            context['src'] = storage.url(names[max(names, key=int)])
+    return context
+
+
+@register.filter
+def variants_state(instances, field):
+    """estado das imagens do campo para compor a key de um fragmento cacheado"""
+    return supportimages.variants_state(instances, field)
@@ -1,10 +1,11 @@
 import logging
+from django.conf import settings
 from django.shortcuts import render
-from django.db.models.aggregates import Count
-from reservations.models import Benefit, Reservation, Room
+from reservations.models import Benefit, RoomPopularity
 from services.models import Service
 from django.views.decorators.http import require_GET
 from django.http import HttpRequest
+from utils.supportcache import catalog_context
 
 
 @require_GET
@@ -12,14 +13,13 @@ def home(request: HttpRequest):
     logger = logging.getLogger('djangoLogger')
 
     context = {
-        'benefits': Benefit.objects.filter(displayable_on_homepage=True)
+        'benefits': Benefit.objects.filter(displayable_on_homepage=True),
+        **catalog_context(),
     }
-    top4_rooms = Reservation.objects.filter(status__in=['F', 'A', 'S']).values('room').annotate(
-        room_count=Count('room')
-    ).order_by('-room_count').values('room')[:4]
-    logger.info(f'top 4 rooms fetched: {top4_rooms}')
-
-    context['rooms'] = Room.objects.filter(pk__in=top4_rooms)
+    context['rooms'] = RoomPopularity.ranking(4, settings.HOME_POPULAR_ROOMS_WINDOW)
+    # o ranking muda a cada reserva, por isso compõe a key do fragmento dos
+    # quartos em vez de invalidar todo o catálogo
+    context['rooms_ranking'] = ','.join(str(room.pk) for room in context['rooms'])
     context['services'] = Service.objects.filter(hotel__pk=1)
-    logger.debug(f'rendering home with context {context}')
+    logger.debug('rendering home')
     return render(request, 'static/home/html/home.html', context)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Payment
+from .models import Payment, StripeEvent
 
 
 class PaymentAdmin(admin.ModelAdmin):
@@ -10,6 +10,7 @@ class PaymentAdmin(admin.ModelAdmin):
         'amount',
         'status'
     ]
+    list_select_related = ['reservation__client', 'reservation__room']
 
     @admin.display(description='Cliente')
     def client(self, obj):
@@ -21,3 +22,14 @@ class PaymentAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Payment, PaymentAdmin)
+
+
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = [
+        'event_id',
+        'type',
+        'received_at',
+    ]
+
+
+admin.site.register(StripeEvent, StripeEventAdmin)
@@ -0,0 +1,53 @@
+import time
+from itertools import cycle, islice
+from typing import Any
+from django.core.management.base import BaseCommand, CommandError
+from payments.models import Payment
+from utils.support import ReceiptRenderer, get_receipt_renderer
+
+
+class Command(BaseCommand):
+    help = 'mede quantos comprovantes de pagamento por segundo são renderizados'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=1000, help='quantidade de comprovantes do lote')
+        parser.add_argument('--repeat', type=int, default=50, help='repetições do comprovante único')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        payments = list(
+            Payment.objects.select_related('reservation__client', 'reservation__room__room_class')
+        )
+        if not payments:
+            raise CommandError('no payments found, load some data first')
+
+        renderer = get_receipt_renderer()
+        batch = list(islice(cycle(payments), options['batch']))
+        repeat = options['repeat']
+        payment = payments[0]
+
+        def cold_single():
+            for _ in range(repeat):
+                ReceiptRenderer(renderer.hotel, renderer.hotel_contact).render(payment)
+
+        def warm_single():
+            for _ in range(repeat):
+                renderer.render(payment)
+
+        self._report('single receipt, new renderer each time', repeat, cold_single)
+        self._report('single receipt, shared renderer', repeat, warm_single)
+        self._report(
+            f'batch of {len(batch)}, one pdf each', len(batch),
+            lambda: [renderer.render(p) for p in batch],
+        )
+        self._report(
+            f'batch of {len(batch)}, one document', len(batch),
+            lambda: renderer.render_many(batch),
+        )
+
+    def _report(self, label: str, receipts: int, func) -> None:
+        """executa `func`, que renderiza `receipts` comprovantes, e escreve
+        os comprovantes por segundo"""
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'{label}: {receipts / elapsed:.1f} receipts/s ({elapsed:.3f}s)')
@@ -0,0 +1,113 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Any
+from django.core.management.base import BaseCommand
+from django.db import connections
+from payments.models import Payment
+from utils.support import ReceiptStore
+from utils.supportdb import init_pool_worker
+
+CHECKPOINT_NAME = f'{ReceiptStore.DIRECTORY}/regenerate.checkpoint'
+
+
+def render_chunk(pks: list[int]) -> tuple[int, list[tuple[int, str]]]:
+    """renderiza novamente os comprovantes dos pagamentos e os grava no
+    `ReceiptStore`, usando o renderer do processo atual.
+
+    Returns:
+        tuple: quantidade de comprovantes gerados e lista de (id, erro) das falhas
+    """
+    store = ReceiptStore()
+    payments = Payment.objects.select_related(
+        'reservation__client', 'reservation__room__room_class'
+    ).filter(pk__in=pks)
+    done, failures = 0, []
+    for payment in payments:
+        try:
+            store.refresh(payment)
+            done += 1
+        except Exception as exc:
+            failures.append((payment.pk, str(exc)))
+    return done, failures
+
+
+class Command(BaseCommand):
+    help = 'renderiza novamente os comprovantes de pagamento em paralelo e grava no storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', default='F', help='status dos pagamentos, padrão finalizado')
+        parser.add_argument('--chunk-size', type=int, default=200, help='pagamentos por lote')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='processos do pool, 0 renderiza no próprio processo',
+        )
+        parser.add_argument('--resume', action='store_true', help='continua a partir do último lote concluído')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        store = ReceiptStore()
+        start_pk = self._read_checkpoint(store) if options['resume'] else 0
+        if start_pk:
+            self.stdout.write(f'resuming after payment {start_pk}')
+
+        pks = (
+            Payment.objects.filter(status=options['status'], pk__gt=start_pk)
+            .order_by('pk').values_list('pk', flat=True)
+            .iterator(chunk_size=options['chunk_size'])
+        )
+        chunks = iter(lambda: list(islice(pks, options['chunk_size'])), [])
+
+        done, failures = 0, []
+        started = time.perf_counter()
+        for chunk, (chunk_done, chunk_failures) in self._run(chunks, options['workers']):
+            done += chunk_done
+            failures.extend(chunk_failures)
+            self._write_checkpoint(store, chunk[-1])
+            self.stdout.write(f'{done} receipts rendered, last payment {chunk[-1]}')
+
+        elapsed = time.perf_counter() - started
+        if store.storage.exists(CHECKPOINT_NAME):
+            store.storage.delete(CHECKPOINT_NAME)
+
+        for pk, error in failures:
+            self.stderr.write(f'payment {pk} failed: {error}')
+        self.stdout.write(
+            f'{done} receipts in {elapsed:.2f}s ({done / elapsed if elapsed else 0:.1f} receipts/s), '
+            f'{len(failures)} failures'
+        )
+
+    def _run(self, chunks, workers: int):
+        """renderiza os lotes em ordem, mantendo no máximo 2 lotes por
+        processo em andamento para não carregar todos os ids em memória"""
+        if workers <= 0:
+            for chunk in chunks:
+                yield chunk, render_chunk(chunk)
+            return
+
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_pool_worker) as executor:
+            pending = deque()
+            for chunk in chunks:
+                pending.append((chunk, executor.submit(render_chunk, chunk)))
+                if len(pending) >= workers * 2:
+                    chunk, future = pending.popleft()
+                    yield chunk, future.result()
+            while pending:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+
+    @staticmethod
+    def _read_checkpoint(store: ReceiptStore) -> int:
+        """retorna o id do último pagamento do lote concluído ou 0"""
+        if not store.storage.exists(CHECKPOINT_NAME):
+            return 0
+        with store.storage.open(CHECKPOINT_NAME, 'rb') as checkpoint:
+            return int(checkpoint.read() or 0)
+
+    @staticmethod
+    def _write_checkpoint(store: ReceiptStore, pk: int) -> None:
+        """grava de forma atômica o id do último pagamento do lote concluído,
+        uma falha durante a gravação mantém o checkpoint anterior"""
+        store.write(CHECKPOINT_NAME, str(pk).encode())
@@ -0,0 +1,124 @@
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any
+from unittest.mock import patch
+from django.contrib.messages import get_messages
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import RequestFactory
+from django.conf import settings
+from django.urls import reverse
+from django.utils.timezone import now
+from stripe.checkout import Session
+from clients.models import Client
+from payments.models import Payment
+from payments.views import Checkout
+from reservations.models import Reservation, Room
+from utils.support import ReservationStripePaymentCreator
+from utils.supportdb import init_pool_worker
+from utils.supportmodels import ReserveErrorMessages
+from utils.supportviews import CheckoutMessages
+
+FAKE_SESSION_URL = 'http://stripe.local/checkout'
+HOST = next((host for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost').lstrip('.')
+
+
+def _fake_session(self, **params) -> Session:
+    """session do stripe criada localmente, sem chamada de rede"""
+    return Session.construct_from(
+        {'id': f'cs_stress_{params["client_reference_id"]}', 'url': FAKE_SESSION_URL, 'expires_at': params['expires_at']},
+        'sk_stress',
+    )
+
+
+def checkout_attempt(reservation_pk: int) -> str:
+    """envia o checkout da reserva para a view `Checkout` e classifica o resultado
+    em ok, refused (quarto já ocupado), blocked (OperationalError) ou error"""
+    try:
+        reservation = Reservation.objects.select_related('client').get(pk=reservation_pk)
+        request = RequestFactory().post(reverse('checkout', args=(reservation_pk,)), HTTP_HOST=HOST)
+        request.user = reservation.client
+        request._messages = CookieStorage(request)
+        response = Checkout.as_view()(request, reservation_pk=reservation_pk)
+    finally:
+        connections.close_all()
+
+    if response.url == FAKE_SESSION_URL:
+        return 'ok'
+    outcome = {
+        ReserveErrorMessages.UNAVAILABLE_ROOM: 'refused',
+        CheckoutMessages.TRANSACTION_BLOCKING: 'blocked',
+    }
+    messages = [msg.message for msg in get_messages(request)]
+    return outcome.get(messages[0], 'error') if messages else 'error'
+
+
+def run_threads(reservation_pks: list[int], threads: int) -> list[str]:
+    """executa os checkouts em um pool de threads do processo atual. A session
+    do stripe é substituída uma única vez para todas as threads"""
+    with patch.object(ReservationStripePaymentCreator, '_create_session', _fake_session), \
+            ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(checkout_attempt, reservation_pks))
+
+
+class Command(BaseCommand):
+    help = (
+        'dispara checkouts concorrentes para o mesmo quarto, em threads e processos, '
+        'e mostra a vazão, as tentativas recusadas ou com falha e se houve reserva dupla. '
+        'As reservas criadas são removidas ao final.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room', type=int, default=1, help='id do quarto disputado')
+        parser.add_argument('--client', type=int, default=1, help='id do cliente das reservas')
+        parser.add_argument('--attempts', type=int, default=64, help='quantidade de checkouts')
+        parser.add_argument('--threads', type=int, default=8, help='threads por processo')
+        parser.add_argument('--processes', type=int, default=0, help='processos, 0 usa apenas threads')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        try:
+            room = Room.objects.get(pk=options['room'])
+            client = Client.objects.get(pk=options['client'])
+        except (Room.DoesNotExist, Client.DoesNotExist) as exc:
+            raise CommandError(str(exc)) from exc
+
+        was_available = room.available
+        Room.objects.filter(pk=room.pk).update(available=True)
+        checkin = now().date() + timedelta(days=365)
+        pks = [
+            Reservation.objects.create(
+                checkin=checkin, checkout=checkin + timedelta(days=1),
+                client=client, room=room, amount=room.daily_price,
+            ).pk
+            for _ in range(options['attempts'])
+        ]
+
+        try:
+            started = time.perf_counter()
+            outcomes = self._run(pks, options['threads'], options['processes'])
+            elapsed = time.perf_counter() - started
+
+            counts = Counter(outcomes)
+            paid = Payment.objects.filter(reservation__in=pks).count()
+            self.stdout.write(
+                f'{len(outcomes)} checkouts in {elapsed:.2f}s ({len(outcomes) / elapsed:.1f} checkouts/s): '
+                f'{counts["ok"]} succeeded, {counts["refused"]} refused, '
+                f'{counts["blocked"]} blocked, {counts["error"]} failed, '
+                f'{max(paid - 1, 0)} double bookings'
+            )
+        finally:
+            Reservation.objects.filter(pk__in=pks).delete()
+            Room.objects.filter(pk=room.pk).update(available=was_available)
+
+    def _run(self, pks: list[int], threads: int, processes: int) -> list[str]:
+        if processes <= 0:
+            return run_threads(pks, threads)
+
+        shares = [pks[i::processes] for i in range(processes)]
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=processes, initializer=init_pool_worker) as executor:
+            results = executor.map(run_threads, shares, [threads] * processes)
+            return [outcome for result in results for outcome in result]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='session_expires_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Expiração da sessão do stripe'),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='session_id',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Sessão do stripe'),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='session_url',
+            field=models.URLField(blank=True, default='', max_length=1000, verbose_name='Url da sessão do stripe'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_payment_stripe_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True, verbose_name='Evento')),
+                ('type', models.CharField(max_length=100, verbose_name='Tipo')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='Recebido em')),
+            ],
+            options={
+                'verbose_name': 'Evento do stripe',
+                'verbose_name_plural': 'Eventos do stripe',
+            },
+        ),
+    ]
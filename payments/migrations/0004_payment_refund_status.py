@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_stripeevent'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('F', 'finalizado'), ('C', 'cancelado'), ('P', 'pendente'), ('PR', 'processando'), ('R', 'reembolso')], default='P', max_length=2, verbose_name='Status'),
+        ),
+    ]
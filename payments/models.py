@@ -15,7 +15,8 @@ class Payment(models.Model):
         ('F', 'finalizado'),
         ('C', 'cancelado'),
         ('P', 'pendente'),
-        ('PR', 'processando')
+        ('PR', 'processando'),
+        ('R', 'reembolso'),
     )
     status = models.CharField(
         'Status',
@@ -35,6 +36,23 @@ class Payment(models.Model):
         related_query_name='payment_reservation',
         verbose_name='Reserva'
     )
+    session_id = models.CharField(
+        'Sessão do stripe',
+        max_length=255,
+        blank=True,
+        default='',
+    )
+    session_url = models.URLField(
+        'Url da sessão do stripe',
+        max_length=1000,
+        blank=True,
+        default='',
+    )
+    session_expires_at = models.DateTimeField(
+        'Expiração da sessão do stripe',
+        blank=True,
+        null=True,
+    )
     
     def __str__(self) -> str:
         return f'{self.__class__.__name__} {self.pk}'
@@ -52,3 +70,28 @@ class Payment(models.Model):
     class Meta:
         verbose_name = 'Pagamento'
         verbose_name_plural = 'Pagamentos'
+
+
+class StripeEvent(models.Model):
+    """registra os eventos do stripe já processados pelo webhook, garantindo
+    que reenvios do mesmo evento não sejam aplicados novamente"""
+    event_id = models.CharField(
+        'Evento',
+        max_length=255,
+        unique=True,
+    )
+    type = models.CharField(
+        'Tipo',
+        max_length=100,
+    )
+    received_at = models.DateTimeField(
+        'Recebido em',
+        auto_now_add=True,
+    )
+
+    def __str__(self) -> str:
+        return f'{self.__class__.__name__} {self.event_id}'
+
+    class Meta:
+        verbose_name = 'Evento do stripe'
+        verbose_name_plural = 'Eventos do stripe'
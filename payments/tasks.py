@@ -1,16 +1,202 @@
+import logging
+import stripe
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from payments.models import Payment
+from reservations.models import Reservation, Room, RoomPopularity
+from schedules.models import Scheduling
 from utils.support import PaymentPDFHandler
+from utils.supporttasks import enqueue_task
 
 
-def create_payment_pdf(payment) -> bool:
+def create_payment_pdf(payment_pk: int) -> bool:
     """generate a PDf file with the payment data and sent by email
     to the user
     
     Args:
-        payment (Payment): instance of the model Payment.
+        payment_pk (int): primary key of the model Payment.
     
     Returns:
         bool: returns True if the email was sent correctly
     """
+    try:
+        payment = Payment.objects.select_related(
+            'reservation__client', 'reservation__room__room_class'
+        ).get(pk=payment_pk)
+    except Payment.DoesNotExist:
+        logging.getLogger('djangoLogger').error('payment %s does not exists', payment_pk)
+        return False
+
     pdf_handler = PaymentPDFHandler(payment)
     log = pdf_handler.handle()
     return True if log else False
+
+
+def _session_payment(session_id: str, reservation_pk=None) -> Payment | None:
+    """retorna o pagamento da session do stripe, pelo id da session guardado
+    no pagamento ou pela reserva enviada como client_reference_id"""
+    payment = Payment.objects.filter(session_id=session_id).first()
+    if payment is None and reservation_pk:
+        payment = Payment.objects.filter(reservation__pk=reservation_pk).first()
+    return payment
+
+
+def confirm_checkout_session(session) -> bool:
+    """finaliza o pagamento da session paga do stripe, ativa a reserva ou a
+    marca como agendada e enfileira o envio do comprovante. As atualizações
+    são condicionais ao status atual, então eventos repetidos não alteram
+    pagamentos já finalizados.
+
+    Sessions ainda não pagas, como as de pagamentos assíncronos, são
+    ignoradas até o evento `checkout.session.async_payment_succeeded`. Um
+    pagamento cancelado enquanto o cliente pagava, por exemplo por
+    `release_expired_holds`, é restabelecido caso o quarto continue livre.
+    Quando o quarto ou as noites já foram ocupados por outra reserva o
+    pagamento é marcado para reembolso em vez de confirmado.
+
+    Args:
+        session (dict): objeto checkout.session do evento do stripe
+
+    Returns:
+        bool: True se o pagamento foi finalizado por esta chamada
+    """
+    logger = logging.getLogger('djangoLogger')
+    session_id = session['id']
+    if session.get('payment_status') != 'paid':
+        logger.info('stripe session %s is %s, waiting for the payment', session_id, session.get('payment_status'))
+        return False
+
+    payment = _session_payment(session_id, session.get('client_reference_id'))
+    if payment is None:
+        logger.error('no payment found for stripe session %s', session_id)
+        return False
+
+    try:
+        with transaction.atomic():
+            if not _finalize_payment(payment):
+                logger.info('payment %s of stripe session %s already finalized', payment.pk, session_id)
+                return False
+    except IntegrityError as exc:
+        _refund_conflicting_payment(payment, session.get('payment_intent'), exc)
+        return False
+
+    task_name = f'create_payment_pdf_{payment.pk}'
+    transaction.on_commit(
+        lambda: enqueue_task('payments.tasks.create_payment_pdf', payment.pk, task_name=task_name)
+    )
+    logger.info('payment %s finalized by stripe session %s', payment.pk, session_id)
+    return True
+
+
+def _finalize_payment(payment: Payment) -> bool:
+    """finaliza o pagamento pendente, ou o cancelado que foi pago, e confirma
+    a reserva ocupando suas noites.
+
+    Raises:
+        IntegrityError: caso o quarto ou as noites da reserva já estejam
+        ocupados por outra reserva
+
+    Returns:
+        bool: False caso o pagamento já estivesse finalizado
+    """
+    reinstated = False
+    if not Payment.objects.filter(pk=payment.pk, status='P').update(status='F'):
+        if not Payment.objects.filter(pk=payment.pk, status='C').update(status='F'):
+            return False
+        reinstated = True
+
+    reservation = Reservation.objects.get(pk=payment.reservation_id)
+    scheduled = Scheduling.objects.filter(reservation_id=reservation.pk).exists()
+    if reinstated and not scheduled:
+        # o quarto foi liberado quando o pagamento foi cancelado
+        if not Room.objects.filter(pk=reservation.room_id, available=True).update(available=False):
+            raise IntegrityError(f'room {reservation.room_id} was taken by another reservation')
+
+    fields = {'status': 'S'} if scheduled else {'status': 'A', 'active': True}
+    statuses = ['I', 'P', 'C'] if reinstated else ['I', 'P']
+    confirmed = Reservation.objects.filter(pk=reservation.pk, status__in=statuses).update(**fields)
+    if confirmed:
+        for field, value in fields.items():
+            setattr(reservation, field, value)
+        RoomPopularity.record(reservation.room_id, 1, reservation.created_at)
+    reservation.sync_nights()
+    if reinstated:
+        logging.getLogger('djangoLogger').warning(
+            'canceled payment %s was paid, reservation %s reinstated', payment.pk, reservation.pk
+        )
+    return True
+
+
+def _refund_conflicting_payment(payment: Payment, payment_intent: str | None, error: Exception) -> None:
+    """marca para reembolso o pagamento cuja reserva não pode ser confirmada,
+    cancela a reserva e enfileira o reembolso pelo stripe após o commit"""
+    logger = logging.getLogger('djangoLogger')
+    with transaction.atomic():
+        Payment.objects.filter(pk=payment.pk, status__in=['P', 'C']).update(status='R')
+        Reservation.objects.filter(pk=payment.reservation_id).update(status='C', active=False)
+        room_claimed = Reservation.objects.filter(
+            room=OuterRef('pk'), status__in=['A', 'P']
+        ).exclude(pk=payment.reservation_id)
+        Room.objects.filter(
+            reservation_room=payment.reservation_id, available=False
+        ).exclude(Exists(room_claimed)).update(available=True)
+
+    if not payment_intent:
+        logger.critical('payment %s must be refunded but its stripe session has no payment intent', payment.pk)
+        return
+
+    logger.error('payment %s conflicts with another reservation, refunding: %s', payment.pk, error)
+    task_name = f'refund_payment_{payment.pk}'
+    transaction.on_commit(
+        lambda: enqueue_task('payments.tasks.refund_payment', payment.pk, payment_intent, task_name=task_name)
+    )
+
+
+def refund_payment(payment_pk: int, payment_intent: str) -> bool:
+    """reembolsa pelo stripe o pagamento marcado para reembolso. A chave de
+    idempotência evita reembolsos em dobro caso a task seja executada
+    novamente.
+
+    Returns:
+        bool: True se o reembolso foi criado
+    """
+    logger = logging.getLogger('djangoLogger')
+    if not Payment.objects.filter(pk=payment_pk, status='R').exists():
+        logger.error('payment %s is not marked for refund', payment_pk)
+        return False
+
+    refund = stripe.Refund.create(payment_intent=payment_intent, idempotency_key=f'refund_payment_{payment_pk}')
+    logger.info('payment %s refunded by stripe refund %s', payment_pk, refund.id)
+    return True
+
+
+def expire_checkout_session(session) -> bool:
+    """cancela o pagamento pendente e a reserva da session expirada, ou cujo
+    pagamento assíncrono falhou, e libera o quarto caso ele não esteja
+    ocupado por uma reserva ativa.
+
+    Args:
+        session (dict): objeto checkout.session do evento do stripe
+
+    Returns:
+        bool: True se o pagamento foi cancelado por esta chamada
+    """
+    logger = logging.getLogger('djangoLogger')
+    session_id = session['id']
+    payment = _session_payment(session_id, session.get('client_reference_id'))
+    if payment is None:
+        logger.error('no payment found for stripe session %s', session_id)
+        return False
+
+    with transaction.atomic():
+        if not Payment.objects.filter(pk=payment.pk, status='P').update(status='C'):
+            return False
+
+        Reservation.objects.filter(pk=payment.reservation_id, status__in=['I', 'P']).update(status='C')
+        room_occupied = Reservation.objects.filter(room=OuterRef('pk'), status='A')
+        Room.objects.filter(
+            reservation_room=payment.reservation_id, available=False
+        ).exclude(Exists(room_occupied)).update(available=True)
+
+    logger.info('payment %s canceled by expired stripe session %s', payment.pk, session_id)
+    return True
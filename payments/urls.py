@@ -1,8 +1,10 @@
 from django.urls import path
-from .views import Checkout , payment_success, payment_cancel
+from .views import Checkout , payment_success, payment_cancel, payment_receipt, stripe_webhook
 
 urlpatterns = [
     path("<int:reservation_pk>/", Checkout.as_view(), name="checkout"),
     path("success/<int:reservation_pk>/", payment_success, name="payment_success"),
     path("cancel/<int:reservation_pk>/", payment_cancel, name="payment_cancel"),
+    path("receipt/<int:reservation_pk>/", payment_receipt, name="payment_receipt"),
+    path("webhook/stripe/", stripe_webhook, name="stripe_webhook"),
 ]
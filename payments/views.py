@@ -1,20 +1,25 @@
 import logging
+import os
+from datetime import datetime, timezone
 
 from django.core.exceptions import PermissionDenied
-from django.views.decorators.http import require_GET
-from django.http import HttpRequest
-from django.http.response import HttpResponse
+from django.views.decorators.http import require_GET, require_POST, condition
+from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
+import stripe
+from django.http import HttpRequest, Http404
+from django.http.response import HttpResponse, FileResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse, reverse_lazy
 from django.views import View
-from reservations.models import Reservation
+from reservations.models import Reservation, Room
 from utils.supportviews import CheckoutMessages, PaymentCancelMessages
+from utils.supportmodels import ReserveErrorMessages
 from django.contrib import messages
-from .models import Payment
+from .models import Payment, StripeEvent
+from .tasks import confirm_checkout_session, expire_checkout_session
 from django.db import transaction, OperationalError
-from .tasks import create_payment_pdf
-from utils.support import ReservationStripePaymentCreator
-from django_q.tasks import async_task, Task
+from utils.support import ReservationStripePaymentCreator, ReceiptStore
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from reservations.decorators import check_reservation_ownership
@@ -32,11 +37,13 @@ class Checkout(LoginRequiredMixin, View):
 
     def get(self, request: HttpRequest, reservation_pk: int, *args, **kwargs):
         reservation = get_object_or_404(Reservation, pk__exact=reservation_pk)
-        self.logger.debug(f"rendering {self.template}")
+        self.logger.debug("rendering %s", self.template)
         return render(request, self.template, {"reservation": reservation})
 
-    @transaction.atomic
     def post(self, request: HttpRequest, reservation_pk: int, *args, **kwargs):
+        """ocupa o quarto com um UPDATE condicional, cria o pagamento com a
+        sessão do stripe e redireciona para a página hospedada do stripe. Se
+        outro checkout já ocupou o quarto o cliente é avisado sem criar sessão"""
         try:
             reservation = get_object_or_404(Reservation, pk=reservation_pk)
             reservation_payment = ReservationStripePaymentCreator(
@@ -46,43 +53,86 @@ class Checkout(LoginRequiredMixin, View):
                 cancel_url_name='payment_cancel'
             )
 
-            self.logger.debug(f"success callback url: {reservation_payment.success_url}")
-            self.logger.debug(f"cancel callback url: {reservation_payment.cancel_url}")
+            self.logger.debug("success callback url: %s", reservation_payment.success_url)
+            self.logger.debug("cancel callback url: %s", reservation_payment.cancel_url)
+            if reservation_payment.reused:
+                self.logger.info('reusing stripe session for reservation %s', reservation.pk)
+                return redirect(reservation_payment.session.url)
 
-            reservation._validate_room()
+            claimed = self._claim_room(reservation)
+            if claimed is None:
+                self.logger.info('reservation %s is no longer started, checkout refused', reservation.pk)
+                messages.error(request, CheckoutMessages.EXPIRED_RESERVATION)
+                return redirect(reverse("rooms"))
 
-            reservation.room.available = False
-            reservation.status = "P"
+            if not claimed:
+                self.logger.info('room %s already taken, reservation %s refused', reservation.room_id, reservation.pk)
+                messages.error(request, ReserveErrorMessages.UNAVAILABLE_ROOM)
+                redirect_url = request.META.get("HTTP_REFERER", reverse("rooms"))
+                return redirect(redirect_url)
 
-            payment = Payment(
-                reservation=reservation, amount=reservation.amount, status="P"
-            )
-            payment.full_clean()
+            try:
+                session = reservation_payment.session
+                payment = reservation_payment.bind(
+                    Payment(reservation=reservation, amount=reservation.amount, status="P")
+                )
+                payment.full_clean()
+                payment.save()
+            except Exception:
+                self._release_room(reservation)
+                raise
 
-            reservation.room.save()
-            reservation.save()
-            payment.save()
-            self.logger.info(f'payment {payment.pk} created for reservation {reservation.pk}')
-            self.logger.debug(f'stripe payment session url: {reservation_payment.session.url}')
-            return redirect(reservation_payment.session.url)
+            self.logger.info('payment %s created for reservation %s', payment.pk, reservation.pk)
+            self.logger.debug('stripe payment session url: %s', session.url)
+            return redirect(session.url)
 
         except OperationalError as exc:
+            # lock não obtido em DB_LOCK_TIMEOUT: "database is locked" no sqlite,
+            # lock_timeout ou deadlock no postgresql
             messages.info(request, CheckoutMessages.TRANSACTION_BLOCKING)
-            self.logger.critical(f"payment transaction fail: {str(exc)}")
+            self.logger.critical("payment transaction fail: %s", exc)
             redirect_url = request.META.get("HTTP_REFERER", reverse("rooms"))
             return redirect(redirect_url)
 
         except Exception as exc:
             messages.error(request, CheckoutMessages.PAYMENT_FAIL)
-            self.logger.critical(f"payment unexpected fail: {str(exc)}")
+            self.logger.critical("payment unexpected fail: %s", exc)
             redirect_url = request.META.get("HTTP_REFERER", reverse("rooms"))
             return redirect(redirect_url)
 
+    @staticmethod
+    @transaction.atomic
+    def _claim_room(reservation: Reservation) -> bool | None:
+        """passa a reserva de iniciada para processando e marca o quarto como
+        indisponível, cada um com um único UPDATE condicional na mesma
+        transação. Retorna None caso a reserva não esteja mais iniciada, por
+        exemplo cancelada por `release_expired_holds`, e False caso o quarto
+        já esteja indisponível, desfazendo a mudança da reserva sem bloquear
+        outros checkouts. No postgresql o UPDATE trava a linha do quarto: um
+        checkout concorrente aguarda o commit e não encontra mais o quarto
+        disponível"""
+        if not Reservation.objects.filter(pk=reservation.pk, status='I').update(status='P'):
+            return None
+
+        claimed = Room.objects.filter(
+            pk=reservation.room_id, available=True
+        ).update(available=False)
+        if not claimed:
+            transaction.set_rollback(True)
+        return bool(claimed)
+
+    @staticmethod
+    @transaction.atomic
+    def _release_room(reservation: Reservation) -> None:
+        """desfaz `_claim_room` quando o pagamento não pode ser criado"""
+        Room.objects.filter(pk=reservation.room_id).update(available=True)
+        Reservation.objects.filter(pk=reservation.pk, status='P').update(status='I')
+
     def dispatch(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
         reservation = get_object_or_404(Reservation, pk=kwargs.get("reservation_pk"))
         if request.user.is_authenticated and reservation.client != request.user:
-            self.logger.warn(
-                f'permission denied for user {request.user.pk} to access reservation {reservation.pk}'
+            self.logger.warning(
+                'permission denied for user %s to access reservation %s', request.user.pk, reservation.pk
             )
             raise PermissionDenied
         return super().dispatch(request, *args, **kwargs)
@@ -92,27 +142,57 @@ class Checkout(LoginRequiredMixin, View):
 @login_required(login_url=reverse_lazy("signin"))
 @check_reservation_ownership
 def payment_success(request: HttpRequest, reservation_pk: int):
-    """renderiza a página de sucesso do pagamento, finaliza e ativa a reserva,
-    e cria um task que envia os dados de pagamento por email para o cliente"""    
+    """renderiza a página de sucesso do pagamento. O pagamento é finalizado,
+    a reserva ativada e o comprovante enviado por email pelo webhook do stripe"""
     logger = logging.getLogger("djangoLogger")
-    logger.info(f"reserva {reservation_pk} recebida para sucesso de pagamento")
+    payment = get_object_or_404(
+        Payment.objects.select_related('reservation__client', 'reservation__room__room_class'),
+        reservation__pk=reservation_pk,
+    )
+    logger.debug("rendering success page for payment: %s", payment.pk)
+    return render(request, "success.html", {"payment": payment})
 
-    payment = get_object_or_404(Payment, reservation__pk=reservation_pk)
-    if payment.status == "P":
-        payment.reservation.status = "A"
-        payment.reservation.active = True
-        payment.reservation.save()
 
-        payment.status = "F"
-        payment.save()
+@csrf_exempt
+@require_POST
+def stripe_webhook(request: HttpRequest):
+    """recebe os eventos de checkout do stripe, valida a assinatura e aplica
+    cada evento uma única vez, registrando-o em `StripeEvent` na mesma
+    transação das atualizações do pagamento"""
+    logger = logging.getLogger("djangoLogger")
+    try:
+        event = stripe.Webhook.construct_event(
+            request.body,
+            request.META.get('HTTP_STRIPE_SIGNATURE', ''),
+            settings.STRIPE_WEBHOOK_SECRET,
+        )
+    except (ValueError, stripe.SignatureVerificationError) as exc:
+        logger.warning('invalid stripe webhook: %s', exc)
+        return HttpResponse(status=400)
 
-    task_name = f"create_payment_pdf_{payment.pk}"
-    if not Task.objects.filter(name=task_name).exists():
-        logger.info(f'task {task_name} created')
-        async_task(create_payment_pdf, payment, task_name=task_name)
+    handler = STRIPE_EVENT_HANDLERS.get(event['type'])
+    if handler is None:
+        return HttpResponse(status=200)
 
-    logger.debug(f"rendering success page for payment: {payment.pk}")
-    return render(request, "success.html", {"payment": payment})
+    session = event['data']['object']
+    with transaction.atomic():
+        _, created = StripeEvent.objects.get_or_create(
+            event_id=event['id'], defaults={'type': event['type']}
+        )
+        if not created:
+            logger.info('stripe event %s already processed', event["id"])
+            return HttpResponse(status=200)
+        handler(session)
+
+    return HttpResponse(status=200)
+
+
+STRIPE_EVENT_HANDLERS = {
+    'checkout.session.completed': confirm_checkout_session,
+    'checkout.session.async_payment_succeeded': confirm_checkout_session,
+    'checkout.session.expired': expire_checkout_session,
+    'checkout.session.async_payment_failed': expire_checkout_session,
+}
 
 
 @require_GET
@@ -122,26 +202,68 @@ def payment_cancel(request: HttpRequest, reservation_pk: int):
     """renderia a página de cancelamento do pagamento, coloca o status
     do pagamento para cancelado e libera o quarto"""
     logger = logging.getLogger("djangoLogger")
-    logger.info(f"reservation {reservation_pk} received to cancel")
+    logger.info("reservation %s received to cancel", reservation_pk)
     try:
         payment = get_object_or_404(Payment, reservation__pk=reservation_pk)
         if payment.status != "C":
             payment.reservation.status = "C"
             payment.reservation.active = False
             payment.reservation.room.available = True
-            payment.reservation.room.save()
+            payment.reservation.room.save(update_fields=['available'])
             payment.reservation.save()
             payment.reservation.save()
 
             payment.status = "C"
             payment.save()
-            logger.info(f"payment {payment.pk} for {payment.reservation.pk} successfully canceled")
+            logger.info("payment %s for %s successfully canceled", payment.pk, payment.reservation_id)
     
     except Exception as exc:
         logger.critical(
-            f"unexpected error reverting reservation {reservation_pk}: {str(exc)}"
+            "unexpected error reverting reservation %s: %s", reservation_pk, exc
         )
         messages.error(request, PaymentCancelMessages.UNEXPECTED_ERROR)
         return redirect('rooms')
 
     return render(request, "cancel.html")
+
+
+def _finalized_receipt(request: HttpRequest, reservation_pk: int) -> tuple[Payment | None, os.stat_result | None]:
+    """retorna o pagamento finalizado da reserva, com os dados usados no
+    comprovante, e o stat do comprovante armazenado. O resultado é guardado
+    na requisição, consultado uma única vez pelo ETag, pelo Last-Modified e
+    pela view"""
+    if not hasattr(request, '_finalized_receipt'):
+        payment = Payment.objects.select_related(
+            'reservation__client', 'reservation__room__room_class'
+        ).filter(reservation__pk=reservation_pk, status='F').first()
+        stat = ReceiptStore().stat(payment) if payment is not None else None
+        request._finalized_receipt = (payment, stat)
+    return request._finalized_receipt
+
+
+def _receipt_etag(request: HttpRequest, reservation_pk: int) -> str | None:
+    payment, stat = _finalized_receipt(request, reservation_pk)
+    return ReceiptStore.etag(payment, stat) if payment is not None else None
+
+
+def _receipt_last_modified(request: HttpRequest, reservation_pk: int) -> datetime | None:
+    _, stat = _finalized_receipt(request, reservation_pk)
+    return datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc) if stat is not None else None
+
+
+@require_GET
+@login_required(login_url=reverse_lazy("signin"))
+@check_reservation_ownership
+@condition(etag_func=_receipt_etag, last_modified_func=_receipt_last_modified)
+def payment_receipt(request: HttpRequest, reservation_pk: int):
+    """envia o pdf do comprovante de pagamento armazenado da reserva,
+    respondendo 304 quando o cliente já possui a versão atual"""
+    payment, _ = _finalized_receipt(request, reservation_pk)
+    if payment is None:
+        raise Http404
+
+    return FileResponse(
+        ReceiptStore().open(payment),
+        content_type='application/pdf',
+        filename=f'comprovante_de_pagamento_{payment.pk}.pdf',
+    )
@@ -31,6 +31,7 @@ class RoomAdmin(admin.ModelAdmin):
     ]
     list_filter = ['hotel']
     list_editable = ['available']
+    list_select_related = ['room_class']
 
 
 @admin.display(description='Status')
@@ -46,6 +47,7 @@ class ReservationAdmin(admin.ModelAdmin):
         'active',
         status,
     ]
+    list_select_related = ['client', 'room__room_class']
     
 admin.site.register(Benefit, BenefitAdmin)
 admin.site.register(Class, ClassAdmin)
@@ -7,6 +7,7 @@ class ReservationsConfig(AppConfig):
 
     def ready(self) -> None:
         from django_q.models import Schedule
+        from . import signals  # noqa: F401
 
         if not Schedule.objects.filter(name='checar finalização das reservas').exists():
             Schedule.objects.create(
@@ -14,3 +15,18 @@ class ReservationsConfig(AppConfig):
                 schedule_type=Schedule.DAILY,
                 name='checar finalização das reservas',
             )
+
+        if not Schedule.objects.filter(name='liberar reservas expiradas').exists():
+            Schedule.objects.create(
+                func='reservations.tasks.release_expired_holds',
+                schedule_type=Schedule.MINUTES,
+                minutes=5,
+                name='liberar reservas expiradas',
+            )
+
+        if not Schedule.objects.filter(name='recalcular popularidade dos quartos').exists():
+            Schedule.objects.create(
+                func='reservations.tasks.rebuild_room_popularity',
+                schedule_type=Schedule.DAILY,
+                name='recalcular popularidade dos quartos',
+            )
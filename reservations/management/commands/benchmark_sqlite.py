@@ -0,0 +1,111 @@
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from utils.supportdb import sqlite_pragma_statements
+
+
+def _connect(path: str, pragmas: dict) -> sqlite3.Connection:
+    """abre a conexão como o django faz, com timeout padrão, aplicando os pragmas"""
+    connection = sqlite3.connect(path, isolation_level=None)
+    for statement in sqlite_pragma_statements(pragmas):
+        connection.execute(statement)
+    return connection
+
+
+def _setup(path: str, rooms: int, pragmas: dict) -> None:
+    connection = _connect(path, pragmas)
+    connection.executescript('''
+        CREATE TABLE room (id INTEGER PRIMARY KEY, available BOOL NOT NULL);
+        CREATE TABLE booking (
+            id INTEGER PRIMARY KEY, room_id INTEGER NOT NULL, status TEXT NOT NULL
+        );
+    ''')
+    connection.executemany('INSERT INTO room (id, available) VALUES (?, 1)', ((i,) for i in range(rooms)))
+    connection.close()
+
+
+def book_rooms(path: str, pragmas: dict, room_ids: list[int]) -> tuple[int, int]:
+    """reserva cada quarto como o checkout faz: UPDATE condicional do quarto e
+    INSERT da reserva na mesma transação.
+
+    Returns:
+        tuple: reservas concluídas e falhas por "database is locked"
+    """
+    connection = _connect(path, pragmas)
+    done = locked = 0
+    for room_id in room_ids:
+        try:
+            connection.execute('BEGIN')
+            if connection.execute(
+                'UPDATE room SET available = 0 WHERE id = ? AND available = 1', (room_id,)
+            ).rowcount:
+                connection.execute("INSERT INTO booking (room_id, status) VALUES (?, 'P')", (room_id,))
+            connection.execute('COMMIT')
+            done += 1
+        except sqlite3.OperationalError:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            locked += 1
+    connection.close()
+    return done, locked
+
+
+def list_rooms(path: str, pragmas: dict, reads: int) -> tuple[int, int]:
+    """lê a listagem de quartos disponíveis como a página de quartos faz.
+
+    Returns:
+        tuple: leituras concluídas e falhas por "database is locked"
+    """
+    connection = _connect(path, pragmas)
+    done = locked = 0
+    for _ in range(reads):
+        try:
+            connection.execute('SELECT id FROM room WHERE available = 1 LIMIT 10').fetchall()
+            done += 1
+        except sqlite3.OperationalError:
+            locked += 1
+    connection.close()
+    return done, locked
+
+
+class Command(BaseCommand):
+    help = (
+        'compara a vazão de reservas concorrentes em um banco sqlite temporário '
+        'com a configuração padrão e com os pragmas de SQLITE_PRAGMAS'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4, help='processos fazendo reservas')
+        parser.add_argument('--readers', type=int, default=4, help='processos lendo a listagem de quartos')
+        parser.add_argument('--bookings', type=int, default=500, help='reservas por processo')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        for label, pragmas in (('default', {}), ('tuned', settings.SQLITE_PRAGMAS)):
+            self._benchmark(label, pragmas, options['writers'], options['readers'], options['bookings'])
+
+    def _benchmark(self, label: str, pragmas: dict, writers: int, readers: int, bookings: int) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = f'{tmp}/benchmark.sqlite3'
+            _setup(path, writers * bookings, pragmas)
+
+            with ProcessPoolExecutor(max_workers=writers + readers) as executor:
+                start = time.perf_counter()
+                booked = [
+                    executor.submit(book_rooms, path, pragmas, list(range(i, writers * bookings, writers)))
+                    for i in range(writers)
+                ]
+                listed = [executor.submit(list_rooms, path, pragmas, bookings) for _ in range(readers)]
+                booked = [future.result() for future in booked]
+                elapsed = time.perf_counter() - start
+                listed = [future.result() for future in listed]
+
+        done = sum(result[0] for result in booked)
+        locked = sum(result[1] for result in booked) + sum(result[1] for result in listed)
+        self.stdout.write(
+            f'{label}: {done} bookings in {elapsed:.2f}s ({done / elapsed:.1f} bookings/s), '
+            f'{locked} "database is locked" errors'
+        )
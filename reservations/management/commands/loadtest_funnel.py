@@ -0,0 +1,361 @@
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any
+from unittest.mock import patch
+import requests
+from django.contrib.auth.hashers import make_password
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.db import connections
+from django.db.models import Max
+from django.http import HttpRequest
+from django.urls import reverse
+from django.utils import timezone
+from stripe.checkout import Session
+from clients.models import Client
+from home.management.commands.generate_dataset import make_cpf
+from reservations.models import Reservation, Room
+from utils.support import CaptchaVerifier, ReservationStripePaymentCreator
+from utils.supportmodels import ReserveErrorMessages
+from utils.supportviews import CheckoutMessages, INVALID_RECAPTCHA_MESSAGE, ReserveMessages, SignInMessages
+
+STEPS = ('signin', 'rooms', 'reserve', 'checkout', 'success')
+PERCENTILES = (50, 95, 99)
+USERNAME_PREFIX = 'loadtest'
+CAPTCHA_TOKEN = 'loadtest-captcha'
+
+# mensagens exibidas pelas views e o motivo reportado para cada uma
+KNOWN_MESSAGES = {
+    ReserveErrorMessages.UNAVAILABLE_ROOM: 'room unavailable',
+    CheckoutMessages.TRANSACTION_BLOCKING: 'blocked',
+    CheckoutMessages.PAYMENT_FAIL: 'payment fail',
+    ReserveMessages.RESERVATION_FAIL: 'reservation fail',
+    INVALID_RECAPTCHA_MESSAGE: 'captcha refused',
+    SignInMessages.INVALID_CREDENTIALS: 'invalid credentials',
+}
+
+
+def _fake_verify(self, captcha_resp, session=None) -> bool:
+    """captcha local: aceita qualquer resposta preenchida sem chamar o google"""
+    return bool(captcha_resp)
+
+
+def _fake_session(self, **params) -> Session:
+    """session do stripe criada localmente que redireciona direto para a
+    página de sucesso, como após um pagamento aprovado"""
+    return Session.construct_from(
+        {'id': f'cs_load_{params["client_reference_id"]}', 'url': params['success_url'], 'expires_at': params['expires_at']},
+        'sk_load',
+    )
+
+
+def percentile(values: list[float], p: float) -> float:
+    """percentil pelo método nearest-rank, 0 para uma lista vazia"""
+    if not values:
+        return 0.
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+class BoundedWSGIServer(ThreadedWSGIServer):
+    """servidor wsgi com uma thread por conexão que atende no máximo `workers`
+    requisições ao mesmo tempo, como um pool de workers. As demais aguardam"""
+    def __init__(self, *args: Any, workers: int, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.workers = threading.BoundedSemaphore(workers)
+
+    def process_request_thread(self, request, client_address) -> None:
+        with self.workers:
+            try:
+                super().process_request_thread(request, client_address)
+            finally:
+                connections.close_all()
+
+
+class ServerErrors(logging.Handler):
+    """conta os registros de erro do servidor pela primeira linha da mensagem,
+    por exemplo `database is locked`"""
+    def __init__(self) -> None:
+        super().__init__(logging.ERROR)
+        self.counts = Counter()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        message = record.getMessage().splitlines()[0] if record.getMessage() else record.levelname
+        self.counts[message[:120]] += 1
+
+
+class Results:
+    """latências e erros de cada etapa do funil, compartilhados pelas threads"""
+    def __init__(self) -> None:
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self.funnels = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, step: str, ms: float, error: str | None = None) -> None:
+        with self._lock:
+            self.latencies[step].append(ms)
+            if error is not None:
+                self.errors[step][error] += 1
+
+    def finish(self, outcome: str) -> None:
+        with self._lock:
+            self.funnels[outcome] += 1
+
+    def summary(self, elapsed: float) -> dict:
+        requests_count = sum(len(values) for values in self.latencies.values())
+        steps = {}
+        for step in STEPS:
+            values = self.latencies.get(step, [])
+            errors = sum(self.errors[step].values())
+            steps[step] = {
+                'requests': len(values),
+                'errors': errors,
+                'error_rate': errors / len(values) if values else 0.,
+                **{f'p{p}': round(percentile(values, p), 1) for p in PERCENTILES},
+                'error_reasons': dict(self.errors[step]),
+            }
+        return {
+            'elapsed': round(elapsed, 2),
+            'funnels': dict(self.funnels),
+            'funnels_per_second': round(self.funnels['ok'] / elapsed, 2) if elapsed else 0.,
+            'requests_per_second': round(requests_count / elapsed, 2) if elapsed else 0.,
+            'steps': steps,
+        }
+
+
+class VirtualUser:
+    """cliente http com sessão própria que percorre o funil de reserva:
+    login, listagem de quartos, reserva, checkout e página de sucesso"""
+    def __init__(self, base_url: str, username: str, password: str, rooms: list[int],
+                 results: Results, rng: random.Random, timeout: float) -> None:
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.rooms = rooms
+        self.results = results
+        self.rng = rng
+        self.timeout = timeout
+
+    def run(self, iterations: int) -> None:
+        for _ in range(iterations):
+            room_pk = self.rng.choice(self.rooms)
+            with requests.Session() as http:
+                outcome = self.funnel(http, room_pk)
+            self.results.finish(outcome)
+            # libera o quarto para as próximas iterações, como ao fim da estadia
+            Room.objects.filter(pk=room_pk).update(available=True)
+            connections.close_all()
+
+    def funnel(self, http: requests.Session, room_pk: int) -> str:
+        """percorre o funil e retorna `ok` ou a etapa em que parou"""
+        started = time.perf_counter()
+        response = self.step(http, 'signin', 'get', reverse('signin'), expected=200, record=False)
+        if response is None:
+            return 'signin'
+        response = self.step(http, 'signin', 'post', reverse('signin'), data={
+            'username': self.username, 'password': self.password,
+        }, expected=re.escape(reverse('rooms')), started=started)
+        if response is None:
+            return 'signin'
+
+        if self.step(http, 'rooms', 'get', reverse('rooms'), expected=200) is None:
+            return 'rooms'
+
+        checkin = timezone.now().date() + timedelta(days=self.rng.randint(1, 60))
+        response = self.step(http, 'reserve', 'post', reverse('reserve', args=(room_pk,)), data={
+            'checkin': str(checkin),
+            'checkout': str(checkin + timedelta(days=self.rng.randint(1, 3))),
+            'obs': '',
+        }, expected=re.escape(reverse('checkout', args=(0,))).replace('/0/', r'/\d+/'))
+        if response is None:
+            return 'reserve'
+
+        checkout_url = response.headers['Location']
+        reservation_pk = int(re.findall(r'\d+', checkout_url)[-1])
+        success_url = reverse('payment_success', args=(reservation_pk,))
+        response = self.step(http, 'checkout', 'post', checkout_url, expected=re.escape(success_url))
+        if response is None:
+            return 'checkout'
+
+        if self.step(http, 'success', 'get', success_url, expected=200) is None:
+            return 'success'
+        return 'ok'
+
+    def step(self, http: requests.Session, name: str, method: str, path: str, data: dict | None = None,
+             expected: int | str = 200, record: bool = True, started: float | None = None):
+        """executa uma requisição da etapa e registra a latência desde `started`,
+        ou desde o envio. `expected` é o status esperado ou um regex da url de
+        redirecionamento. Retorna a resposta ou None em caso de erro"""
+        url = path if path.startswith('http') else self.base_url + path
+        if method == 'post':
+            data = {**(data or {}), 'csrfmiddlewaretoken': http.cookies.get('csrftoken', ''), 'g-recaptcha-response': CAPTCHA_TOKEN}
+
+        start = time.perf_counter()
+        try:
+            response = http.request(method, url, data=data, timeout=self.timeout, allow_redirects=False)
+            error = self.classify(response, expected)
+        except requests.Timeout:
+            response, error = None, 'timeout'
+        except requests.RequestException:
+            response, error = None, 'connection error'
+        elapsed = (time.perf_counter() - (started or start)) * 1000
+
+        if record:
+            self.results.record(name, elapsed, error)
+        return None if error is not None else response
+
+    @staticmethod
+    def classify(response: requests.Response, expected: int | str) -> str | None:
+        """None se a resposta é a esperada, senão o motivo do erro pela
+        mensagem exibida ao usuário ou pelo status http"""
+        if isinstance(expected, int):
+            if response.status_code == expected:
+                return None
+        elif response.is_redirect and re.search(f'{expected}$', response.headers['Location']):
+            return None
+
+        for message in VirtualUser.messages(response):
+            if message in KNOWN_MESSAGES:
+                return KNOWN_MESSAGES[message]
+        if response.status_code >= 500:
+            return f'http {response.status_code}'
+        if response.status_code == 200:
+            for message, reason in KNOWN_MESSAGES.items():
+                if message in response.text:
+                    return reason
+        return f'unexpected http {response.status_code}'
+
+    @staticmethod
+    def messages(response: requests.Response) -> list[str]:
+        """mensagens do django messages enviadas no cookie da resposta"""
+        value = response.cookies.get('messages')
+        if not value:
+            return []
+        decoded = CookieStorage(HttpRequest())._decode(value.strip('"').replace('\\054', ','))
+        return [message.message for message in decoded or []]
+
+
+class Command(BaseCommand):
+    help = (
+        'teste de carga do funil de reserva (login, quartos, reserva, checkout e sucesso) '
+        'com usuários virtuais concorrentes contra um servidor local iniciado pelo comando. '
+        'O captcha e o stripe são substituídos por stubs locais. Mostra a vazão, os '
+        'percentis de latência e a taxa de erros de cada etapa e os erros do servidor, '
+        'como `database is locked`. Os clientes e reservas criados são removidos ao final.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='usuários virtuais concorrentes')
+        parser.add_argument('--iterations', type=int, default=5, help='funis por usuário')
+        parser.add_argument('--workers', type=int, default=4, help='requisições atendidas ao mesmo tempo pelo servidor')
+        parser.add_argument('--rooms', type=int, default=0, help='quartos disputados, 0 usa todos os disponíveis')
+        parser.add_argument('--port', type=int, default=0, help='porta do servidor, 0 escolhe uma livre')
+        parser.add_argument('--timeout', type=float, default=30, help='timeout de cada requisição em segundos')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true', help='mostra o resultado em JSON')
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        rooms = Room.objects.filter(available=True).order_by('pk').values_list('pk', flat=True)
+        rooms = list(rooms[:options['rooms']] if options['rooms'] > 0 else rooms)
+        if not rooms:
+            raise CommandError('no available room to reserve')
+        if options['users'] < 1 or options['workers'] < 1:
+            raise CommandError('at least one user and one worker are required')
+
+        password = f'{USERNAME_PREFIX}@{options["seed"]}'
+        users = self._create_users(options['users'], password)
+        server = BoundedWSGIServer(('127.0.0.1', options['port']), QuietRequestHandler, workers=options['workers'])
+        server.set_app(get_internal_wsgi_application())
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_errors = ServerErrors()
+        loggers = [logging.getLogger(name) for name in ('djangoLogger', 'django.request')]
+        results = Results()
+        base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+        try:
+            with patch.object(CaptchaVerifier, 'verify', _fake_verify), \
+                    patch.object(ReservationStripePaymentCreator, '_create_session', _fake_session):
+                for logger in loggers:
+                    logger.addHandler(server_errors)
+                server_thread.start()
+
+                virtual_users = [
+                    VirtualUser(base_url, user.username, password, rooms, results,
+                                random.Random(options['seed'] * 10007 + i), options['timeout'])
+                    for i, user in enumerate(users)
+                ]
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=len(virtual_users)) as executor:
+                    list(executor.map(lambda user: user.run(options['iterations']), virtual_users))
+                elapsed = time.perf_counter() - started
+        finally:
+            server.shutdown()
+            server.server_close()
+            for logger in loggers:
+                logger.removeHandler(server_errors)
+            self._cleanup(users, rooms)
+
+        summary = results.summary(elapsed)
+        summary['server_errors'] = dict(server_errors.counts.most_common())
+        summary['config'] = {key: options[key] for key in ('users', 'iterations', 'workers', 'seed')}
+        summary['config']['rooms'] = len(rooms)
+        if options['json']:
+            self.stdout.write(json.dumps(summary))
+        else:
+            self._report(summary)
+
+    def _create_users(self, amount: int, password: str) -> list[Client]:
+        """clientes dos usuários virtuais, com a mesma senha"""
+        first = (Client.objects.aggregate(pk=Max('pk'))['pk'] or 0) + 1
+        hashed = make_password(password)
+        today = timezone.now().date()
+        return Client.objects.bulk_create(
+            Client(
+                pk=pk, username=f'{USERNAME_PREFIX}{pk}', password=hashed,
+                first_name='Load', last_name='Test', email=f'{USERNAME_PREFIX}{pk}@email.example.com',
+                phone=f'999{pk:08d}', cpf=make_cpf(pk), birthdate=today - timedelta(days=365 * 30),
+            )
+            for pk in range(first, first + amount)
+        )
+
+    def _cleanup(self, users: list[Client], rooms: list[int]) -> None:
+        Reservation.objects.filter(client__in=users).delete()
+        Client.objects.filter(pk__in=[user.pk for user in users]).delete()
+        Room.objects.filter(pk__in=rooms).update(available=True)
+
+    def _report(self, summary: dict) -> None:
+        config = summary['config']
+        funnels = summary['funnels']
+        self.stdout.write(
+            f'{config["users"]} users x {config["iterations"]} funnels, {config["workers"]} server workers, '
+            f'{config["rooms"]} rooms in {summary["elapsed"]}s: '
+            f'{funnels.get("ok", 0)}/{sum(funnels.values())} funnels completed '
+            f'({summary["funnels_per_second"]} funnels/s, {summary["requests_per_second"]} requests/s)'
+        )
+        self.stdout.write(f'{"step":<10}{"requests":>10}{"errors":>8}{"rate":>8}{"p50":>9}{"p95":>9}{"p99":>9}  ms')
+        for step, stats in summary['steps'].items():
+            self.stdout.write(
+                f'{step:<10}{stats["requests"]:>10}{stats["errors"]:>8}{stats["error_rate"]:>8.1%}'
+                f'{stats["p50"]:>9.1f}{stats["p95"]:>9.1f}{stats["p99"]:>9.1f}'
+            )
+            for reason, count in stats['error_reasons'].items():
+                self.stdout.write(f'    {reason}: {count}')
+        if summary['server_errors']:
+            self.stdout.write('server errors:')
+            for message, count in summary['server_errors'].items():
+                self.stdout.write(f'    {count}x {message}')
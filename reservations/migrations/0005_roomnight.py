@@ -0,0 +1,49 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+from datetime import timedelta
+
+
+def fill_room_nights(apps, schema_editor):
+    """popula o ledger com as noites das reservas ativas ou agendadas"""
+    Reservation = apps.get_model('reservations', 'Reservation')
+    RoomNight = apps.get_model('reservations', 'RoomNight')
+    reservations = Reservation.objects.filter(
+        status__in=['A', 'S'], room__isnull=False
+    ).order_by('created_at')
+
+    nights = [
+        RoomNight(room_id=r.room_id, night=r.checkin + timedelta(days=d), reservation_id=r.pk)
+        for r in reservations.iterator()
+        for d in range((r.checkout - r.checkin).days)
+    ]
+    RoomNight.objects.bulk_create(nights, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0004_alter_benefit_icon'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomNight',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('night', models.DateField(verbose_name='Noite')),
+                ('reservation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservation_nights', related_query_name='reservation_night', to='reservations.reservation')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_nights', related_query_name='room_night', to='reservations.room')),
+            ],
+            options={
+                'verbose_name': 'Noite ocupada',
+                'verbose_name_plural': 'Noites ocupadas',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='roomnight',
+            constraint=models.UniqueConstraint(fields=('room', 'night'), name='unique_room_night'),
+        ),
+        migrations.RunPython(fill_room_nights, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:18
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def fill_room_popularity(apps, schema_editor):
+    """popula a popularidade com as reservas finalizadas, ativas ou agendadas"""
+    Reservation = apps.get_model('reservations', 'Reservation')
+    RoomPopularity = apps.get_model('reservations', 'RoomPopularity')
+    now = timezone.now()
+    counts = Reservation.objects.filter(
+        status__in=['F', 'A', 'S'], room__isnull=False
+    ).values('room').annotate(
+        reservations=Count('pk'),
+        last_30_days=Count('pk', filter=Q(created_at__gte=now - timezone.timedelta(days=30))),
+        last_90_days=Count('pk', filter=Q(created_at__gte=now - timezone.timedelta(days=90))),
+    ).order_by()
+
+    RoomPopularity.objects.bulk_create(
+        (RoomPopularity(room_id=row.pop('room'), **row) for row in counts), batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0007_reservation_reservation_status_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomPopularity',
+            fields=[
+                ('room', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='reservations.room', verbose_name='Quarto')),
+                ('reservations', models.PositiveIntegerField(default=0, verbose_name='Reservas')),
+                ('last_30_days', models.PositiveIntegerField(default=0, verbose_name='Reservas nos últimos 30 dias')),
+                ('last_90_days', models.PositiveIntegerField(default=0, verbose_name='Reservas nos últimos 90 dias')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Atualizada em')),
+            ],
+            options={
+                'verbose_name': 'Popularidade do quarto',
+                'verbose_name_plural': 'Popularidade dos quartos',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='roompopularity',
+            index=models.Index(fields=['-reservations', 'room'], name='popularity_total_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roompopularity',
+            index=models.Index(fields=['-last_30_days', 'room'], name='popularity_30_days_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roompopularity',
+            index=models.Index(fields=['-last_90_days', 'room'], name='popularity_90_days_idx'),
+        ),
+        migrations.RunPython(fill_room_popularity, migrations.RunPython.noop),
+    ]
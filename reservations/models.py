@@ -9,7 +9,9 @@ from django.core.validators import (
     RegexValidator, 
     validate_image_file_extension,
 )
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
@@ -24,7 +26,7 @@ from utils.supportmodels import (
     BenefitRules,
     BenefitErrorMessages
 )
-from utils import support
+from utils import supportimages
 
 
 class Benefit(models.Model):
@@ -182,6 +184,12 @@ class Room(models.Model):
         blank=True,
         null=True
     )
+    image_variants = models.JSONField(
+        'Variantes da imagem',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     short_desc = models.CharField(
         'Descrição curta',
         max_length=255,
@@ -232,8 +240,37 @@ class Room(models.Model):
 
     def save(self, *args, **kwargs) -> None:
         super().save(*args, **kwargs)
-        if self.image:
-            support.resize_image(self.image.path, *RoomRules.IMAGE_SIZE)
+        supportimages.enqueue_variants(self, 'image', 'image_variants', 'reservations.tasks.create_room_image_variants')
+
+    @classmethod
+    def free_rooms(cls, checkin, checkout, adults=1, children=0) -> models.QuerySet:
+        """retorna em uma única query todos os quartos que comportam os
+        hóspedes e não possuem noite ocupada por reserva ativa ou agendada
+        entre o check-in e o check-out. Para check-in hoje os quartos
+        indisponíveis, ocupados ou em checkout (status 'P'), também são
+        excluídos, assim como na validação da reserva
+
+        Args:
+            checkin (datetime.date): data de check-in
+            checkout (datetime.date): data de check-out
+            adults (int, optional): quantidade de adultos. Defaults to 1.
+            children (int, optional): quantidade de crianças. Defaults to 0.
+
+        Returns:
+            QuerySet: quartos livres para o período
+        """
+        occupied = RoomNight.objects.filter(
+            room=models.OuterRef('pk'),
+            night__gte=checkin,
+            night__lt=checkout,
+        )
+        rooms = cls.objects.filter(
+            adult_capacity__gte=adults,
+            child_capacity__gte=children,
+        ).filter(~models.Exists(occupied))
+        if checkin <= datetime.now().date():
+            rooms = rooms.filter(available=True)
+        return rooms
 
 
 class Reservation(models.Model):
@@ -310,9 +347,19 @@ class Reservation(models.Model):
         blank=False,
         default=timezone.now
     )
+    OCCUPYING_STATUS = ('A', 'S')
+    POPULARITY_STATUS = ('F', 'A', 'S')
 
     def __str__(self) -> str:
         return f'<{self.__class__.__name__}: {self.pk}>'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """guarda o status lido do banco para identificar, no post_save, se
+        a reserva passou a contar para a popularidade do quarto"""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
     
     def formatted_price(self) -> str:
         """valor total da reserva no formato R$xn.xx
@@ -394,14 +441,20 @@ class Reservation(models.Model):
         return cls.get_free_dates(reservas)
         
     def _validate_date_availability(self, msg_dict, k) -> bool:
-        """verifica se a data da reserva sobrepõe um reserva ativa ou agendada"""
-        reservations = Reservation.objects.filter(
-            room=self.room, 
-            checkout__gt=self.checkin,
-            checkin__lte=self.checkout,
-            status__in=['A', 'S']
+        """verifica se alguma noite da reserva já esta ocupada no ledger
+        de ocupação por uma reserva ativa ou agendada"""
+        nights = RoomNight.objects.filter(
+            room=self.room,
+            night__gte=self.checkin,
+            night__lt=self.checkout,
         )
-        if reservations.exists():
+        if self.pk is not None:
+            nights = nights.exclude(reservation=self.pk)
+
+        if nights.exists():
+            reservations = Reservation.objects.filter(
+                pk__in=nights.values('reservation')
+            ).order_by('checkin')
             dates = self.get_free_dates(reservations)
             msg = ReserveErrorMessages.UNAVAILABLE_DATE.format_map({'dates': dates})
             msg_dict[k] = msg
@@ -432,6 +485,155 @@ class Reservation(models.Model):
         """custo da reserva em centavos"""
         return int(self.amount * Decimal('100'))
 
+    @property
+    def nights(self) -> list:
+        """retorna as noites ocupadas pela reserva, do check-in até
+        a véspera do check-out"""
+        return [
+            self.checkin + timezone.timedelta(days=d)
+            for d in range(self.reservation_days)
+        ]
+
+    def sync_nights(self) -> None:
+        """mantém o ledger de ocupação em sincronia com a reserva. Reservas
+        ativas ou agendadas ocupam uma linha por noite, as demais não
+        ocupam nenhuma.
+
+        Raises:
+            IntegrityError: caso alguma das noites já esteja ocupada por
+            outra reserva do mesmo quarto
+        """
+        occupied = RoomNight.objects.filter(reservation=self)
+        if self.status not in self.OCCUPYING_STATUS or self.room_id is None:
+            occupied.delete()
+            return
+
+        expected = {(self.room_id, night) for night in self.nights}
+        current = set(occupied.values_list('room', 'night'))
+        if current == expected:
+            return
+
+        with transaction.atomic():
+            occupied.delete()
+            RoomNight.objects.bulk_create(
+                RoomNight(room_id=room_id, night=night, reservation=self)
+                for room_id, night in expected
+            )
+
     class Meta:
         verbose_name = 'Reserva'
         verbose_name_plural = 'Reservas'
+        indexes = [
+            models.Index(
+                fields=['room', 'status', 'checkin'],
+                name='reservation_room_status_idx',
+            ),
+            models.Index(
+                fields=['client', 'status'],
+                name='reservation_client_status_idx',
+            ),
+            models.Index(
+                fields=['checkout'],
+                condition=models.Q(active=True),
+                name='reservation_active_idx',
+            ),
+            models.Index(
+                fields=['status', 'created_at'],
+                name='reservation_status_created_idx',
+            ),
+        ]
+
+
+class RoomNight(models.Model):
+    """ledger de ocupação dos quartos, com uma linha por noite ocupada
+    por uma reserva ativa ou agendada"""
+    room = models.ForeignKey(
+        Room,
+        on_delete=models.CASCADE,
+        related_name='room_nights',
+        related_query_name='room_night',
+    )
+    night = models.DateField(
+        'Noite',
+        blank=False,
+        null=False,
+    )
+    reservation = models.ForeignKey(
+        Reservation,
+        on_delete=models.CASCADE,
+        related_name='reservation_nights',
+        related_query_name='reservation_night',
+    )
+
+    def __str__(self) -> str:
+        return f'{self.room} {self.night}'
+
+    class Meta:
+        verbose_name = 'Noite ocupada'
+        verbose_name_plural = 'Noites ocupadas'
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'night'], name='unique_room_night'),
+        ]
+
+
+class RoomPopularity(models.Model):
+    """quantidade de reservas finalizadas, ativas ou agendadas de cada quarto,
+    no total e nas janelas de `WINDOWS` dias pela data de criação da reserva.
+    Atualizada a cada mudança de status e recalculada diariamente por
+    `reservations.tasks.rebuild_room_popularity`, que também remove das
+    janelas as reservas que ficaram antigas"""
+    room = models.OneToOneField(
+        Room,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='popularity',
+        verbose_name='Quarto',
+    )
+    reservations = models.PositiveIntegerField('Reservas', default=0)
+    last_30_days = models.PositiveIntegerField('Reservas nos últimos 30 dias', default=0)
+    last_90_days = models.PositiveIntegerField('Reservas nos últimos 90 dias', default=0)
+    updated_at = models.DateTimeField('Atualizada em', auto_now=True)
+
+    # campo de cada ranking pela janela em dias, None para o total
+    WINDOWS = {None: 'reservations', 30: 'last_30_days', 90: 'last_90_days'}
+
+    def __str__(self) -> str:
+        return f'{self.room_id}: {self.reservations}'
+
+    @classmethod
+    def record(cls, room_id, delta: int, created_at) -> None:
+        """soma `delta` aos contadores do quarto com um UPDATE atômico,
+        incluindo as janelas que contêm `created_at`"""
+        if room_id is None:
+            return
+
+        fields = {'reservations': delta}
+        for days, field in cls.WINDOWS.items():
+            if days is not None and created_at >= timezone.now() - timezone.timedelta(days=days):
+                fields[field] = delta
+
+        updates = {field: Greatest(F(field) + value, 0) for field, value in fields.items()}
+        if cls.objects.filter(room_id=room_id).update(**updates, updated_at=timezone.now()):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(room_id=room_id, **{field: max(value, 0) for field, value in fields.items()})
+        except IntegrityError:
+            cls.objects.filter(room_id=room_id).update(**updates, updated_at=timezone.now())
+
+    @classmethod
+    def ranking(cls, limit: int = 4, days: int | None = None) -> list:
+        """os `limit` quartos com mais reservas no total ou na janela de
+        `days` dias, em uma única query pelo índice do contador"""
+        field = cls.WINDOWS[days]
+        popular = cls.objects.filter(**{f'{field}__gt': 0}).select_related('room__room_class')
+        return [popularity.room for popularity in popular.order_by(f'-{field}', 'room_id')[:limit]]
+
+    class Meta:
+        verbose_name = 'Popularidade do quarto'
+        verbose_name_plural = 'Popularidade dos quartos'
+        indexes = [
+            models.Index(fields=['-reservations', 'room'], name='popularity_total_idx'),
+            models.Index(fields=['-last_30_days', 'room'], name='popularity_30_days_idx'),
+            models.Index(fields=['-last_90_days', 'room'], name='popularity_90_days_idx'),
+        ]
@@ -0,0 +1,37 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Benefit, Class, Reservation, Room, RoomPopularity
+from utils.supportcache import invalidate_catalog
+
+
+@receiver(post_save, sender=Reservation)
+def sync_reservation_nights(sender, instance: Reservation, **kwargs):
+    """atualiza o ledger de ocupação sempre que uma reserva é salva,
+    incluindo reservas carregadas por fixtures"""
+    instance.sync_nights()
+
+
+@receiver(post_save, sender=Reservation)
+def count_room_popularity(sender, instance: Reservation, **kwargs):
+    """soma ou subtrai a reserva da popularidade do quarto quando ela entra
+    ou sai dos status contados. Mudanças feitas com `QuerySet.update` não
+    disparam o signal e chamam `RoomPopularity.record` diretamente"""
+    counted = instance.status in Reservation.POPULARITY_STATUS
+    was_counted = getattr(instance, '_loaded_status', None) in Reservation.POPULARITY_STATUS
+    instance._loaded_status = instance.status
+    if counted != was_counted:
+        RoomPopularity.record(instance.room_id, 1 if counted else -1, instance.created_at)
+
+
+@receiver(post_delete, sender=Reservation)
+def discount_room_popularity(sender, instance: Reservation, **kwargs):
+    if getattr(instance, '_loaded_status', instance.status) in Reservation.POPULARITY_STATUS:
+        RoomPopularity.record(instance.room_id, -1, instance.created_at)
+
+
+for model in (Room, Benefit, Class):
+    post_save.connect(invalidate_catalog, sender=model, dispatch_uid=f'catalog_save_{model.__name__}')
+    post_delete.connect(invalidate_catalog, sender=model, dispatch_uid=f'catalog_delete_{model.__name__}')
+
+m2m_changed.connect(invalidate_catalog, sender=Room.benefit.through, dispatch_uid='catalog_room_benefits')
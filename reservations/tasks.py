@@ -1,59 +1,157 @@
-from django.utils.timezone import now
+from django.utils.timezone import now, timedelta
 import logging
-from django.core.mail import send_mass_mail
-from django.conf import settings
-from clients.models import Client
-from reservations.models import Reservation, Room
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from reservations.models import Reservation, Room, RoomNight, RoomPopularity
 from payments.models import Payment
+from utils import supportimages
+from utils.supportmodels import RoomRules
+from utils.supporttasks import send_reservation_emails
+from utils.supportviews import ReserveSupport
 
 
-def check_reservation_dates():
-    """filtra por reservas ativas e verifica se a data de checkout é menor
-    ou igual a data atual, caso seja, desativa a reserva e passa o status para
-    finalizada, envia email avisando ao cliente e os admins
+def check_reservation_dates() -> int:
+    """filtra as reservas ativas com data de checkout menor ou igual a data
+    atual, desativa as reservas, passa o status para finalizada e libera os
+    quartos que não estão ocupados por outra reserva ativa. Envia um email
+    para cada cliente e um único resumo para os admins, tudo pela mesma
+    conexão.
+
+    Returns:
+        int: quantidade de reservas finalizadas
     """
-    active_reservations = Reservation.objects.filter(active=True)
-    for reservation in active_reservations:
-        if reservation.checkout <= now().date():
-            reservation.active = False
-            reservation.status = 'F'
-            reservation.save()
+    logger = logging.getLogger('djangoLogger')
+    expired = Reservation.objects.filter(active=True, checkout__lte=now().date())
+    expired_list = list(expired.select_related('client', 'room'))
+    if not expired_list:
+        return 0
 
-            room = Room.objects.get(pk=reservation.room.pk)
-            room.available = True
-            room.save()
-
-            print(f'{reservation} encerrada. Quarto {reservation.room} liberado para novas reservas.')
-            message1 = (
-                "Vencimento da reserva",
-                "Olá, passando pra avisar que a sua reserva expirou!",
-                settings.DEFAULT_FROM_EMAIL,
-                [reservation.client.email],
-            )
-
-            admin_users = Client.objects.filter(is_staff=True)
-            admin_emails = [adm.email for adm in admin_users if adm.email]
-            message2 = (
-                'Vencimento da reserva',
-                f'Reserva de {reservation.client.complete_name} para o quarto Nº{reservation.room.number} expirou!',
-                settings.DEFAULT_FROM_EMAIL,
-                admin_emails
-            )
-            send_mass_mail((message1, message2), fail_silently=False)
+    expired_pks = [reservation.pk for reservation in expired_list]
+    with transaction.atomic():
+        finalized = Reservation.objects.filter(pk__in=expired_pks).update(active=False, status='F')
+        RoomNight.objects.filter(reservation__in=expired_pks).delete()
+
+        room_occupied = Reservation.objects.filter(room=OuterRef('pk'), status='A')
+        Room.objects.filter(
+            reservation_room__in=expired_pks
+        ).exclude(Exists(room_occupied)).update(available=True)
+
+    sent = send_reservation_emails(
+        expired_list,
+        'Vencimento da reserva',
+        'Olá, passando pra avisar que a sua reserva expirou!',
+        'Vencimento das reservas',
+        f'{finalized} reserva(s) expirada(s) hoje:',
+    )
+    logger.info('%s reservations finalized, %s emails sent', finalized, sent)
+    return finalized
+
+
+def release_expired_holds() -> int:
+    """cancela as reservas que seguram o quarto sem pagamento finalizado e
+    cujo prazo acabou, junto de seus pagamentos pendentes:
+
+    - iniciadas há mais de `ReserveSupport.RESERVATION_PATIENCE_MINUTES`, que
+      ainda não ocuparam o quarto;
+    - processando cuja session do stripe expirou, pelo `session_expires_at` do
+      pagamento, contado a partir do checkout e não da criação da reserva;
+    - processando sem session há mais de duas vezes o prazo, que ficaram sem
+      pagamento por uma falha entre a ocupação do quarto e a criação da session.
+
+    Libera apenas os quartos das reservas processando expiradas e que não
+    estão ocupados por outra reserva ativa ou processando.
+
+    Returns:
+        int: quantidade de reservas liberadas
+    """
+    logger = logging.getLogger('djangoLogger')
+    current = now()
+    patience = timedelta(minutes=ReserveSupport.RESERVATION_PATIENCE_MINUTES)
+    finalized_payment = Payment.objects.filter(reservation=OuterRef('pk'), status='F')
+    pending_session = Payment.objects.filter(
+        reservation=OuterRef('pk'), status='P', session_expires_at__isnull=False
+    )
+    expired_session = pending_session.filter(session_expires_at__lt=current)
+    holds = Reservation.objects.filter(
+        Q(status='I', created_at__lt=current - patience)
+        | Q(status='P') & (
+            Exists(expired_session)
+            | ~Exists(pending_session) & Q(created_at__lt=current - 2 * patience)
+        )
+    ).exclude(Exists(finalized_payment))
+
+    with transaction.atomic():
+        expired = list(holds.values_list('pk', 'status'))
+        expired_pks = [pk for pk, _ in expired]
+        room_claimed = Reservation.objects.filter(
+            room=OuterRef('pk'), status__in=['A', 'P']
+        ).exclude(pk__in=expired_pks)
+        Room.objects.filter(
+            reservation_room__in=[pk for pk, status in expired if status == 'P'], available=False
+        ).exclude(Exists(room_claimed)).update(available=True)
+
+        Payment.objects.filter(reservation__in=expired_pks, status='P').update(status='C')
+        released = Reservation.objects.filter(pk__in=expired_pks, status__in=['I', 'P']).update(status='C')
+
+    logger.info('%s expired reservation holds released', released)
+    return released
 
 
 def release_room(reservation_pk):
-    """libera o quarto caso a reserva não tenha um pagamento finalizado"""
+    """libera o quarto caso a reserva não tenha um pagamento finalizado.
+
+    Mantida para as schedules criadas antes de `release_expired_holds`.
+    """
     logger = logging.getLogger('djangoLogger')
     try:
         reservation = Reservation.objects.get(pk=reservation_pk)
         payment = Payment.objects.filter(reservation=reservation).first()
         if payment is None or payment.status != 'F':
-            logger.info(f'room {reservation.room} of the reservation {reservation_pk} released')
+            logger.info('room %s of the reservation %s released', reservation.room_id, reservation_pk)
             room = Room.objects.get(pk=reservation.room.pk)
             room.available = True
-            room.save()
-            print(f'quarto {room} da reserva {reservation} esta disponível novamente.')
+            room.save(update_fields=['available'])
     
     except Reservation.DoesNotExist:
         pass
+
+
+def rebuild_room_popularity() -> int:
+    """recalcula a popularidade de todos os quartos a partir das reservas
+    finalizadas, ativas ou agendadas, corrigindo os contadores incrementais e
+    removendo das janelas as reservas que ficaram antigas.
+
+    Returns:
+        int: quantidade de quartos com popularidade
+    """
+    logger = logging.getLogger('djangoLogger')
+    current = now()
+    windows = {
+        field: Count('pk', filter=Q(created_at__gte=current - timedelta(days=days)))
+        for days, field in RoomPopularity.WINDOWS.items() if days is not None
+    }
+
+    with transaction.atomic():
+        counts = Reservation.objects.filter(
+            status__in=Reservation.POPULARITY_STATUS, room__isnull=False,
+        ).values('room').annotate(reservations=Count('pk'), **windows).order_by()
+
+        RoomPopularity.objects.all().delete()
+        rooms = RoomPopularity.objects.bulk_create(
+            RoomPopularity(room_id=row.pop('room'), updated_at=current, **row) for row in counts
+        )
+
+    logger.info('room popularity rebuilt for %s rooms', len(rooms))
+    return len(rooms)
+
+
+def create_room_image_variants(room_pk: int) -> bool:
+    """gera as variantes responsivas da imagem do quarto, enfileirada por
+    `Room.save` quando a imagem muda
+
+    Returns:
+        bool: True se as variantes foram atualizadas
+    """
+    return supportimages.update_variants(
+        Room, room_pk, 'image', 'image_variants', RoomRules.IMAGE_WIDTHS, RoomRules.IMAGE_SIZE
+    )
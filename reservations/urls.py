@@ -1,10 +1,11 @@
 from django.urls import path, include
-from .views import Rooms, RoomDetail, Reserve, ReservationsHistory, ReservationHistory
+from .views import Rooms, RoomSearch, RoomDetail, Reserve, ReservationsHistory, ReservationHistory
 
 urlpatterns = [
     path("quartos/", include(
         [
             path("", Rooms.as_view(), name="rooms"),
+            path("buscar/", RoomSearch.as_view(), name="rooms_search"),
             path("<int:pk>/", RoomDetail.as_view(), name="room"),
             path("<int:room_pk>/reservar", Reserve.as_view(), name="reserve"),
         ]
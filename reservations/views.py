@@ -1,5 +1,4 @@
 from typing import Any
-from datetime import timedelta
 import logging
 
 from django.contrib import messages
@@ -18,7 +17,6 @@ from django.utils import timezone
 from django.views import View
 from django.views.generic.detail import DetailView
 from django.views.generic.list import ListView
-from django_q.tasks import schedule
 
 from .mixins import LoginRequired
 from .models import (
@@ -29,7 +27,13 @@ from .models import (
 )
 from .validators import convert_date
 from utils import support
-from utils.supportviews import ReserveMessages, ReserveSupport, INVALID_RECAPTCHA_MESSAGE
+from utils.supportcache import catalog_context
+from utils.supportmodels import ReserveErrorMessages, ReserveRules
+from utils.supportviews import (
+    ReserveMessages,
+    RoomSearchMessages,
+    INVALID_RECAPTCHA_MESSAGE,
+)
 
 
 def get_user_reservations_on(request, context):
@@ -54,6 +58,13 @@ class Rooms(ListView):
     template_name = 'rooms.html'
     context_object_name = 'rooms'
     ordering = '-daily_price'
+    paginate_by = 10
+
+    def get_queryset(self) -> QuerySet[Any]:
+        """carrega a classe e os benefícios dos quartos junto com a
+        listagem para evitar uma query por quarto"""
+        qs = super().get_queryset()
+        return qs.select_related('room_class').prefetch_related('benefit')
 
     def get_context_data(self, **kwargs):
         """retorna todos os quartos, todos os benefícios e todas as reservas
@@ -61,12 +72,67 @@ class Rooms(ListView):
         """
         context = super().get_context_data(**kwargs)
         context['benefits'] = Benefit.objects.all()
+        context.update(catalog_context())
         self.logger.debug('add benefits to the context')
 
+        for room in context[self.context_object_name]:
+            room.benefit_ids = {benefit.pk for benefit in room.benefit.all()}
+
+        query = self.request.GET.copy()
+        query.pop('page', None)
+        context['page_query'] = query.urlencode()
+
         get_user_reservations_on(self.request, context)
         return context
 
 
+class RoomSearch(Rooms):
+    """lista todos os quartos livres para as datas e hóspedes informados"""
+    def setup(self, request: HttpRequest, *args: Any, **kwargs: Any) -> None:
+        super().setup(request, *args, **kwargs)
+        self.search = {
+            'checkin': request.GET.get('checkin', ''),
+            'checkout': request.GET.get('checkout', ''),
+            'adults': request.GET.get('adults', '1'),
+            'children': request.GET.get('children', '0'),
+        }
+
+    def get_queryset(self) -> QuerySet[Any]:
+        """retorna os quartos livres ou nenhum quarto caso os dados
+        da busca sejam inválidos"""
+        checkin = convert_date(self.search['checkin'])
+        checkout = convert_date(self.search['checkout'])
+        try:
+            adults = int(self.search['adults'])
+            children = int(self.search['children'])
+        except ValueError:
+            adults = children = -1
+
+        error = None
+        if checkin < timezone.now().date():
+            error = ReserveErrorMessages.INVALID_CHECKIN_DATE
+        elif checkin > ReserveRules.checkin_anticipation_offset():
+            error = ReserveErrorMessages.INVALID_CHECKIN_ANTICIPATION
+        elif not ReserveRules.MIN_RESERVATION_DAYS <= (checkout - checkin).days <= ReserveRules.MAX_RESERVATION_DAYS:
+            error = ReserveErrorMessages.INVALID_STAYED_DAYS
+        elif adults < 1 or children < 0:
+            error = RoomSearchMessages.INVALID_GUESTS
+
+        if error is not None:
+            self.logger.info('invalid room search: %s', error)
+            messages.error(self.request, error)
+            return Room.objects.none()
+
+        self.queryset = Room.free_rooms(checkin, checkout, adults, children)
+        return super().get_queryset()
+
+    def get_context_data(self, **kwargs):
+        """add os dados da busca ao context para preencher o formulário"""
+        context = super().get_context_data(**kwargs)
+        context['search'] = self.search
+        return context
+
+
 class RoomDetail(DetailView):
     """mostra os dados de um quarto em especifico"""
     model = Room
@@ -83,6 +149,7 @@ class RoomDetail(DetailView):
         """
         context = super().get_context_data(**kwargs)
         context['benefits'] = Benefit.objects.all()
+        context.update(catalog_context())
         self.logger.info('add benefits to context')
         get_user_reservations_on(self.request, context)
         return context
@@ -107,11 +174,11 @@ class Reserve(LoginRequired, View):
             return redirect('rooms')
 
         self.context['room_pk'] = room_pk
-        self.logger.debug(f'rendering {self.template_name}')
+        self.logger.debug('rendering %s', self.template_name)
         return render(request, self.template_name, self.context)
 
     def post(self, request: HttpRequest, room_pk: int):
-        self.logger.debug(f'reservation for room {room_pk} started')
+        self.logger.debug('reservation for room %s started', room_pk)
         self.context['room_pk'] = room_pk
 
         try:
@@ -119,7 +186,7 @@ class Reserve(LoginRequired, View):
             CHECKOUT = convert_date(self.request.POST.get('checkout', '0001-01-01'))
             OBS = self.request.POST.get('obs', '')
             captcha = request.POST.get('g-recaptcha-response')
-            if not support.verify_captcha(captcha):
+            if not support.verify_captcha(captcha, request.session):
                 messages.error(request, INVALID_RECAPTCHA_MESSAGE)
                 return redirect(request.META.get('HTTP_REFERER', reverse('reserve', args=(room_pk,))))
         
@@ -135,26 +202,18 @@ class Reserve(LoginRequired, View):
                 reservation.amount = reservation.calc_reservation_value()
                 reservation.full_clean()
                 reservation.save()
-                self.logger.info(f'reservation {reservation} created')
-
-            schd = schedule(
-                'reservations.tasks.release_room', 
-                reservation.pk,
-                repeats=1,
-                next_run=timezone.now() + timedelta(minutes=ReserveSupport.RESERVATION_PATIENCE_MINUTES),
-                name=f'release_room : reservation {reservation.pk} : room {reservation.room.pk}'
-            )
-            self.logger.info(f'schedule {schd} created')
-            self.logger.info(f'reservation {reservation.pk} registered. Redirecting to checkout')
+                self.logger.info('reservation %s created', reservation)
+
+            self.logger.info('reservation %s registered. Redirecting to checkout', reservation.pk)
             return redirect(reverse_lazy('checkout', args=(reservation.pk,)))
 
         except ValidationError as exc:
             messages.error(request, exc.messages[0])
-            self.logger.error(str(exc.error_dict))
+            self.logger.error('%s', exc.error_dict)
             return render(request, self.template_name, self.context)
         
         except Exception as exc:
-            self.logger.error(str(exc))
+            self.logger.error('%s', exc)
             messages.error(request, ReserveMessages.RESERVATION_FAIL)
             room_url = reverse_lazy('room', args=(room_pk,))
             redirect_url = request.META.get('HTTP_REFERER', room_url)
@@ -169,7 +228,7 @@ class ReservationsHistory(LoginRequired, ListView):
     ordering = '-id'
 
     def get_queryset(self) -> QuerySet[Any]:
-        qs = super().get_queryset()
+        qs = super().get_queryset().select_related('room__room_class')
         return qs.filter(client__exact=self.request.user, status__in=['A', 'S', 'C', 'F'])
 
 
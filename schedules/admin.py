@@ -6,6 +6,7 @@ from utils import support
 class AgendamentoAdmin(admin.ModelAdmin):
     model = Scheduling
     list_display = ('client', 'date', 'room')
+    list_select_related = ('client', 'reservation__room')
 
     @admin.display(description='Data')
     def date(self, obj: Scheduling):
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class SchedulesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'schedules'
+
+    def ready(self) -> None:
+        from django_q.models import Schedule
+
+        if not Schedule.objects.filter(name='ativar reservas agendadas').exists():
+            Schedule.objects.create(
+                func='schedules.tasks.activate_scheduled_reservations',
+                schedule_type=Schedule.DAILY,
+                name='ativar reservas agendadas',
+            )
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedules', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='scheduling',
+            index=models.Index(fields=['client', 'reservation'], name='scheduling_client_resv_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:46
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedules', '0002_scheduling_scheduling_client_resv_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='scheduling',
+            name='scheduling_client_resv_idx',
+        ),
+    ]
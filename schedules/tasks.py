@@ -1,10 +1,47 @@
+import logging
 from django.core.mail import send_mass_mail
 from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
 from clients.models import Client
 from reservations.models import Reservation, Room
+from utils.supporttasks import send_reservation_emails
+
+
+def activate_scheduled_reservations() -> int:
+    """ativa todas as reservas agendadas com checkin até a data atual,
+    marca os quartos como indisponíveis e envia um email para cada cliente
+    e um único resumo para os admins, tudo pela mesma conexão.
+
+    Returns:
+        int: quantidade de reservas ativadas
+    """
+    logger = logging.getLogger('djangoLogger')
+    scheduled = Reservation.objects.filter(status='S', checkin__lte=now().date())
+    scheduled_list = list(scheduled.select_related('client', 'room'))
+    if not scheduled_list:
+        return 0
+
+    scheduled_pks = [reservation.pk for reservation in scheduled_list]
+    with transaction.atomic():
+        activated = Reservation.objects.filter(pk__in=scheduled_pks).update(active=True, status='A')
+        Room.objects.filter(reservation_room__in=scheduled_pks).update(available=False)
+
+    sent = send_reservation_emails(
+        scheduled_list,
+        'Agendamento de reserva',
+        'Olá, passando pra avisar que a sua reserva agendada ativou!',
+        'Agendamentos de reserva',
+        f'{activated} reserva(s) agendada(s) ativada(s) hoje:',
+    )
+    logger.info('%s scheduled reservations activated, %s emails sent', activated, sent)
+    return activated
 
 
 def schedule_reservation(reservation_id):
+    """ativa a reserva agendada. Mantida para as schedules criadas antes
+    de `activate_scheduled_reservations`."""
+    logger = logging.getLogger('djangoLogger')
     try:
         reservation = Reservation.objects.get(pk=int(reservation_id))
         reservation.active = True
@@ -13,7 +50,7 @@ def schedule_reservation(reservation_id):
         
         quarto = Room.objects.get(pk=reservation.room.pk)
         quarto.available = False
-        quarto.save()
+        quarto.save(update_fields=['available'])
 
         admin_users = Client.objects.filter(is_staff=True)
         admin_emails = [adm.email for adm in admin_users if adm.email]
@@ -37,7 +74,7 @@ def schedule_reservation(reservation_id):
         )
 
     except Reservation.DoesNotExist:
-        print(f'reservation {reservation_id} does not exists')
+        logger.error('reservation %s does not exists', reservation_id)
     
     except Room.DoesNotExist:
-        print(f'room {reservation.room.pk} from reservation {reservation_id} does not exists')
+        logger.error('room %s from reservation %s does not exists', reservation.room_id, reservation_id)
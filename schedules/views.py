@@ -8,8 +8,6 @@ from reservations.models import Reservation, Room
 from reservations.validators import convert_date
 from .models import Scheduling
 from payments.models import Payment
-from django_q.tasks import Schedule, Task, async_task
-from payments.tasks import create_payment_pdf
 from utils.support import ReservationStripePaymentCreator
 from django.urls import reverse_lazy, reverse
 from django.contrib.auth.decorators import login_required
@@ -32,7 +30,7 @@ class Schedules(LoginRequired, View):
         self.context = {}
     
     def get(self, request, room_pk, *args, **kwargs):
-        self.logger.debug(f'schedule for room {room_pk} received')
+        self.logger.debug('schedule for room %s received', room_pk)
         self.context['room_pk'] = room_pk
         return render(self.request, 'schedule.html', self.context)
 
@@ -42,13 +40,13 @@ class Schedules(LoginRequired, View):
         reserva, pagamento, cria uma sessão de pagamento e redireciona
         para a pagina hospedada do stripe
         """
-        self.logger.debug(f'schedule for room {room_pk} received')
+        self.logger.debug('schedule for room %s received', room_pk)
         self.context['room_pk'] = room_pk
         CHECK_IN = convert_date(self.request.POST.get('checkin', '0001-01-01'))
         CHECKOUT = convert_date(self.request.POST.get('checkout', '0001-01-01'))
         OBS = self.request.POST.get('obs', '')
         captcha = request.POST.get('g-recaptcha-response')
-        if not support.verify_captcha(captcha):
+        if not support.verify_captcha(captcha, request.session):
             messages.error(request, INVALID_RECAPTCHA_MESSAGE)
             return redirect(request.META.get('HTTP_REFERER', reverse('schedule', args=(room_pk,))))
         
@@ -59,7 +57,7 @@ class Schedules(LoginRequired, View):
                 checkin=CHECK_IN,
                 checkout=CHECKOUT
             ).first()
-            self.logger.debug(f'existing reservation {reservation}')
+            self.logger.debug('existing reservation %s', reservation)
             
             if reservation is None:
                 self.logger.debug('creating a new reservation')
@@ -76,12 +74,12 @@ class Schedules(LoginRequired, View):
                 reservation._validate_date_availability(reservation.error_messages, 'checkin')
                 reservation._validate_check_in()
                 if reservation.error_messages:
-                    self.logger.error(str(reservation.error_messages))
+                    self.logger.error('%s', reservation.error_messages)
                     raise ValidationError(reservation.error_messages)
                 
                 reservation.clean_fields()
                 reservation.save()
-                self.logger.info(f'reservation {reservation.pk} created')
+                self.logger.info('reservation %s created', reservation.pk)
 
             stripe_payment = ReservationStripePaymentCreator(
                 request=self.request,
@@ -89,21 +87,26 @@ class Schedules(LoginRequired, View):
                 success_url_name='schedule_success',
                 cancel_url_name='payment_cancel',
             )
-            self.logger.debug(f'stripe payment created {stripe_payment}')
+            self.logger.debug('stripe payment created %s', stripe_payment)
+            if stripe_payment.reused:
+                self.logger.info('reusing stripe session for reservation %s', reservation.pk)
+                return redirect(stripe_payment.session.url)
 
             scheduling = Scheduling(
                 client=self.request.user, 
                 reservation=reservation
             )
             scheduling.full_clean()
-            self.logger.debug(f'schedule {scheduling} prepared')
-            payment = Payment(
-                status='P',
-                amount=reservation.amount,
-                reservation=reservation
+            self.logger.debug('schedule %s prepared', scheduling)
+            payment = stripe_payment.bind(
+                Payment(
+                    status='P',
+                    amount=reservation.amount,
+                    reservation=reservation
+                )
             )
             payment.full_clean()
-            self.logger.debug(f'payment {payment} created')
+            self.logger.debug('payment %s created', payment)
 
             scheduling.save()
             payment.save()
@@ -116,14 +119,16 @@ class Schedules(LoginRequired, View):
             return render(request, 'schedule.html', self.context)
         
         except OperationalError as exc:
+            # lock não obtido em DB_LOCK_TIMEOUT: "database is locked" no sqlite,
+            # lock_timeout ou deadlock no postgresql
             messages.info(request, CheckoutMessages.TRANSACTION_BLOCKING)
-            self.logger.warn(f"payment transaction fail: {str(exc)}")
+            self.logger.warning("payment transaction fail: %s", exc)
             redirect_url = request.META.get("HTTP_REFERER", reverse("rooms"))
             return redirect(redirect_url)
 
         except Exception as exc:
             messages.error(request, CheckoutMessages.PAYMENT_FAIL)
-            self.logger.critical(f"payment unexpected fail: {str(exc)}")
+            self.logger.critical("payment unexpected fail: %s", exc)
             redirect_url = request.META.get("HTTP_REFERER", reverse("rooms"))
             return redirect(redirect_url)
 
@@ -133,40 +138,15 @@ class Schedules(LoginRequired, View):
 @check_reservation_ownership
 def schedule_success(request: HttpRequest, reservation_pk: int):
     """view responsável de renderizar a pagina de sucesso do pagamento
-    da reserva e criar uma task para enviar os dados de pagamento via
-    email para o cliente.
+    da reserva agendada. O pagamento é finalizado e a reserva agendada pelo
+    webhook do stripe, que também envia o comprovante por email, e a reserva
+    é ativada na data de checkin por `schedules.tasks.activate_scheduled_reservations`.
     """
     logger = logging.getLogger('djangoLogger')
 
-    payment = get_object_or_404(Payment, reservation__pk__exact=reservation_pk)
-    context = {'payment': payment}
-    if not payment.status == 'P':
-        logger.warn('payment is not processing')
-        return render(request, 'schedule_success.html', context)
-    
-    payment.reservation.status = 'S'
-    payment.status = 'F'
-    payment.reservation.save()
-    payment.save()
-    context['payment'] = payment
-    logger.info(f'payment {payment} created')
-
-    schedule = get_object_or_404(Scheduling, client=request.user, reservation=payment.reservation)
-    schedule_name = f'schedule {schedule}-{schedule.client}-{schedule.reservation}'
-    if not Schedule.objects.filter(name=schedule_name).exists():
-        Schedule.objects.create(
-            func='schedules.tasks.schedule_reservation',
-            args=str(schedule.reservation.pk),
-            next_run=payment.reservation.checkin,
-            repeats=1,
-            name=schedule_name,
-        )
-        logger.info(f'schedule {schedule_name} created')
-
-    task_name = f"create_payment_pdf_{payment.pk}"
-    if not Task.objects.filter(name=task_name).exists():
-        async_task(create_payment_pdf, payment, task_name=task_name)
-        logger.info(f'task {task_name} created')
-
+    payment = get_object_or_404(
+        Payment.objects.select_related('reservation__client', 'reservation__room__room_class'),
+        reservation__pk__exact=reservation_pk,
+    )
     logger.debug('rendering schedule_success.html')
-    return render(request, 'schedule_success.html', context)
+    return render(request, 'schedule_success.html', {'payment': payment})
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0005_rename_services_service'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='service',
+            name='logo_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Variantes do logo'),
+        ),
+    ]
@@ -2,8 +2,7 @@ from typing import Iterable
 from django.db import models
 from home.models import Hotel
 from django.core.validators import RegexValidator
-from utils import support
-from utils.supportmodels import ServicesRules
+from utils import supportimages
 
 
 class Service(models.Model):
@@ -29,6 +28,12 @@ class Service(models.Model):
         'Logo',
         upload_to='services/logo',
     )
+    logo_variants = models.JSONField(
+        'Variantes do logo',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     hotel = models.ForeignKey(
         Hotel,
         on_delete=models.CASCADE,
@@ -41,8 +46,7 @@ class Service(models.Model):
 
     def save(self, *args, **kwargs) -> None:
         super().save(*args, **kwargs)
-        if self.logo:
-            support.resize_image(self.logo.path, *ServicesRules.IMG_SIZE)
+        supportimages.enqueue_variants(self, 'logo', 'logo_variants', 'services.tasks.create_service_logo_variants')
 
     class Meta:
         verbose_name = 'Serviço'
@@ -0,0 +1,7 @@
+from django.db.models.signals import post_save, post_delete
+
+from .models import Service
+from utils.supportcache import invalidate_catalog
+
+post_save.connect(invalidate_catalog, sender=Service, dispatch_uid='catalog_save_Service')
+post_delete.connect(invalidate_catalog, sender=Service, dispatch_uid='catalog_delete_Service')
@@ -0,0 +1,15 @@
+from services.models import Service
+from utils import supportimages
+from utils.supportmodels import ServicesRules
+
+
+def create_service_logo_variants(service_pk: int) -> bool:
+    """gera as variantes responsivas do logo do serviço, enfileirada por
+    `Service.save` quando o logo muda
+
+    Returns:
+        bool: True se as variantes foram atualizadas
+    """
+    return supportimages.update_variants(
+        Service, service_pk, 'logo', 'logo_variants', ServicesRules.IMG_WIDTHS, ServicesRules.IMG_SIZE
+    )
@@ -0,0 +1,147 @@
+import os
+import tempfile
+from datetime import date
+from io import StringIO
+from unittest.mock import call, patch
+from django.core.management import call_command
+from django.db.models import Count
+from django.test import TestCase, override_settings
+from PIL import Image
+from clients.models import Client
+from clients.validators import CpfValidator
+from home.management.commands.generate_dataset import make_cpf, room_number
+from home.models import Contact, Hotel
+from payments.models import Payment
+from reservations.models import Reservation, Room, RoomNight
+from schedules.models import Scheduling
+from services.models import Service
+
+TODAY = date(2026, 3, 10)
+
+
+def generate(**options) -> str:
+    out = StringIO()
+    options = {
+        'seed': 7, 'today': TODAY, 'rooms': 20, 'clients': 60, 'reservations': 400,
+        'batch_size': 50, 'stdout': out, **options,
+    }
+    call_command('generate_dataset', **options)
+    return out.getvalue()
+
+
+def snapshot() -> list:
+    return list(Reservation.objects.order_by('pk').values_list(
+        'room__number', 'client__cpf', 'checkin', 'checkout', 'status', 'amount',
+    ))
+
+
+class TestGenerateDataset(TestCase):
+    def test_cria_a_quantidade_pedida_de_cada_model(self):
+        """testa se o comando cria a quantidade pedida de cada model e um
+        pagamento por reserva"""
+        output = generate(hotels=2, services=2)
+        self.assertEqual(Hotel.objects.count(), 2)
+        self.assertEqual(Contact.objects.count(), 2)
+        self.assertEqual(Service.objects.count(), 4)
+        self.assertEqual(Room.objects.count(), 20)
+        self.assertEqual(Client.objects.count(), 60)
+        self.assertEqual(Reservation.objects.count(), 400)
+        self.assertEqual(Payment.objects.count(), 400)
+        self.assertIn('400 reservations', output)
+
+    def test_dados_gerados_passam_nos_validators(self):
+        """testa se quartos, clientes e reservas passam no full_clean das models"""
+        generate()
+        for room in Room.objects.all():
+            room.full_clean()
+        for client in Client.objects.all():
+            client.full_clean()
+        for reservation in Reservation.objects.all():
+            reservation.full_clean()
+        for scheduling in Scheduling.objects.all():
+            scheduling.full_clean()
+
+    def test_mesma_seed_gera_os_mesmos_dados(self):
+        """testa se duas execuções com a mesma seed geram as mesmas reservas"""
+        generate()
+        first = snapshot()
+        for model in (Reservation, Room, Client, Hotel):
+            model.objects.all().delete()
+        generate()
+        self.assertEqual(first, snapshot())
+
+    def test_ocupacao_e_coerente(self):
+        """testa se quartos com reserva ativa ficam indisponíveis, se cada
+        reserva ativa ou agendada ocupa suas noites e se os agendamentos
+        pertencem a quartos ocupados"""
+        generate()
+        active = Reservation.objects.filter(status='A')
+        self.assertTrue(active.exists())
+        self.assertFalse(Room.objects.filter(reservation_room__status='A', available=True).exists())
+        self.assertTrue(all(r.checkin <= TODAY < r.checkout for r in active))
+
+        occupying = Reservation.objects.filter(status__in=Reservation.OCCUPYING_STATUS)
+        self.assertEqual(RoomNight.objects.count(), sum(r.reservation_days for r in occupying))
+        self.assertEqual(Scheduling.objects.count(), occupying.filter(status='S').count())
+        scheduled_rooms = set(occupying.filter(status='S').values_list('room', flat=True))
+        self.assertTrue(scheduled_rooms <= set(active.values_list('room', flat=True)))
+
+        clients = occupying.values('client').annotate(total=Count('pk')).filter(total__gt=1)
+        self.assertFalse(clients.exists())
+
+    def test_executa_sobre_dados_existentes(self):
+        """testa se uma segunda execução continua as chaves e números de
+        quarto sem conflitar com os dados já existentes"""
+        generate()
+        generate(seed=8)
+        self.assertEqual(Room.objects.count(), 40)
+        self.assertEqual(Client.objects.count(), 120)
+        self.assertEqual(Reservation.objects.count(), 800)
+
+    def test_cpf_e_numero_do_quarto(self):
+        """testa se os cpfs gerados são válidos e únicos e os números de quarto
+        seguem o formato da model"""
+        validator = CpfValidator(message='invalid')
+        cpfs = {make_cpf(n) for n in range(1, 5000)}
+        self.assertEqual(len(cpfs), 4999)
+        for cpf in cpfs:
+            validator(cpf)
+        self.assertEqual(room_number(101), '101')
+        self.assertEqual(room_number(1101), '101A')
+        self.assertEqual(room_number(26999), '999Z')
+
+
+class TestGenerateImageVariants(TestCase):
+    def setUp(self):
+        for fixture in ('hotel', 'beneficio', 'classe', 'quarto'):
+            call_command('loaddata', f'tests/fixtures/{fixture}_fixture.json', verbosity=0)
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+        os.makedirs(os.path.join(media.name, 'test'))
+        Image.new('RGB', (800, 600), 'teal').save(os.path.join(media.name, 'test/room_test.jpg'))
+
+    def test_sync_gera_as_variantes_pendentes(self):
+        """testa se --sync gera as variantes dos quartos pendentes e se uma
+        segunda execução não encontra pendências"""
+        out = StringIO()
+        call_command('generate_image_variants', sync=True, only='rooms', stdout=out)
+        self.assertIn(f'{Room.objects.count()} rooms processed', out.getvalue())
+        self.assertFalse(Room.objects.filter(image_variants={}).exists())
+
+        out = StringIO()
+        call_command('generate_image_variants', sync=True, stdout=out)
+        self.assertIn('0 rooms processed', out.getvalue())
+
+    @patch('home.management.commands.generate_image_variants.enqueue_task')
+    def test_enfileira_por_padrao(self, mock_enqueue):
+        """testa se sem --sync uma task é enfileirada por quarto pendente"""
+        call_command('generate_image_variants', only='rooms', stdout=StringIO())
+        task = 'reservations.tasks.create_room_image_variants'
+        self.assertListEqual(
+            mock_enqueue.call_args_list,
+            [call(task, pk, task_name=f'{task}_{pk}') for pk in Room.objects.order_by('pk').values_list('pk', flat=True)]
+        )
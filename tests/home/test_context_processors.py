@@ -0,0 +1,38 @@
+from django.test import TestCase
+from django.core.management import call_command
+from home import context_processors
+from home.models import Hotel, Contact
+
+
+class TestHotelContextProcessor(TestCase):
+    def setUp(self):
+        call_command('loaddata', 'tests/fixtures/hotel_fixture.json')
+        call_command('loaddata', 'tests/fixtures/contato_fixture.json')
+        context_processors.invalidate_hotel_snapshot()
+
+    def test_hotel_e_contato_adicionados_ao_context(self):
+        """testa se o hotel e seu contato são retornados corretamente"""
+        result = context_processors.hotel()
+        expected = {'hotel': Hotel.objects.first(), 'hotel_contact': Contact.objects.first()}
+        self.assertDictEqual(result, expected)
+
+    def test_snapshot_evita_queries_nas_proximas_chamadas(self):
+        """testa se após a primeira chamada o hotel é lido do snapshot
+        sem consultar o banco de dados"""
+        context_processors.hotel()
+        with self.assertNumQueries(0):
+            context_processors.hotel()
+
+    def test_alterar_hotel_ou_contato_invalida_o_snapshot(self):
+        """testa se salvar o hotel ou o contato faz o context refletir
+        os novos dados"""
+        context_processors.hotel()
+        hotel = Hotel.objects.first()
+        hotel.name = 'Hotel alterado'
+        hotel.save()
+        self.assertEqual(context_processors.hotel()['hotel'].name, 'Hotel alterado')
+
+        contact = Contact.objects.first()
+        contact.phone = '11999999999'
+        contact.save()
+        self.assertEqual(context_processors.hotel()['hotel_contact'].phone, '11999999999')
@@ -0,0 +1,61 @@
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import TestCase
+from reservations.models import Room
+
+
+class TestPictureTag(TestCase):
+    def setUp(self):
+        call_command('loaddata', 'tests/fixtures/hotel_fixture.json')
+        call_command('loaddata', 'tests/fixtures/beneficio_fixture.json')
+        call_command('loaddata', 'tests/fixtures/classe_fixture.json')
+        call_command('loaddata', 'tests/fixtures/quarto_fixture.json')
+        self.room = Room.objects.get(pk=1)
+
+    def render(self, room: Room) -> str:
+        template = Template(
+            '{% load image_customtags %}'
+            '{% picture room.image room.image_variants sizes="33vw" css_class="rounded" %}'
+        )
+        return template.render(Context({'room': room}))
+
+    def test_usa_a_imagem_original_sem_variantes(self):
+        """testa se o <img> usa a original enquanto as variantes não existem"""
+        html = self.render(self.room)
+        self.assertIn(f'<img src="{self.room.image.url}"', html)
+        self.assertIn('loading="lazy"', html)
+        self.assertNotIn('<source', html)
+        self.assertNotIn('srcset', html)
+
+    def test_source_por_formato_e_fallback_com_srcset(self):
+        """testa se cada formato moderno vira um <source> e se o <img> usa a
+        maior variante do formato de fallback"""
+        name = self.room.image.name
+        self.room.image_variants = {
+            'source': name,
+            'formats': {
+                'avif': {'280': 'rooms/variants/a-280w.avif', '560': 'rooms/variants/a-560w.avif'},
+                'webp': {'280': 'rooms/variants/a-280w.webp', '560': 'rooms/variants/a-560w.webp'},
+                'jpeg': {'280': 'rooms/variants/a-280w.jpg', '560': 'rooms/variants/a-560w.jpg'},
+            },
+        }
+        html = self.render(self.room)
+        self.assertIn(
+            '<source type="image/avif" srcset="/media/rooms/variants/a-280w.avif 280w, '
+            '/media/rooms/variants/a-560w.avif 560w" sizes="33vw">', html
+        )
+        self.assertIn('<source type="image/webp"', html)
+        self.assertLess(html.index('image/avif'), html.index('image/webp'))
+        self.assertIn(
+            '<img src="/media/rooms/variants/a-560w.jpg" srcset="/media/rooms/variants/a-280w.jpg 280w, '
+            '/media/rooms/variants/a-560w.jpg 560w" sizes="33vw" alt="" class="rounded"', html
+        )
+
+    def test_ignora_variantes_de_outra_imagem(self):
+        """testa se variantes de uma imagem anterior não são usadas"""
+        self.room.image_variants = {'source': 'rooms/antiga.jpg', 'formats': {'jpeg': {'280': 'x.jpg'}}}
+        self.assertNotIn('x.jpg', self.render(self.room))
+
+    def test_sem_imagem_nao_renderiza(self):
+        self.room.image = ''
+        self.assertEqual(self.render(self.room).strip(), '')
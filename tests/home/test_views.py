@@ -1,6 +1,16 @@
-from django.test import TestCase
+import time
+from datetime import timedelta
+from unittest.mock import patch
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.cache import cache
 from django.core.management import call_command
-from reservations.models import Benefit, Room
+from django.urls import reverse
+from django.utils import timezone
+from reservations.models import Benefit, Reservation, Room, RoomPopularity
+from reservations.tasks import rebuild_room_popularity
+from utils import supportcache
 from services.models import Service
 
 
@@ -29,11 +39,135 @@ class TestHome(TestCase):
     def test_top_4_quartos_mais_procurados_enviados_corretamente(self):
         """envia corretamente os top 4 quartos mais procurados no context"""
         result = self.response.context.get('rooms')
-        expected = Room.objects.filter(reservation_room__pk__in=[2, 3, 1, 4])
-        self.assertQuerysetEqual(result, expected)
+        expected = [Room.objects.get(pk=pk) for pk in (2, 3, 1, 4)]
+        self.assertEqual(result, expected)
+
+    def test_top_4_quartos_em_uma_query(self):
+        """testa se o ranking dos quartos é lido da popularidade em uma única
+        query, independente do histórico de reservas"""
+        with CaptureQueriesContext(connection) as queries:
+            RoomPopularity.ranking(4)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('reservations_reservation', queries[0]['sql'])
+
+    @override_settings(HOME_POPULAR_ROOMS_WINDOW=30)
+    def test_top_4_quartos_na_janela_de_dias(self):
+        """testa se com HOME_POPULAR_ROOMS_WINDOW a home mostra apenas os
+        quartos com reservas criadas na janela"""
+        Reservation.objects.exclude(pk__in=[5, 7]).update(created_at=timezone.now() - timedelta(days=60))
+        rebuild_room_popularity()
+        response = self.client.get('/')
+        self.assertEqual(response.context.get('rooms'), [Room.objects.get(pk=2)])
 
     def test_servicos_enviados_no_context(self):
         """testa se todos os serviços são enviados corretamente no context"""
         result = self.response.context.get('services')
         expected = Service.objects.all()
         self.assertQuerysetEqual(result, expected)
+
+
+class TestCatalogCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        call_command('loaddata', 'tests/fixtures/hotel_fixture.json')
+        call_command('loaddata', 'tests/fixtures/servico_fixture.json')
+        call_command('loaddata', 'tests/fixtures/beneficio_fixture.json')
+        call_command('loaddata', 'tests/fixtures/classe_fixture.json')
+        call_command('loaddata', 'tests/fixtures/quarto_fixture.json')
+        call_command('loaddata', 'tests/fixtures/cliente_fixture.json')
+        call_command('loaddata', 'tests/fixtures/reserva_fixture.json')
+
+    def _count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        return len(queries)
+
+    def test_secoes_da_home_cacheadas_evitam_queries(self):
+        """testa se a segunda renderização da home não consulta as seções
+        cacheadas"""
+        first = self._count_queries('/')
+        second = self._count_queries('/')
+        self.assertLess(second, first)
+
+    def test_alteracoes_no_catalogo_invalidam_o_cache(self):
+        """testa se salvar, deletar ou alterar os benefícios de um quarto
+        gera uma nova versão do catálogo"""
+        room = Room.objects.get(pk=1)
+        benefit = Benefit.objects.get(pk=1)
+        actions = {
+            'save': room.save,
+            'm2m': lambda: room.benefit.remove(benefit),
+            'delete': benefit.delete,
+        }
+        for name, action in actions.items():
+            with self.subTest(action=name):
+                version = supportcache.catalog_version()
+                action()
+                self.assertNotEqual(supportcache.catalog_version(), version)
+
+    def test_versao_do_catalogo_expira_para_outros_processos(self):
+        """testa se a versão do catálogo expira após CATALOG_VERSION_TTL, para
+        que processos com cache local recebam invalidações feitas em outros"""
+        version = supportcache.catalog_version()
+        expired = time.time() + supportcache.CATALOG_VERSION_TTL + 1
+        with patch('django.core.cache.backends.locmem.time.time', return_value=expired):
+            self.assertNotEqual(supportcache.catalog_version(), version)
+
+    def test_alterar_disponibilidade_do_quarto_nao_invalida_o_cache(self):
+        """testa se saves que alteram apenas a disponibilidade do quarto
+        mantém a versão do catálogo"""
+        room = Room.objects.get(pk=1)
+        version = supportcache.catalog_version()
+
+        room.available = False
+        room.save(update_fields=['available'])
+        self.assertEqual(supportcache.catalog_version(), version)
+
+    def test_nome_do_beneficio_alterado_aparece_apos_invalidacao(self):
+        """testa se o fragmento renderizado reflete a alteração feita
+        no benefício"""
+        benefit = Benefit.objects.get(pk=1)
+        benefit.displayable_on_homepage = True
+        benefit.icon = 'test/test_icon.png'
+        benefit.save()
+        self.client.get('/')
+
+        benefit.short_desc = 'beneficio alterado'
+        benefit.save()
+
+        response = self.client.get('/')
+        self.assertContains(response, 'Beneficio alterado')
+
+    def test_mudanca_no_ranking_atualiza_os_quartos_cacheados(self):
+        """testa se a seção de quartos reflete o novo ranking sem depender
+        de uma nova versão do catálogo"""
+        self.client.get('/')
+        version = supportcache.catalog_version()
+        room = Room.objects.get(pk=4)
+        room.short_desc = 'quarto em alta'
+        Room.objects.filter(pk=4).update(short_desc=room.short_desc)
+        RoomPopularity.objects.filter(room=room).update(reservations=100)
+
+        response = self.client.get('/')
+        self.assertEqual(supportcache.catalog_version(), version)
+        self.assertEqual(response.context.get('rooms')[0], room)
+        self.assertContains(response, 'quarto em alta')
+
+    def test_variantes_geradas_em_outro_processo_substituem_fragmentos_pendentes(self):
+        """testa se as páginas cacheadas com as variantes pendentes passam a
+        usá-las depois que o worker as gera, sem depender da versão do catálogo
+        trocada em outro processo"""
+        room = Room.objects.get(pk=2)
+        urls = ['/', reverse('rooms'), reverse('room', args=(room.pk,))]
+        for url in urls:
+            self.assertNotContains(self.client.get(url), 'image/webp')
+
+        version = supportcache.catalog_version()
+        Room.objects.filter(pk=room.pk).update(image_variants={
+            'source': room.image.name,
+            'formats': {'webp': {'280': 'rooms/variants/a-280w.webp'}},
+        })
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), 'image/webp')
+        self.assertEqual(supportcache.catalog_version(), version)
@@ -1,7 +1,19 @@
+import os
 from django.test import TestCase
 from django.core.management import call_command
 from payments import tasks, models
+from reservations.models import Reservation
+from utils.supporttasks import enqueue_task
 from unittest.mock import patch
+import tempfile
+from io import StringIO
+from PIL import Image
+from django.test import override_settings
+from django.core.files.base import ContentFile
+from payments.management.commands import regenerate_receipts
+from home import context_processors
+from home.models import Hotel
+from utils import support
 
 class TestTasks(TestCase):
     def setUp(self):
@@ -21,7 +33,7 @@ class TestTasks(TestCase):
         """testa se a task True caso seja enviado por email corretamente com um pagamento valido"""
         pdf_handle.handle.side_effect = 1
 
-        result = tasks.create_payment_pdf(self.payment)
+        result = tasks.create_payment_pdf(self.payment.pk)
         self.assertTrue(result)
     
     @patch('payments.tasks.PaymentPDFHandler.handle')
@@ -29,5 +41,263 @@ class TestTasks(TestCase):
         """testa se a task retorna False caso o email não seja enviado corretamente com um pagamento valido"""
         pdf_handle.return_value = 0
 
-        result = tasks.create_payment_pdf(self.payment)
+        result = tasks.create_payment_pdf(self.payment.pk)
         self.assertFalse(result)
+
+    def test_create_payment_pdf_retorna_false_se_pagamento_nao_existe(self):
+        """testa se a task retorna False caso o pagamento tenha sido removido"""
+        result = tasks.create_payment_pdf(999)
+        self.assertFalse(result)
+
+    @patch('payments.tasks.PaymentPDFHandler')
+    def test_create_payment_pdf_carrega_pagamento_com_reserva_cliente_e_quarto(self, pdf_handle):
+        """testa se o pagamento é carregado em uma única query junto da reserva,
+        cliente e quarto usados no pdf"""
+        pdf_handle.return_value.handle.return_value = 1
+
+        with self.assertNumQueries(1):
+            tasks.create_payment_pdf(self.payment.pk)
+            payment = pdf_handle.call_args.args[0]
+            payment.reservation.client.email
+            payment.reservation.room.room_class.name
+
+    @patch('payments.tasks.stripe.Refund.create')
+    def test_refund_payment_reembolsa_pagamento_marcado(self, refund_create):
+        """testa se o pagamento marcado para reembolso é reembolsado pelo
+        stripe com chave de idempotência"""
+        models.Payment.objects.filter(pk=self.payment.pk).update(status='R')
+
+        self.assertTrue(tasks.refund_payment(self.payment.pk, 'pi_test'))
+        refund_create.assert_called_once_with(
+            payment_intent='pi_test', idempotency_key=f'refund_payment_{self.payment.pk}'
+        )
+
+    @patch('payments.tasks.stripe.Refund.create')
+    def test_refund_payment_ignora_pagamento_nao_marcado(self, refund_create):
+        """testa se pagamentos que não estão marcados para reembolso não são reembolsados"""
+        models.Payment.objects.filter(pk=self.payment.pk).update(status='F')
+
+        self.assertFalse(tasks.refund_payment(self.payment.pk, 'pi_test'))
+        refund_create.assert_not_called()
+
+    @patch('utils.supporttasks.async_task')
+    def test_enqueue_task_recusa_instancia_de_pagamento(self, mock_async_task):
+        """testa se passar a instância do pagamento no lugar do id levanta
+        ValueError"""
+        with self.assertRaises(ValueError):
+            enqueue_task('payments.tasks.create_payment_pdf', self.payment, task_name='pdf')
+        mock_async_task.assert_not_called()
+
+
+class TestEnqueueTask(TestCase):
+    @patch('utils.supporttasks.async_task')
+    def test_enfileira_task_com_ids(self, mock_async_task):
+        """testa se a task é enfileirada quando os argumentos são pequenos"""
+        enqueue_task('payments.tasks.create_payment_pdf', 1, task_name='create_payment_pdf_1')
+        mock_async_task.assert_called_once_with(
+            'payments.tasks.create_payment_pdf', 1, task_name='create_payment_pdf_1'
+        )
+
+    @patch('utils.supporttasks.async_task')
+    def test_payload_grande_levanta_value_error(self, mock_async_task):
+        """testa se argumentos maiores que o limite, como instâncias de models,
+        levantam ValueError sem enfileirar a task"""
+        with self.assertRaises(ValueError):
+            enqueue_task('payments.tasks.create_payment_pdf', 'x' * 2048, task_name='big')
+        mock_async_task.assert_not_called()
+
+
+class TestReceiptRenderer(TestCase):
+    def setUp(self):
+        call_command('loaddata', 'tests/fixtures/hotel_fixture.json')
+        call_command('loaddata', 'tests/fixtures/contato_fixture.json')
+        call_command('loaddata', 'tests/fixtures/beneficio_fixture.json')
+        call_command('loaddata', 'tests/fixtures/classe_fixture.json')
+        call_command('loaddata', 'tests/fixtures/quarto_fixture.json')
+        call_command('loaddata', 'tests/fixtures/cliente_fixture.json')
+        call_command('loaddata', 'tests/fixtures/reserva_fixture.json')
+        call_command('loaddata', 'tests/fixtures/pagamento_fixture.json')
+
+        context_processors.invalidate_hotel_snapshot()
+        self.payments = list(models.Payment.objects.select_related(
+            'reservation__client', 'reservation__room__room_class'
+        ))
+
+    def test_render_retorna_pdf(self):
+        """testa se o comprovante renderizado é um pdf"""
+        pdf = support.get_receipt_renderer().render(self.payments[0])
+        self.assertTrue(pdf.startswith(b'%PDF'))
+
+    def test_render_many_cria_uma_pagina_por_pagamento_com_cabecalho_unico(self):
+        """testa se o lote gera uma página por pagamento reutilizando o mesmo
+        form de cabeçalho"""
+        pdf = support.get_receipt_renderer().render_many(self.payments)
+
+        self.assertEqual(pdf.count(b'/Type /Page\n'), len(self.payments))
+        self.assertEqual(pdf.count(b'/Subtype /Form'), 1)
+
+    def test_renderer_reutilizado_sem_queries_enquanto_hotel_nao_muda(self):
+        """testa se o renderer é criado uma vez por processo e recriado
+        quando o hotel é alterado"""
+        renderer = support.get_receipt_renderer()
+
+        with self.assertNumQueries(0):
+            self.assertIs(support.get_receipt_renderer(), renderer)
+
+        hotel = Hotel.objects.get(pk=1)
+        hotel.name = 'outro hotel'
+        hotel.save()
+        new_renderer = support.get_receipt_renderer()
+        self.assertIsNot(new_renderer, renderer)
+        self.assertEqual(new_renderer.hotel.name, 'outro hotel')
+
+    def test_logo_decodificado_uma_unica_vez(self):
+        """testa se o logo do hotel é lido do disco uma única vez para
+        vários comprovantes"""
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            Image.new('RGB', (30, 30), 'red').save(f'{media}/logo.png')
+            Hotel.objects.filter(pk=1).update(logo='logo.png')
+            context_processors.invalidate_hotel_snapshot()
+
+            with patch('utils.support.ImageReader', wraps=support.ImageReader) as reader:
+                renderer = support.get_receipt_renderer()
+                for payment in self.payments:
+                    renderer.render(payment)
+
+            reader.assert_called_once()
+
+    def test_pdf_handler_reutiliza_comprovante_armazenado(self):
+        """testa se reenviar o comprovante por email reutiliza o pdf armazenado"""
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media, PRIVATE_STORAGE_ROOT=media):
+            renderer = support.get_receipt_renderer()
+            with patch.object(renderer, 'render', wraps=renderer.render) as render, \
+                    patch.object(support.PaymentPDFHandler, '_send_email') as send_email:
+                for _ in range(2):
+                    support.PaymentPDFHandler(self.payments[0]).handle()
+
+            render.assert_called_once()
+            self.assertEqual(send_email.call_args_list[0], send_email.call_args_list[1])
+
+    def test_benchmark_receipts(self):
+        """testa se o benchmark escreve os comprovantes por segundo de cada cenário"""
+        out = StringIO()
+        call_command('benchmark_receipts', batch=5, repeat=2, stdout=out)
+        self.assertEqual(out.getvalue().count('receipts/s'), 4)
+
+
+class TestRegenerateReceipts(TestCase):
+    def setUp(self):
+        call_command('loaddata', 'tests/fixtures/hotel_fixture.json')
+        call_command('loaddata', 'tests/fixtures/contato_fixture.json')
+        call_command('loaddata', 'tests/fixtures/beneficio_fixture.json')
+        call_command('loaddata', 'tests/fixtures/classe_fixture.json')
+        call_command('loaddata', 'tests/fixtures/quarto_fixture.json')
+        call_command('loaddata', 'tests/fixtures/cliente_fixture.json')
+        call_command('loaddata', 'tests/fixtures/reserva_fixture.json')
+        call_command('loaddata', 'tests/fixtures/pagamento_fixture.json')
+
+        media, private = tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.addCleanup(private.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name, PRIVATE_STORAGE_ROOT=private.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.private_root = private.name
+        context_processors.invalidate_hotel_snapshot()
+
+        for reservation in Reservation.objects.filter(payment_reservation__isnull=True)[:4]:
+            models.Payment.objects.create(reservation=reservation, amount=reservation.amount, status='F')
+        models.Payment.objects.update(status='F')
+        self.payments = list(models.Payment.objects.order_by('pk'))
+        self.store = support.ReceiptStore()
+
+    def _call(self, **options):
+        out, err = StringIO(), StringIO()
+        call_command('regenerate_receipts', workers=0, chunk_size=2, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_regenera_todos_os_comprovantes(self):
+        """testa se os comprovantes de todos os pagamentos são regenerados no storage"""
+        out, _ = self._call()
+
+        for payment in self.payments:
+            with self.subTest(payment=payment):
+                self.assertTrue(self.store.storage.exists(self.store.name(payment)))
+        self.assertIn(f'{len(self.payments)} receipts in', out)
+        self.assertIn('receipts/s', out)
+        self.assertFalse(self.store.storage.exists(regenerate_receipts.CHECKPOINT_NAME))
+
+    def test_substitui_comprovante_existente(self):
+        """testa se um comprovante já armazenado é renderizado novamente"""
+        payment = self.payments[0]
+        self.store.storage.save(self.store.name(payment), ContentFile(b'old'))
+
+        self._call()
+
+        self.assertTrue(self.store.get_or_render(payment).startswith(b'%PDF'))
+
+    def test_falhas_sao_reportadas_sem_interromper(self):
+        """testa se a falha de um pagamento é reportada e os demais continuam"""
+        failing = self.payments[1]
+        refresh = support.ReceiptStore.refresh
+
+        def fake_refresh(store, payment):
+            if payment.pk == failing.pk:
+                raise ValueError('broken')
+            return refresh(store, payment)
+
+        with patch('utils.support.ReceiptStore.refresh', fake_refresh):
+            out, err = self._call()
+
+        self.assertIn(f'payment {failing.pk} failed: broken', err)
+        self.assertIn(f'{len(self.payments) - 1} receipts in', out)
+        self.assertIn('1 failures', out)
+
+    def test_resume_continua_apos_ultimo_lote_concluido(self):
+        """testa se --resume continua a partir do checkpoint do último lote concluído"""
+        last_done = self.payments[1]
+        regenerate_receipts.Command._write_checkpoint(self.store, last_done.pk)
+
+        out, _ = self._call(resume=True)
+
+        self.assertIn(f'resuming after payment {last_done.pk}', out)
+        for payment in self.payments:
+            with self.subTest(payment=payment):
+                self.assertEqual(
+                    self.store.storage.exists(self.store.name(payment)),
+                    payment.pk > last_done.pk,
+                )
+
+    def test_checkpoint_gravado_de_forma_atomica_fora_do_media_root(self):
+        """testa se uma falha ao gravar o checkpoint mantém o anterior e se ele
+        fica no storage privado, com o nome exato"""
+        regenerate_receipts.Command._write_checkpoint(self.store, 3)
+        with patch('utils.support.os.replace', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                regenerate_receipts.Command._write_checkpoint(self.store, 7)
+
+        self.assertEqual(regenerate_receipts.Command._read_checkpoint(self.store), 3)
+        self.assertTrue(self.store.storage.path(regenerate_receipts.CHECKPOINT_NAME).startswith(self.private_root))
+        self.assertListEqual(
+            os.listdir(os.path.dirname(self.store.storage.path(regenerate_receipts.CHECKPOINT_NAME))),
+            ['regenerate.checkpoint'],
+        )
+
+    def test_refresh_nao_remove_o_comprovante_durante_a_gravacao(self):
+        """testa se o comprovante anterior continua disponível enquanto o novo
+        é gravado e se é substituído no mesmo nome"""
+        payment = self.payments[0]
+        name = self.store.name(payment)
+        self.store.write(name, b'old')
+
+        def assert_old_available(src, dst):
+            with open(dst, 'rb') as current:
+                self.assertEqual(current.read(), b'old')
+            return os.rename(src, dst)
+
+        with patch('utils.support.os.replace', side_effect=assert_old_available) as replace:
+            self.store.refresh(payment)
+
+        replace.assert_called_once()
+        self.assertTrue(self.store.get_or_render(payment).startswith(b'%PDF'))
+        self.assertListEqual(os.listdir(os.path.dirname(self.store.storage.path(name))), [os.path.basename(name)])
@@ -1,19 +1,29 @@
+import os
 import time
+import tempfile
 from datetime import datetime, timedelta
 from decimal import Decimal
-from django.test import TestCase
+from io import StringIO
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from utils.supportmodels import ReserveErrorMessages
+from django.utils import timezone
+from stripe.checkout import Session
 from django.urls import reverse
 from django.core.management import call_command
 from django.http import HttpResponseForbidden
-from reservations.models import Room, Reservation
+from reservations.models import Room, Reservation, RoomPopularity
 from clients.models import Client
-from payments.models import Payment
+from payments.models import Payment, StripeEvent
+from schedules.models import Scheduling
 from payments.views import Checkout
 from utils.supportviews import PaymentCancelMessages, CheckoutMessages
-from utils.supporttest import get_message
+from utils.supporttest import get_message, replay_stripe_event
+from utils.support import ReceiptStore, ReservationStripePaymentCreator, get_receipt_renderer
+from home import context_processors
 from unittest.mock import patch
 from http import HTTPStatus
-from django.db import OperationalError
+from django.db import OperationalError, connection
+from django.test.utils import CaptureQueriesContext
 
 class Base(TestCase):
     def setUp(self):
@@ -93,6 +103,8 @@ class TestCheckout(Base):
     def test_payment_created_successfully(self, fake_stripe_session):
         """testa se redireciona para a pagina de pagamento com reserva enviada corretamente"""
         fake_stripe_session.url = 'http://stripepayment-hostedpage.url'
+        fake_stripe_session.id = 'cs_test_session'
+        fake_stripe_session.expires_at = int(time.time()) + 30 * 60
 
         self.client.force_login(self.user)
         response = self.client.post(self.url, follow=True)
@@ -124,6 +136,8 @@ class TestCheckout(Base):
     def test_status_reserva_muda_para_P_e_quarto_fica_indisponivel(self, fake_stripe_session):
         """testa se muda o status da reserva para processando e o quarto para indisponível"""
         fake_stripe_session.url = 'http://stripepayment-hostedpage.url'
+        fake_stripe_session.id = 'cs_test_session'
+        fake_stripe_session.expires_at = int(time.time()) + 30 * 60
 
         self.client.force_login(self.user)
         self.client.post(self.url, follow=True)
@@ -140,6 +154,8 @@ class TestCheckout(Base):
     def test_status_cria_pagamento_corretamente(self, fake_stripe_session):
         """testa se o pagamento é criado corretamente no banco de dados"""
         fake_stripe_session.url = 'http://stripepayment-hostedpage.url'
+        fake_stripe_session.id = 'cs_test_session'
+        fake_stripe_session.expires_at = int(time.time()) + 30 * 60
 
         self.client.force_login(self.user)
         self.client.post(self.url, follow=True)
@@ -161,6 +177,55 @@ class TestCheckout(Base):
         
 
 
+    @patch('utils.support.ReservationStripePaymentCreator._create_session')
+    def test_session_do_stripe_guardada_no_pagamento(self, create_session):
+        """testa se o id, url e expiração da session são guardados no pagamento"""
+        expires_at = int(time.time()) + 30 * 60
+        create_session.return_value = Session.construct_from(
+            {'id': 'cs_test_1', 'url': 'http://stripepayment-hostedpage.url', 'expires_at': expires_at}, 'key'
+        )
+        self.client.force_login(self.user)
+        self.client.post(self.url)
+
+        payment = Payment.objects.get(reservation=self.reservation)
+        self.assertListEqual(
+            [payment.session_id, payment.session_url, int(payment.session_expires_at.timestamp())],
+            ['cs_test_1', 'http://stripepayment-hostedpage.url', expires_at],
+        )
+
+    @patch('utils.support.ReservationStripePaymentCreator._create_session')
+    def test_session_valida_reaproveitada_sem_chamar_stripe(self, create_session):
+        """testa se um novo envio do checkout com session ainda válida redireciona
+        para ela sem criar outra session no stripe"""
+        Payment.objects.create(
+            reservation=self.reservation, amount=self.reservation.amount, status='P',
+            session_id='cs_test_1', session_url='http://stripepayment-hostedpage.url',
+            session_expires_at=timezone.now() + timedelta(minutes=20),
+        )
+        self.client.force_login(self.user)
+        response = self.client.post(self.url)
+
+        self.assertRedirects(response, 'http://stripepayment-hostedpage.url', fetch_redirect_response=False)
+        create_session.assert_not_called()
+
+    def test_session_expirada_nao_e_reaproveitada(self):
+        """testa se a session expirada ou prestes a expirar não é reaproveitada"""
+        payment = Payment.objects.create(
+            reservation=self.reservation, amount=self.reservation.amount, status='P',
+            session_id='cs_test_1', session_url='http://stripepayment-hostedpage.url',
+            session_expires_at=timezone.now() + timedelta(seconds=30),
+        )
+        request = RequestFactory().post(self.url)
+        creator = ReservationStripePaymentCreator(request, self.reservation, 'payment_success', 'payment_cancel')
+        self.assertFalse(creator.reused)
+
+        payment.session_expires_at = timezone.now() + timedelta(minutes=20)
+        payment.save()
+        creator = ReservationStripePaymentCreator(request, self.reservation, 'payment_success', 'payment_cancel')
+        self.assertTrue(creator.reused)
+        self.assertEqual(creator.session.id, 'cs_test_1')
+
+
 class TestPayementSuccess(Base):
     def setUp(self):
         super().setUp()
@@ -180,23 +245,16 @@ class TestPayementSuccess(Base):
         response = self.client.get(self.url)
         self.assertTemplateUsed(response, self.template)
     
-    def test_payment_recebe_status_como_finalizado(self):
-        """testa se o pagamento é atualizado para status finalizado após
-        concluido
+    def test_pagina_de_sucesso_nao_altera_pagamento_nem_reserva(self):
+        """testa se a página de sucesso apenas exibe o pagamento, que é
+        finalizado pelo webhook do stripe
         """
         self.client.force_login(self.user)
         self.client.get(self.url)
-        payment = Payment.objects.get(pk=1)
-        self.assertEqual(payment.status, 'F')
-    
-    def test_reserva_e_ativa(self):
-        """testa se o a reserva é ativada corretamente"""
-        self.client.force_login(self.user)
-        self.client.get(self.url)
-        payment = Payment.objects.get(pk=1)
+        payment = Payment.objects.get(pk=self.payment.pk)
         self.assertListEqual(
-            [payment.reservation.status, payment.reservation.active],
-            ['A', True]
+            [payment.status, payment.reservation.status, payment.reservation.active],
+            ['P', 'I', False]
         )
 
     def test_cliente_nao_logado_nao_consegue_acessar_paginda_de_sucesso(self):
@@ -282,3 +340,386 @@ class TestPaymentCancel(Base):
 
             self.assertRedirects(response, reverse('rooms'))
             self.assertEqual(msg, PaymentCancelMessages.UNEXPECTED_ERROR)
+
+
+class TestPaymentReceipt(Base):
+    def setUp(self):
+        super().setUp()
+        media, private = tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.addCleanup(private.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name, PRIVATE_STORAGE_ROOT=private.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.media_root = media.name
+        context_processors.invalidate_hotel_snapshot()
+
+        self.payment = Payment.objects.create(
+            reservation=self.reservation,
+            status='F',
+            amount=self.reservation.amount
+        )
+        self.url = reverse('payment_receipt', args=(self.reservation.pk,))
+        self.url2 = reverse('payment_receipt', args=(self.reservation2.pk,))
+        self.next_url_field_name = 'next'
+
+    def test_envia_pdf_do_comprovante_com_etag(self):
+        """testa se o comprovante é enviado como pdf com ETag do comprovante
+        armazenado, gravado fora do MEDIA_ROOT servido publicamente"""
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+
+        store = ReceiptStore()
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['ETag'], f'"{ReceiptStore.etag(self.payment, store.stat(self.payment))}"')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        self.assertTrue(store.storage.exists(store.name(self.payment)))
+        self.assertFalse(store.storage.path(store.name(self.payment)).startswith(self.media_root))
+        self.assertListEqual(os.listdir(self.media_root), [])
+
+    def test_comprovante_regenerado_muda_o_etag(self):
+        """testa se após renderizar o comprovante novamente o ETag anterior
+        não retorna 304"""
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        b''.join(response.streaming_content)
+        etag = response['ETag']
+
+        store = ReceiptStore()
+        path = store.storage.path(store.name(self.payment))
+        store.refresh(self.payment)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_pagamento_consultado_uma_unica_vez(self):
+        """testa se o pagamento é consultado uma única vez pelo ETag, pelo
+        Last-Modified e pela view"""
+        self.client.force_login(self.user)
+        b''.join(self.client.get(self.url).streaming_content)
+        with CaptureQueriesContext(connection) as queries:
+            b''.join(self.client.get(self.url).streaming_content)
+        payment_queries = [q for q in queries if 'FROM "payments_payment"' in q['sql']]
+        self.assertEqual(len(payment_queries), 1)
+
+    def test_comprovante_renderizado_uma_unica_vez(self):
+        """testa se downloads seguintes reutilizam o pdf armazenado"""
+        self.client.force_login(self.user)
+        with patch('utils.support.ReceiptRenderer.render', wraps=get_receipt_renderer().render) as render:
+            for _ in range(3):
+                b''.join(self.client.get(self.url).streaming_content)
+
+        render.assert_called_once()
+
+    def test_retorna_304_se_cliente_ja_possui_comprovante(self):
+        """testa se o cliente recebe 304 ao enviar o ETag ou a data do comprovante atual"""
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        b''.join(response.streaming_content)
+        response = self.client.get(self.url)
+
+        for header, value in (
+            ('HTTP_IF_NONE_MATCH', response['ETag']),
+            ('HTTP_IF_MODIFIED_SINCE', response['Last-Modified']),
+        ):
+            with self.subTest(header=header):
+                result = self.client.get(self.url, **{header: value})
+                self.assertEqual(result.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_pagamento_nao_finalizado_retorna_404(self):
+        """testa se não há comprovante para pagamentos não finalizados"""
+        self.payment.status = 'P'
+        self.payment.save()
+        self.client.force_login(self.user)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_cliente_nao_logado_redirecionado_para_signin(self):
+        """testa se o cliente nao estiver logado ele é redirecionado para signin"""
+        response = self.client.get(self.url)
+        redirect_url = reverse('signin') + f'?{self.next_url_field_name}={self.url}'
+        self.assertRedirects(response, redirect_url)
+
+    def test_cliente_nao_acessa_comprovante_de_outro(self):
+        """testa se o cliente recebe 403 ao tentar baixar o comprovante de outro"""
+        self.client.force_login(self.user)
+        response = self.client.get(self.url2)
+        self.assertIsInstance(response, HttpResponseForbidden)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class TestStripeWebhook(Base):
+    def setUp(self):
+        super().setUp()
+        self.reservation.status = 'P'
+        self.reservation.save()
+        self.room.available = False
+        self.room.save()
+        self.payment = Payment.objects.create(
+            reservation=self.reservation,
+            status='P',
+            amount=self.reservation.amount,
+            session_id='cs_test_session',
+        )
+
+    def _replay(self, fixture, **kwargs):
+        return replay_stripe_event(self.client, fixture, 'whsec_test', **kwargs)
+
+    @patch('payments.tasks.enqueue_task')
+    def test_checkout_completo_finaliza_pagamento_e_ativa_reserva(self, enqueue):
+        """testa se o evento de checkout completo finaliza o pagamento, ativa
+        a reserva e enfileira o comprovante"""
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self._replay('checkout_session_completed')
+
+        self.payment.refresh_from_db()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertListEqual(
+            [self.payment.status, self.payment.reservation.status, self.payment.reservation.active],
+            ['F', 'A', True],
+        )
+        self.assertEqual(self.payment.reservation.reservation_nights.count(), len(self.reservation.nights))
+        enqueue.assert_called_once_with(
+            'payments.tasks.create_payment_pdf', self.payment.pk, task_name=f'create_payment_pdf_{self.payment.pk}'
+        )
+
+    @patch('payments.tasks.enqueue_task')
+    def test_checkout_completo_de_agendamento_marca_reserva_como_agendada(self, enqueue):
+        """testa se a reserva com agendamento fica agendada e não ativa"""
+        Scheduling.objects.create(client=self.user, reservation=self.reservation)
+        Reservation.objects.filter(pk=self.reservation.pk).update(status='I')
+
+        self._replay('checkout_session_completed')
+
+        self.reservation.refresh_from_db()
+        self.assertListEqual([self.reservation.status, self.reservation.active], ['S', False])
+
+    @patch('payments.tasks.enqueue_task')
+    def test_evento_repetido_aplicado_uma_unica_vez(self, enqueue):
+        """testa se reenvios do mesmo evento são registrados e ignorados"""
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(3):
+                response = self._replay('checkout_session_completed')
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        enqueue.assert_called_once()
+
+    @patch('payments.tasks.enqueue_task')
+    def test_checkout_completo_conta_na_popularidade_do_quarto_uma_vez(self, enqueue):
+        """testa se a reserva confirmada pelo webhook soma uma única vez na
+        popularidade do quarto, mesmo com eventos repetidos"""
+        for _ in range(2):
+            self._replay('checkout_session_completed')
+            self._replay('checkout_session_completed', event={'id': 'evt_other'})
+
+        popularity = RoomPopularity.objects.get(room=self.room)
+        self.assertListEqual([popularity.reservations, popularity.last_30_days, popularity.last_90_days], [1, 1, 1])
+
+    @patch('payments.tasks.enqueue_task')
+    def test_evento_fora_de_ordem_nao_altera_pagamento_finalizado(self, enqueue):
+        """testa se a expiração recebida depois da conclusão não cancela o pagamento"""
+        self._replay('checkout_session_completed')
+        self._replay('checkout_session_expired')
+
+        self.payment.refresh_from_db()
+        self.assertListEqual([self.payment.status, self.payment.reservation.status], ['F', 'A'])
+
+    def test_checkout_expirado_cancela_pagamento_e_libera_quarto(self):
+        """testa se o evento de checkout expirado cancela pagamento e reserva
+        e libera o quarto"""
+        self._replay('checkout_session_expired')
+
+        self.payment.refresh_from_db()
+        self.assertListEqual(
+            [self.payment.status, self.payment.reservation.status, self.payment.reservation.room.available],
+            ['C', 'C', True],
+        )
+
+    @patch('payments.tasks.enqueue_task')
+    def test_pagamento_encontrado_pela_reserva_de_referencia(self, enqueue):
+        """testa se o pagamento sem session guardada é encontrado pelo
+        client_reference_id da session"""
+        Payment.objects.filter(pk=self.payment.pk).update(session_id='')
+
+        self._replay('checkout_session_completed', session={'client_reference_id': str(self.reservation.pk)})
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'F')
+
+    @patch('payments.tasks.enqueue_task')
+    def test_session_nao_paga_nao_finaliza_pagamento(self, enqueue):
+        """testa se a session concluída sem pagamento, como a de um pagamento
+        assíncrono, não finaliza o pagamento até o evento de sucesso"""
+        response = self._replay('checkout_session_completed', session={'payment_status': 'unpaid'})
+
+        self.payment.refresh_from_db()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertListEqual([self.payment.status, self.payment.reservation.status], ['P', 'P'])
+        self.assertTrue(StripeEvent.objects.exists())
+
+        self._replay('checkout_session_completed', event={
+            'id': 'evt_async_succeeded', 'type': 'checkout.session.async_payment_succeeded',
+        })
+        self.payment.refresh_from_db()
+        self.assertListEqual([self.payment.status, self.payment.reservation.status], ['F', 'A'])
+
+    @patch('payments.tasks.enqueue_task')
+    def test_pagamento_cancelado_e_restabelecido_se_o_quarto_esta_livre(self, enqueue):
+        """testa se o pagamento cancelado pela expiração da reserva enquanto o
+        cliente pagava é finalizado e a reserva ativada caso o quarto continue livre"""
+        Payment.objects.filter(pk=self.payment.pk).update(status='C')
+        Reservation.objects.filter(pk=self.reservation.pk).update(status='C')
+        Room.objects.filter(pk=self.room.pk).update(available=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self._replay('checkout_session_completed')
+
+        self.payment.refresh_from_db()
+        self.assertListEqual(
+            [self.payment.status, self.payment.reservation.status, self.payment.reservation.room.available],
+            ['F', 'A', False],
+        )
+        self.assertEqual(self.payment.reservation.reservation_nights.count(), len(self.reservation.nights))
+        enqueue.assert_called_once_with(
+            'payments.tasks.create_payment_pdf', self.payment.pk, task_name=f'create_payment_pdf_{self.payment.pk}'
+        )
+
+    @patch('payments.tasks.enqueue_task')
+    def test_pagamento_cancelado_com_quarto_ocupado_e_reembolsado(self, enqueue):
+        """testa se o pagamento cancelado cujo quarto foi ocupado por outro
+        checkout é marcado para reembolso, sem reativar a reserva"""
+        Payment.objects.filter(pk=self.payment.pk).update(status='C')
+        Reservation.objects.filter(pk=self.reservation.pk).update(status='C')
+        Reservation.objects.create(
+            checkin=self.reservation.checkin,
+            checkout=self.reservation.checkout,
+            client=self.user2,
+            room=self.room,
+            amount=self.reservation.amount,
+            status='P',
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self._replay('checkout_session_completed')
+
+        self.payment.refresh_from_db()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertListEqual([self.payment.status, self.payment.reservation.status], ['R', 'C'])
+        self.assertFalse(self.payment.reservation.room.available)
+        enqueue.assert_called_once_with(
+            'payments.tasks.refund_payment', self.payment.pk, 'pi_test_payment',
+            task_name=f'refund_payment_{self.payment.pk}',
+        )
+
+    @patch('payments.tasks.enqueue_task')
+    def test_noites_ja_ocupadas_reembolsa_sem_falhar_o_webhook(self, enqueue):
+        """testa se a confirmação de uma reserva cujas noites já foram ocupadas
+        registra o evento, responde 200 e reembolsa em vez de levantar
+        IntegrityError, para que o stripe não reenvie o evento"""
+        other = Reservation.objects.create(
+            checkin=self.reservation.checkin,
+            checkout=self.reservation.checkout,
+            client=self.user2,
+            room=self.room,
+            amount=self.reservation.amount,
+            status='A',
+            active=True,
+        )
+        other.sync_nights()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self._replay('checkout_session_completed')
+
+        self.payment.refresh_from_db()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(StripeEvent.objects.filter(event_id='evt_test_checkout_session_completed').exists())
+        self.assertListEqual([self.payment.status, self.payment.reservation.status], ['R', 'C'])
+        self.assertFalse(self.payment.reservation.reservation_nights.exists())
+        self.assertEqual(other.reservation_nights.count(), len(other.nights))
+        self.assertEqual(RoomPopularity.objects.get(room=self.room).reservations, 1)
+        enqueue.assert_called_once()
+
+    def test_assinatura_invalida_retorna_400(self):
+        """testa se eventos com assinatura inválida são recusados sem alterar nada"""
+        response = replay_stripe_event(self.client, 'checkout_session_completed', 'whsec_other')
+
+        self.payment.refresh_from_db()
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(self.payment.status, 'P')
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_evento_desconhecido_e_ignorado(self):
+        """testa se tipos de eventos não tratados retornam 200 sem efeito"""
+        response = self._replay('checkout_session_completed', event={'type': 'customer.created'})
+
+        self.payment.refresh_from_db()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(self.payment.status, 'P')
+
+
+class TestCheckoutConcurrency(TransactionTestCase):
+    def setUp(self):
+        call_command('loaddata', 'tests/fixtures/hotel_fixture.json')
+        call_command('loaddata', 'tests/fixtures/beneficio_fixture.json')
+        call_command('loaddata', 'tests/fixtures/classe_fixture.json')
+        call_command('loaddata', 'tests/fixtures/quarto_fixture.json')
+        call_command('loaddata', 'tests/fixtures/cliente_fixture.json')
+
+    def test_checkouts_concorrentes_ocupam_o_quarto_uma_unica_vez(self):
+        """testa se entre vários checkouts simultâneos para o mesmo quarto apenas
+        um é aceito e os demais são recusados sem erros de bloqueio"""
+        out = StringIO()
+        call_command('stress_checkout', room=1, client=1, attempts=16, threads=8, stdout=out)
+
+        self.assertIn('1 succeeded, 15 refused, 0 blocked, 0 failed, 0 double bookings', out.getvalue())
+        self.assertFalse(Reservation.objects.exists())
+
+    @patch('utils.support.ReservationStripePaymentCreator._create_session')
+    def test_quarto_ocupado_recusa_checkout_sem_criar_session(self, create_session):
+        """testa se o checkout de um quarto já ocupado é recusado com a mensagem
+        correta sem criar a session do stripe"""
+        user = Client.objects.get(pk=1)
+        room = Room.objects.get(pk=1)
+        room.available = False
+        room.save()
+        reservation = Reservation.objects.create(
+            client=user, room=room, amount=room.daily_price,
+            checkin=datetime.now().date(), checkout=datetime.now().date() + timedelta(days=1),
+        )
+
+        self.client.force_login(user)
+        response = self.client.post(reverse('checkout', args=(reservation.pk,)))
+
+        self.assertRedirects(response, reverse('rooms'))
+        self.assertEqual(get_message(response), ReserveErrorMessages.UNAVAILABLE_ROOM)
+        create_session.assert_not_called()
+        self.assertFalse(Payment.objects.exists())
+        self.assertEqual(Reservation.objects.get(pk=reservation.pk).status, 'I')
+
+    @patch('utils.support.ReservationStripePaymentCreator._create_session')
+    def test_reserva_cancelada_pelo_sweeper_recusa_checkout_sem_ocupar_quarto(self, create_session):
+        """testa se o checkout de uma reserva já cancelada por
+        release_expired_holds é recusado sem ocupar o quarto nem criar a
+        session do stripe"""
+        user = Client.objects.get(pk=1)
+        room = Room.objects.get(pk=1)
+        reservation = Reservation.objects.create(
+            client=user, room=room, amount=room.daily_price,
+            checkin=datetime.now().date(), checkout=datetime.now().date() + timedelta(days=1),
+        )
+        Reservation.objects.filter(pk=reservation.pk).update(status='C')
+
+        self.client.force_login(user)
+        response = self.client.post(reverse('checkout', args=(reservation.pk,)))
+
+        self.assertRedirects(response, reverse('rooms'))
+        self.assertEqual(get_message(response), CheckoutMessages.EXPIRED_RESERVATION)
+        create_session.assert_not_called()
+        self.assertFalse(Payment.objects.exists())
+        self.assertTrue(Room.objects.get(pk=1).available)
+        self.assertEqual(Reservation.objects.get(pk=reservation.pk).status, 'C')
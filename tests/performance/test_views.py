@@ -0,0 +1,271 @@
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.admin import site as admin_site
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from clients.models import Client
+from home import context_processors
+from payments.models import Payment
+from reservations.models import Benefit, Class, Reservation, Room
+from schedules.models import Scheduling
+from utils.supportcache import bump_catalog_version
+from utils.supporttest import replay_stripe_event
+
+ROOMS = 300
+CLIENTS = 200
+RESERVATIONS = 20000
+BATCH_SIZE = 2000
+
+# tempo máximo de cada requisição, folgado para não falhar por ruído da máquina
+LATENCY_CEILING = float(os.getenv('PERF_LATENCY_CEILING', 1000))  # ms
+RESULTS_FILE = os.getenv('PERF_RESULTS_FILE', settings.BASE_DIR / 'perf_results.jsonl')
+WEBHOOK_SECRET = 'whsec_performance'
+
+
+def build_dataset(seed: int = 0) -> dict:
+    """cria com bulk_create o volume de dados usado nos testes de performance:
+    `ROOMS` quartos, `CLIENTS` clientes e `RESERVATIONS` reservas finalizadas
+    ou canceladas nos últimos dois anos com seus pagamentos. O primeiro cliente
+    recebe ainda uma reserva ativa, uma agendada e uma iniciada.
+
+    Returns:
+        dict: cliente, administrador e reservas usados nas urls testadas
+    """
+    rng = random.Random(seed)
+    today = timezone.now().date()
+    for fixture in ('hotel', 'contato', 'beneficio', 'classe', 'servico'):
+        call_command('loaddata', f'tests/fixtures/{fixture}_fixture.json', verbosity=0)
+
+    classes = list(Class.objects.all())
+    Room.objects.bulk_create(
+        Room(
+            number=str(100 + i), room_class=classes[i % len(classes)], hotel_id=1,
+            adult_capacity=rng.randint(1, 4), child_capacity=rng.randint(0, 99),
+            size=rng.randint(20, 80), daily_price=Decimal(rng.randint(150, 900)),
+            short_desc=f'quarto {100 + i}', image='test/room_test.jpg',
+        )
+        for i in range(ROOMS)
+    )
+    rooms = list(Room.objects.order_by('pk'))
+    benefits = list(Benefit.objects.all())
+    Room.benefit.through.objects.bulk_create(
+        Room.benefit.through(room=room, benefit=benefit)
+        for room in rooms for benefit in rng.sample(benefits, rng.randint(1, len(benefits)))
+    )
+
+    password = make_password('Perf@1234')
+    Client.objects.bulk_create(
+        Client(
+            username=f'perfclient{i}', password=password, first_name='Perf', last_name='Client',
+            email=f'perf{i}@email.com', phone=f'279{i:08d}', cpf=f'{i:011d}',
+            birthdate=today - timedelta(days=365 * 30),
+        )
+        for i in range(CLIENTS)
+    )
+    clients = list(Client.objects.filter(username__startswith='perfclient').order_by('pk'))
+    client = clients[0]
+    admin = Client.objects.create(
+        username='perfadmin', password=password, first_name='Perf', last_name='Admin',
+        email='perfadmin@email.com', phone='27999999999', cpf='99999999999',
+        birthdate=today - timedelta(days=365 * 30), is_staff=True, is_superuser=True,
+    )
+
+    reservations = []
+    for i in range(RESERVATIONS):
+        room = rng.choice(rooms)
+        checkin = today - timedelta(days=rng.randint(30, 730))
+        checkout = checkin + timedelta(days=rng.randint(1, 7))
+        reservations.append(Reservation(
+            checkin=checkin, checkout=checkout, room=room,
+            client=client if i % 100 == 0 else rng.choice(clients),
+            amount=room.daily_price * (checkout - checkin).days,
+            status='F' if rng.random() < .9 else 'C',
+            created_at=timezone.now() - timedelta(days=(today - checkin).days + rng.randint(1, 30)),
+        ))
+    for start in range(0, len(reservations), BATCH_SIZE):
+        Reservation.objects.bulk_create(reservations[start:start + BATCH_SIZE])
+
+    Payment.objects.bulk_create(
+        (
+            Payment(reservation_id=pk, amount=amount, status=status)
+            for pk, amount, status in Reservation.objects.values_list('pk', 'amount', 'status').iterator()
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+    active_room, scheduled_room, free_room = rooms[0], rooms[0], rooms[1]
+    Room.objects.filter(pk=active_room.pk).update(available=False)
+    active = Reservation.objects.create(
+        checkin=today, checkout=today + timedelta(days=3), room=active_room, client=client,
+        amount=active_room.daily_price * 3, status='A', active=True,
+    )
+    scheduled = Reservation.objects.create(
+        checkin=today + timedelta(days=5), checkout=today + timedelta(days=7), room=scheduled_room,
+        client=client, amount=scheduled_room.daily_price * 2, status='S',
+    )
+    Payment.objects.create(reservation=active, amount=active.amount, status='F')
+    Payment.objects.create(
+        reservation=scheduled, amount=scheduled.amount, status='P', session_id='cs_test_session',
+    )
+    Scheduling.objects.create(client=client, reservation=scheduled)
+    started = Reservation.objects.create(
+        checkin=today + timedelta(days=1), checkout=today + timedelta(days=2), room=free_room,
+        client=client, amount=free_room.daily_price,
+    )
+    return {
+        'client': client,
+        'guest': clients[1],
+        'admin': admin,
+        'room': free_room,
+        'finalized': Reservation.objects.filter(client=client, status='F').first(),
+        'active': active,
+        'scheduled': scheduled,
+        'started': started,
+    }
+
+
+@tag('performance')
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET, SQL_INSTRUMENTATION_SAMPLE_RATE=0)
+class TestQueryBudgets(TestCase):
+    """garante um número máximo de queries e um tempo máximo de resposta para
+    cada url do projeto com um volume de dados realista. Uma query por item
+    listado (N+1) estoura o orçamento. Os resultados são adicionados como uma
+    linha JSON em PERF_RESULTS_FILE para acompanhar a evolução.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.results = []
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = build_dataset()
+
+    @classmethod
+    def tearDownClass(cls):
+        with open(RESULTS_FILE, 'a') as file:
+            file.write(json.dumps({
+                'time': timezone.now().isoformat(),
+                'volume': {'rooms': ROOMS, 'clients': CLIENTS, 'reservations': RESERVATIONS},
+                'results': cls.results,
+            }) + '\n')
+        super().tearDownClass()
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name, PRIVATE_STORAGE_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        context_processors.invalidate_hotel_snapshot()
+
+    def cases(self) -> list[tuple]:
+        """(nome, usuário logado, método, url, dados, máximo de queries) das
+        urls que apenas leem dados, incluindo o changelist de cada model
+        registrado no admin"""
+        data = self.data
+        client, guest, admin = data['client'].pk, data['guest'].pk, data['admin'].pk
+        search = {
+            'checkin': str(timezone.now().date() + timedelta(days=10)),
+            'checkout': str(timezone.now().date() + timedelta(days=12)),
+            'adults': 1, 'children': 0,
+        }
+        cases = [
+            ('home', None, 'get', reverse('home'), None, 3),
+            ('rooms', None, 'get', reverse('rooms'), None, 4),
+            ('rooms_search', None, 'get', reverse('rooms_search'), search, 4),
+            ('room', None, 'get', reverse('room', args=(data['room'].pk,)), None, 3),
+            ('signup', None, 'get', reverse('signup'), None, 1),
+            ('signin', None, 'get', reverse('signin'), None, 7),
+            ('rooms_logged', client, 'get', reverse('rooms'), None, 7),
+            ('perfil', client, 'get', reverse('perfil', args=(client,)), None, 3),
+            ('update_perfil', client, 'get', reverse('update_perfil', args=(client,)), None, 3),
+            ('update_perfil_password', client, 'get', reverse('update_perfil_password', args=(client,)), None, 2),
+            ('delete_perfil', client, 'get', reverse('delete_perfil', args=(client,)), None, 3),
+            ('reserve', guest, 'get', reverse('reserve', args=(data['room'].pk,)), None, 3),
+            ('schedule', client, 'get', reverse('schedule', args=(data['active'].room_id,)), None, 2),
+            ('reservations_history', client, 'get', reverse('reservations_history'), None, 3),
+            ('reservation_history', client, 'get', reverse('reservation_history', args=(data['finalized'].pk,)), None, 5),
+            ('checkout', client, 'get', reverse('checkout', args=(data['started'].pk,)), None, 7),
+            ('payment_success', client, 'get', reverse('payment_success', args=(data['active'].pk,)), None, 5),
+            ('schedule_success', client, 'get', reverse('schedule_success', args=(data['scheduled'].pk,)), None, 5),
+            ('payment_receipt', client, 'get', reverse('payment_receipt', args=(data['active'].pk,)), None, 7),
+            ('admin_index', admin, 'get', reverse('admin:index'), None, 3),
+        ]
+        for model in sorted(admin_site._registry, key=lambda model: model._meta.label):
+            meta = model._meta
+            url = reverse(f'admin:{meta.app_label}_{meta.model_name}_changelist')
+            # os changelists do django-axes contam os registros e montam os filtros por data
+            budget = 8 if meta.app_label == 'axes' else 6
+            cases.append((f'admin_{meta.model_name}', admin, 'get', url, None, budget))
+        return cases
+
+    def mutations(self) -> list[tuple]:
+        """urls que alteram dados, medidas na primeira requisição"""
+        data = self.data
+        client = data['client'].pk
+        return [
+            ('stripe_webhook', None, 'webhook', 'checkout_session_completed', None, 14),
+            ('payment_cancel', client, 'get', reverse('payment_cancel', args=(data['started'].pk,)), None, 5),
+            ('logout', client, 'get', reverse('logout'), None, 6),
+        ]
+
+    def request(self, method: str, url: str, data: dict | None):
+        if method == 'webhook':
+            return replay_stripe_event(self.client, url, WEBHOOK_SECRET)
+        return getattr(self.client, method)(url, data)
+
+    def measure(self, method: str, url: str, data: dict | None) -> tuple:
+        """(resposta, queries capturadas, milissegundos) de uma requisição"""
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = self.request(method, url, data)
+            elapsed = (time.perf_counter() - start) * 1000
+        return response, queries, elapsed
+
+    def test_queries_e_latencia_por_url(self):
+        """testa se cada url executa no máximo o número de queries do orçamento,
+        independente do volume de dados, e responde abaixo de LATENCY_CEILING.
+        As urls de leitura são medidas com os fragmentos do catálogo fora do
+        cache, para que uma query por item dentro de um fragmento cacheado
+        estoure o orçamento, e de novo com o cache preenchido, que não pode
+        executar mais queries"""
+        cases = [(case, True) for case in self.cases()] + [(case, False) for case in self.mutations()]
+        for (name, user, method, url, data, budget), read_only in cases:
+            with self.subTest(url=name):
+                self.client.logout()
+                if user is not None:
+                    self.client.force_login(Client.objects.get(pk=user))
+                if read_only:
+                    self.request(method, url, data)  # carrega templates e conexões
+                    bump_catalog_version()
+
+                response, queries, elapsed = self.measure(method, url, data)
+                result = {
+                    'name': name, 'status': response.status_code, 'queries': len(queries),
+                    'budget': budget, 'ms': round(elapsed, 2), 'ceiling': LATENCY_CEILING,
+                }
+                if read_only:
+                    _, warm_queries, _ = self.measure(method, url, data)
+                    result['warm_queries'] = len(warm_queries)
+                self.results.append(result)
+
+                self.assertLess(response.status_code, 400)
+                self.assertLessEqual(
+                    len(queries), budget,
+                    '\n'.join(query['sql'] for query in queries.captured_queries),
+                )
+                if read_only:
+                    self.assertLessEqual(len(warm_queries), len(queries))
+                self.assertLess(elapsed, LATENCY_CEILING)
@@ -0,0 +1,66 @@
+import json
+import tempfile
+from io import StringIO
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+from clients.models import Client
+from payments.models import Payment
+from reservations.management.commands.loadtest_funnel import STEPS, percentile
+from reservations.models import Reservation, Room
+
+
+class TestLoadtestFunnel(TransactionTestCase):
+    def setUp(self):
+        for fixture in ('hotel', 'contato', 'beneficio', 'classe', 'quarto', 'cliente'):
+            call_command('loaddata', f'tests/fixtures/{fixture}_fixture.json', verbosity=0)
+        Room.objects.update(available=True)
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def run_command(self, **options) -> dict:
+        out = StringIO()
+        call_command('loadtest_funnel', json=True, stdout=out, **options)
+        return json.loads(out.getvalue())
+
+    def test_percorre_o_funil_com_stubs_e_reporta_cada_etapa(self):
+        """testa se os usuários virtuais completam o funil com o captcha e o
+        stripe locais e se cada etapa tem requisições e percentis"""
+        summary = self.run_command(users=2, iterations=2, workers=1, rooms=2)
+        self.assertEqual(summary['funnels'], {'ok': 4})
+        self.assertEqual(list(summary['steps']), list(STEPS))
+        for stats in summary['steps'].values():
+            self.assertEqual(stats['requests'], 4)
+            self.assertEqual(stats['errors'], 0)
+            self.assertLessEqual(stats['p50'], stats['p95'])
+            self.assertLessEqual(stats['p95'], stats['p99'])
+        self.assertEqual(summary['server_errors'], {})
+
+    def test_remove_os_dados_criados(self):
+        """testa se os clientes, reservas e pagamentos criados são removidos e
+        os quartos ficam disponíveis ao final"""
+        clients, reservations = Client.objects.count(), Reservation.objects.count()
+        self.run_command(users=2, iterations=1, workers=2)
+        self.assertEqual(Client.objects.count(), clients)
+        self.assertEqual(Reservation.objects.count(), reservations)
+        self.assertFalse(Payment.objects.filter(session_id__startswith='cs_load_').exists())
+        self.assertFalse(Room.objects.filter(available=False).exists())
+
+    def test_relatorio_em_texto(self):
+        """testa se o relatório mostra a vazão e uma linha por etapa"""
+        out = StringIO()
+        call_command('loadtest_funnel', users=1, iterations=1, stdout=out)
+        output = out.getvalue()
+        self.assertIn('funnels/s', output)
+        for step in STEPS:
+            self.assertIn(step, output)
+
+    def test_percentile(self):
+        """testa o percentil nearest-rank"""
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([], 99), 0)
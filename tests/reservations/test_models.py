@@ -1,8 +1,9 @@
 from datetime import datetime, timedelta
 from decimal import Decimal
 from django.test import TestCase
+from django.utils import timezone
 from django.core.management import call_command
-from reservations.models import Class, Room, Benefit, Reservation
+from reservations.models import Class, Room, Benefit, Reservation, RoomNight, RoomPopularity
 from clients.models import Client
 from home.models import Hotel
 from utils.supportmodels import (
@@ -14,6 +15,9 @@ from utils.supportmodels import (
     BenefitErrorMessages
 )
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction, connection
+from unittest import skipUnless
+from unittest.mock import patch
 from PIL import Image
 import tempfile
 import os
@@ -221,23 +225,31 @@ class TestRoom(BaseTestReservations):
             
             setattr(self.valid_room, case_attr, old)
        
-    def test_imagem_redimensionada_apos_salvar(self):
-        """testa se a imagem é redimensionada corretamente após
-        salva
+    @patch('utils.supportimages.enqueue_task')
+    def test_imagem_original_mantida_e_variantes_enfileiradas_apos_salvar(self, mock_enqueue):
+        """testa se a imagem original não é alterada ao salvar e se a task das
+        variantes é enfileirada após o commit apenas quando a imagem muda
         """
         img_path = 'test/room_test.jpg'
-        img = Image.open('media/' + img_path)
-        img = img.resize((800,600))
-        self.assertTupleEqual(img.size, (800, 600))
-        img.close()
+        with Image.open('media/' + img_path) as img:
+            original_size = img.size
 
         self.valid_room.image = img_path
-        self.valid_room.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.valid_room.save()
 
-        self.assertTupleEqual(
-            (self.valid_room.image.width, self.valid_room.image.height),
-            RoomRules.IMAGE_SIZE
+        self.assertTupleEqual((self.valid_room.image.width, self.valid_room.image.height), original_size)
+        task = 'reservations.tasks.create_room_image_variants'
+        mock_enqueue.assert_called_once_with(task, self.valid_room.pk, task_name=f'{task}_{self.valid_room.pk}')
+
+        mock_enqueue.reset_mock()
+        Room.objects.filter(pk=self.valid_room.pk).update(
+            image_variants={'source': img_path, 'formats': {}}
         )
+        self.valid_room.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.valid_room.save()
+        mock_enqueue.assert_not_called()
 
     def test_imagem_com_nome_invalido(self):
         """testa se levanta ValidationError com a msg correta
@@ -497,3 +509,218 @@ class TestReserva(BaseTestReservations):
         expected = f"{date_1} a {date_2}, e {date_3} para frente."
         result = Reservation.available_dates(self.room)
         self.assertEqual(result, expected)
+
+
+class TestRoomNight(BaseTestReservations):
+    def setUp(self) -> None:
+        super().setUp()
+        call_command('loaddata', 'tests/fixtures/quarto_fixture.json')
+        call_command('loaddata', 'tests/fixtures/cliente_fixture.json')
+
+        self.room = Room.objects.get(pk=1)
+        self.checkin = datetime.now().date()
+        self.reservation = Reservation.objects.create(
+            client=Client.objects.get(pk=1),
+            checkin=self.checkin,
+            checkout=self.checkin + timedelta(days=3),
+            amount=Decimal('300'),
+            room=self.room,
+        )
+
+    def test_reserva_iniciada_nao_ocupa_noites(self):
+        """testa se reservas que não estão ativas ou agendadas não ocupam
+        noites no ledger"""
+        self.assertFalse(RoomNight.objects.filter(reservation=self.reservation).exists())
+
+    def test_reserva_ativa_ou_agendada_ocupa_uma_linha_por_noite(self):
+        """testa se reservas ativas ou agendadas ocupam uma linha por noite,
+        do check-in até a véspera do check-out"""
+        for stt in ['A', 'S']:
+            with self.subTest(status=stt):
+                self.reservation.status = stt
+                self.reservation.save()
+
+                result = list(
+                    RoomNight.objects.filter(reservation=self.reservation)
+                    .order_by('night').values_list('night', flat=True)
+                )
+                expected = [self.checkin + timedelta(days=d) for d in range(3)]
+                self.assertListEqual(result, expected)
+
+    def test_reserva_cancelada_ou_finalizada_libera_as_noites(self):
+        """testa se as noites são removidas do ledger quando a reserva
+        é cancelada ou finalizada"""
+        for stt in ['C', 'F']:
+            with self.subTest(status=stt):
+                self.reservation.status = 'A'
+                self.reservation.save()
+
+                self.reservation.status = stt
+                self.reservation.save()
+                self.assertFalse(RoomNight.objects.filter(reservation=self.reservation).exists())
+
+    def test_alterar_datas_da_reserva_atualiza_as_noites(self):
+        """testa se alterar as datas de uma reserva ativa atualiza o ledger"""
+        self.reservation.status = 'A'
+        self.reservation.save()
+
+        self.reservation.checkout = self.checkin + timedelta(days=1)
+        self.reservation.save()
+
+        result = list(RoomNight.objects.filter(reservation=self.reservation).values_list('night', flat=True))
+        self.assertListEqual(result, [self.checkin])
+
+    def test_noite_ja_ocupada_levanta_integrity_error(self):
+        """testa se o banco de dados impede duas reservas ativas ou agendadas
+        de ocuparem a mesma noite do mesmo quarto"""
+        self.reservation.status = 'A'
+        self.reservation.save()
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Reservation.objects.create(
+                client=Client.objects.get(pk=2),
+                checkin=self.checkin + timedelta(days=2),
+                checkout=self.checkin + timedelta(days=4),
+                amount=Decimal('200'),
+                room=self.room,
+                status='S',
+            )
+
+    def test_reserva_que_termina_no_checkin_de_outra_nao_sobrepoe(self):
+        """testa se uma reserva com check-out no dia do check-in de uma
+        reserva ativa é considerada disponível"""
+        self.reservation.status = 'A'
+        self.reservation.save()
+
+        reservation = Reservation(
+            checkin=self.checkin + timedelta(days=3),
+            checkout=self.checkin + timedelta(days=5),
+            room=self.room,
+        )
+        errors = {}
+        reservation._validate_date_availability(errors, 'checkin')
+        self.assertDictEqual(errors, {})
+
+
+class TestRoomPopularity(BaseTestReservations):
+    def setUp(self) -> None:
+        super().setUp()
+        call_command('loaddata', 'tests/fixtures/quarto_fixture.json')
+        call_command('loaddata', 'tests/fixtures/cliente_fixture.json')
+        self.room = Room.objects.get(pk=1)
+        self.checkin = datetime.now().date()
+        self.reservation = Reservation.objects.create(
+            client=Client.objects.get(pk=1),
+            checkin=self.checkin,
+            checkout=self.checkin + timedelta(days=3),
+            amount=Decimal('300'),
+            room=self.room,
+        )
+
+    def popularity(self) -> list:
+        popularity = RoomPopularity.objects.filter(room=self.room).first()
+        if popularity is None:
+            return [0, 0, 0]
+        return [popularity.reservations, popularity.last_30_days, popularity.last_90_days]
+
+    def test_reserva_conta_ao_entrar_em_status_contado(self):
+        """testa se a reserva conta uma única vez ao passar para um status
+        finalizado, ativo ou agendado e deixa de contar ao ser cancelada"""
+        self.assertEqual(self.popularity(), [0, 0, 0])
+        for stt, expected in [('P', 0), ('S', 1), ('A', 1), ('F', 1), ('C', 0), ('C', 0)]:
+            with self.subTest(status=stt):
+                self.reservation.status = stt
+                self.reservation.save()
+                self.assertEqual(self.popularity(), [expected] * 3)
+
+    def test_reserva_carregada_do_banco_nao_conta_duas_vezes(self):
+        """testa se salvar novamente uma reserva já contada, carregada do
+        banco, não altera a popularidade"""
+        self.reservation.status = 'A'
+        self.reservation.save()
+        reservation = Reservation.objects.get(pk=self.reservation.pk)
+        reservation.observations = 'alterada'
+        reservation.save()
+        self.assertEqual(self.popularity(), [1, 1, 1])
+
+        reservation.delete()
+        self.assertEqual(self.popularity(), [0, 0, 0])
+
+    def test_janelas_consideram_a_data_de_criacao(self):
+        """testa se uma reserva antiga conta apenas no total e na janela que
+        contém a sua data de criação"""
+        self.reservation.created_at = timezone.now() - timedelta(days=60)
+        self.reservation.status = 'F'
+        self.reservation.save()
+        self.assertEqual(self.popularity(), [1, 0, 1])
+
+    def test_contador_nunca_fica_negativo(self):
+        """testa se decrementos sem reserva contada mantêm o contador em zero"""
+        RoomPopularity.record(self.room.pk, 1, timezone.now())
+        RoomPopularity.record(self.room.pk, -1, timezone.now())
+        RoomPopularity.record(self.room.pk, -1, timezone.now())
+        self.assertEqual(self.popularity(), [0, 0, 0])
+
+    def test_ranking_ordena_pela_janela(self):
+        """testa se o ranking ordena os quartos pelo contador da janela e
+        ignora quartos sem reservas"""
+        RoomPopularity.record(1, 1, timezone.now() - timedelta(days=60))
+        RoomPopularity.record(1, 1, timezone.now() - timedelta(days=60))
+        RoomPopularity.record(2, 1, timezone.now())
+        RoomPopularity.record(3, 1, timezone.now())
+        RoomPopularity.record(3, -1, timezone.now())
+
+        self.assertEqual([room.pk for room in RoomPopularity.ranking()], [1, 2])
+        self.assertEqual([room.pk for room in RoomPopularity.ranking(days=30)], [2])
+        self.assertEqual([room.pk for room in RoomPopularity.ranking(1, days=90)], [1])
+
+    @skipUnless(connection.vendor == 'sqlite', 'plano de execução específico do SQLite')
+    def test_ranking_usa_indice(self):
+        """testa se cada ranking é lido pelo índice do seu contador, sem ordenar
+        a tabela"""
+        for days, field in RoomPopularity.WINDOWS.items():
+            with self.subTest(days=days):
+                plan = RoomPopularity.objects.filter(**{f'{field}__gt': 0}).order_by(f'-{field}', 'room_id')[:4].explain()
+                self.assertRegex(plan, r'USING (COVERING )?INDEX', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'plano de execução específico do SQLite')
+class TestReservationIndexes(BaseTestReservations):
+    def setUp(self) -> None:
+        super().setUp()
+        call_command('loaddata', 'tests/fixtures/quarto_fixture.json')
+        call_command('loaddata', 'tests/fixtures/cliente_fixture.json')
+        self.room = Room.objects.get(pk=1)
+        self.user = Client.objects.get(pk=1)
+        self.today = datetime.now().date()
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertRegex(plan, rf'USING (COVERING )?INDEX {index}\b', plan)
+
+    def test_queries_quentes_usam_os_indices_compostos(self):
+        """testa se as consultas mais frequentes de reservas são resolvidas
+        pelos índices compostos e parcial e não pelos índices das chaves
+        estrangeiras, que já atendem buscas apenas por quarto ou cliente"""
+        queries = {
+            'available_dates': (
+                Reservation.objects.filter(room=self.room, status__in=['A', 'S']),
+                'reservation_room_status_idx',
+            ),
+            'reservations_on': (
+                self.user.reservation_clients.filter(status__in=['A', 'S']),
+                'reservation_client_status_idx',
+            ),
+            'reservations_history': (
+                Reservation.objects.filter(client__exact=self.user, status__in=['A', 'S', 'C', 'F']),
+                'reservation_client_status_idx',
+            ),
+            'check_reservation_dates': (
+                Reservation.objects.filter(active=True, checkout__lte=self.today),
+                'reservation_active_idx',
+            ),
+        }
+        for name, (queryset, index) in queries.items():
+            with self.subTest(query=name):
+                self.assertUsesIndex(queryset, index)
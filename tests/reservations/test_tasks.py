@@ -1,10 +1,22 @@
+import os
+import tempfile
 from datetime import datetime, timedelta
 from unittest.mock import patch
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.core import mail
+from django.core.mail import get_connection
 from django.core.management import call_command
-from reservations.models import Reservation
+from django.utils import timezone
+from reservations.models import Reservation, Room, RoomNight, RoomPopularity
 from payments.models import Payment
-from reservations.tasks import check_reservation_dates, release_room
+from clients.models import Client
+from reservations.tasks import (
+    check_reservation_dates, create_room_image_variants, release_room, release_expired_holds, rebuild_room_popularity
+)
+from PIL import Image, features
+from utils import supportimages
+from utils.supportmodels import RoomRules
+from utils.supportviews import ReserveSupport
 
 class TestTasks(TestCase):
     def setUp(self) -> None:
@@ -21,6 +33,7 @@ class TestTasks(TestCase):
         """
         for r in Reservation.objects.all():
             r.checkout = datetime.now().date() - timedelta(days=1)
+            r.checkin = r.checkout  # evita sobrepor noites do mesmo quarto
             r.active = True
             r.room.available = False
             r.room.save()
@@ -35,6 +48,76 @@ class TestTasks(TestCase):
                     [False, 'F', True],
                 )
         
+    def _expire_all(self):
+        """torna todas as reservas ativas e vencidas, cada uma ocupando uma
+        noite própria no ledger, sem sobrepor as de outra reserva do quarto"""
+        for i, r in enumerate(Reservation.objects.all()):
+            r.checkout = datetime.now().date() - timedelta(days=1 + 2 * i)
+            r.checkin = r.checkout - timedelta(days=1)
+            r.active = True
+            r.status = 'A'
+            r.room.available = False
+            r.room.save()
+            r.save()
+        self.assertEqual(RoomNight.objects.count(), Reservation.objects.count())
+
+    def test_check_reservation_dates_envia_email_aos_clientes_e_resumo_aos_admins(self):
+        """testa se cada cliente recebe um email e os admins recebem um único
+        resumo com todas as reservas expiradas, pela mesma conexão"""
+        self._expire_all()
+        expired = Reservation.objects.count()
+        Client.objects.filter(pk=1).update(is_staff=True)
+
+        with patch('utils.supporttasks.get_connection', wraps=get_connection) as mock_connection:
+            result = check_reservation_dates()
+
+        self.assertEqual(result, expired)
+        mock_connection.assert_called_once()
+        summaries = [m for m in mail.outbox if m.subject == 'Vencimento das reservas']
+        self.assertEqual(len(summaries), 1)
+        self.assertEqual(len(mail.outbox), expired + 1)
+        for r in Reservation.objects.select_related('room'):
+            with self.subTest(reservation=r):
+                self.assertIn(f'Nº{r.room.number}', summaries[0].body)
+
+    def test_check_reservation_dates_em_quantidade_constante_de_queries(self):
+        """testa se a quantidade de queries não depende da quantidade de
+        reservas expiradas"""
+        self._expire_all()
+
+        with self.assertNumQueries(7):
+            check_reservation_dates()
+
+    def test_check_reservation_dates_nao_libera_quarto_com_outra_reserva_ativa(self):
+        """testa se o quarto continua indisponível quando outra reserva
+        ativa ainda o ocupa"""
+        self._expire_all()
+        expired = Reservation.objects.first()
+        Reservation.objects.create(
+            checkin=datetime.now().date(),
+            checkout=datetime.now().date() + timedelta(days=2),
+            client_id=2,
+            room=expired.room,
+            status='A',
+            active=True,
+        )
+
+        check_reservation_dates()
+
+        expired.refresh_from_db()
+        self.assertListEqual([expired.status, expired.room.available], ['F', False])
+        self.assertFalse(expired.reservation_nights.exists())
+        self.assertListEqual(
+            list(RoomNight.objects.values_list('reservation__status', flat=True).distinct()), ['A']
+        )
+
+    def test_check_reservation_dates_sem_reservas_expiradas_nao_envia_emails(self):
+        """testa se nada é enviado quando não há reservas expiradas"""
+        Reservation.objects.update(active=False)
+
+        self.assertEqual(check_reservation_dates(), 0)
+        self.assertEqual(len(mail.outbox), 0)
+
     def test_release_room_libera_quarto_corretamente(self):
         """testa se a task release_room libera o quarto corretamente
         caso ele não tenha um pagamento finalizado
@@ -74,3 +157,225 @@ class TestTasks(TestCase):
             release_room(18)
         except Reservation.DoesNotExist:
             self.fail(f'Reservation.DoesNotExist raised')
+
+
+class TestReleaseExpiredHolds(TestCase):
+    def setUp(self) -> None:
+        call_command('loaddata', 'tests/fixtures/hotel_fixture.json')
+        call_command('loaddata', 'tests/fixtures/beneficio_fixture.json')
+        call_command('loaddata', 'tests/fixtures/classe_fixture.json')
+        call_command('loaddata', 'tests/fixtures/quarto_fixture.json')
+        call_command('loaddata', 'tests/fixtures/cliente_fixture.json')
+
+        self.expired_at = timezone.now() - timedelta(minutes=ReserveSupport.RESERVATION_PATIENCE_MINUTES + 1)
+        self.checkin = datetime.now().date()
+
+    def _hold(self, room_pk, status='P', created_at=None, payment_status='P', session_expires_at=None, client_pk=1):
+        room = Room.objects.get(pk=room_pk)
+        room.available = status != 'P'
+        room.save()
+        reservation = Reservation.objects.create(
+            checkin=self.checkin,
+            checkout=self.checkin + timedelta(days=1),
+            client_id=client_pk,
+            room=room,
+            amount=room.daily_price,
+            status=status,
+            created_at=created_at or self.expired_at,
+        )
+        if payment_status is not None:
+            Payment.objects.create(
+                reservation=reservation,
+                amount=reservation.amount,
+                status=payment_status,
+                session_expires_at=session_expires_at or timezone.now() - timedelta(minutes=1),
+            )
+        return reservation
+
+    def test_reservas_expiradas_sao_canceladas_e_quartos_liberados(self):
+        """testa se reservas iniciadas ou processando há mais tempo que o
+        permitido são canceladas, junto dos pagamentos, e o quarto é liberado"""
+        holds = [self._hold(1, 'P'), self._hold(2, 'I', payment_status=None)]
+
+        result = release_expired_holds()
+
+        self.assertEqual(result, 2)
+        for hold in holds:
+            with self.subTest(reservation=hold):
+                hold.refresh_from_db()
+                self.assertEqual(hold.status, 'C')
+                self.assertTrue(hold.room.available)
+        self.assertEqual(Payment.objects.get(reservation=holds[0]).status, 'C')
+
+    def test_reservas_recentes_ou_com_pagamento_finalizado_nao_sao_liberadas(self):
+        """testa se reservas com a session do stripe ainda válida, mesmo
+        criadas há mais tempo que o prazo, ou com pagamento finalizado são
+        mantidas"""
+        paying = self._hold(1, 'P', session_expires_at=timezone.now() + timedelta(minutes=20))
+        paid = self._hold(2, 'P', payment_status='F')
+
+        result = release_expired_holds()
+
+        self.assertEqual(result, 0)
+        for hold in (paying, paid):
+            with self.subTest(reservation=hold):
+                hold.refresh_from_db()
+                self.assertListEqual([hold.status, hold.room.available], ['P', False])
+
+    def test_reserva_iniciada_expirada_nao_libera_quarto_de_checkout_em_andamento(self):
+        """testa se cancelar uma reserva iniciada, que nunca ocupou o quarto,
+        não libera o quarto ocupado pelo checkout de outro cliente"""
+        paying = self._hold(1, 'P', session_expires_at=timezone.now() + timedelta(minutes=20))
+        started = self._hold(1, 'I', payment_status=None, client_pk=2)
+        Room.objects.filter(pk=1).update(available=False)
+
+        self.assertEqual(release_expired_holds(), 1)
+
+        started.refresh_from_db()
+        paying.refresh_from_db()
+        self.assertEqual(started.status, 'C')
+        self.assertListEqual([paying.status, paying.room.available], ['P', False])
+
+    def test_reserva_processando_sem_session_usa_o_dobro_do_prazo(self):
+        """testa se reservas processando sem pagamento só são liberadas após
+        duas vezes o prazo, tempo em que o checkout já teria criado a session"""
+        patience = timedelta(minutes=ReserveSupport.RESERVATION_PATIENCE_MINUTES)
+        recent = self._hold(1, 'P', payment_status=None)
+        orphan = self._hold(2, 'P', payment_status=None, created_at=timezone.now() - 2 * patience - timedelta(minutes=1))
+
+        self.assertEqual(release_expired_holds(), 1)
+
+        recent.refresh_from_db()
+        orphan.refresh_from_db()
+        self.assertListEqual([recent.status, recent.room.available], ['P', False])
+        self.assertListEqual([orphan.status, orphan.room.available], ['C', True])
+
+    def test_quarto_ocupado_por_reserva_ativa_nao_e_liberado(self):
+        """testa se o quarto de uma reserva expirada continua indisponível
+        quando há uma reserva ativa para ele"""
+        hold = self._hold(1, 'P')
+        Reservation.objects.create(
+            checkin=self.checkin + timedelta(days=5),
+            checkout=self.checkin + timedelta(days=6),
+            client_id=2,
+            room=hold.room,
+            status='A',
+            active=True,
+        )
+
+        release_expired_holds()
+
+        hold.refresh_from_db()
+        self.assertListEqual([hold.status, hold.room.available], ['C', False])
+
+    def test_liberacao_em_quantidade_constante_de_queries(self):
+        """testa se a quantidade de queries não depende da quantidade de
+        reservas expiradas"""
+        for pk in range(1, 7):
+            self._hold(pk, 'P')
+
+        with self.assertNumQueries(6):
+            self.assertEqual(release_expired_holds(), 6)
+
+
+class TestRebuildRoomPopularity(TestCase):
+    def setUp(self) -> None:
+        call_command('loaddata', 'tests/fixtures/hotel_fixture.json')
+        call_command('loaddata', 'tests/fixtures/beneficio_fixture.json')
+        call_command('loaddata', 'tests/fixtures/classe_fixture.json')
+        call_command('loaddata', 'tests/fixtures/quarto_fixture.json')
+        call_command('loaddata', 'tests/fixtures/cliente_fixture.json')
+        call_command('loaddata', 'tests/fixtures/reserva_fixture.json')
+
+    def test_rebuild_room_popularity(self):
+        """testa se a popularidade é recalculada a partir das reservas
+        finalizadas, ativas ou agendadas, corrigindo contadores divergentes e
+        as janelas de reservas que ficaram antigas"""
+        RoomPopularity.objects.filter(room=2).update(reservations=50, last_30_days=50)
+        RoomPopularity.objects.create(room_id=5, reservations=7)
+        Reservation.objects.filter(pk=1).update(created_at=timezone.now() - timedelta(days=60))
+
+        self.assertEqual(rebuild_room_popularity(), 4)
+        popularity = {
+            p.room_id: [p.reservations, p.last_30_days, p.last_90_days]
+            for p in RoomPopularity.objects.all()
+        }
+        self.assertDictEqual(popularity, {1: [1, 0, 1], 2: [3, 3, 3], 3: [2, 2, 2], 4: [1, 1, 1]})
+
+
+
+class TestCreateRoomImageVariants(TestCase):
+    def setUp(self) -> None:
+        call_command('loaddata', 'tests/fixtures/hotel_fixture.json')
+        call_command('loaddata', 'tests/fixtures/beneficio_fixture.json')
+        call_command('loaddata', 'tests/fixtures/classe_fixture.json')
+        call_command('loaddata', 'tests/fixtures/quarto_fixture.json')
+
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+        os.makedirs(os.path.join(media.name, 'rooms'))
+        self.image_path = 'rooms/original.jpg'
+        Image.new('RGB', (1600, 900), 'teal').save(os.path.join(media.name, self.image_path))
+        Room.objects.filter(pk=1).update(image=self.image_path)
+
+    def test_gera_variantes_sem_alterar_a_original(self):
+        """testa se as variantes são geradas em cada largura e formato
+        suportado, recortadas na proporção da model, e se a original é mantida"""
+        self.assertTrue(create_room_image_variants(1))
+        room = Room.objects.get(pk=1)
+
+        self.assertTupleEqual((room.image.width, room.image.height), (1600, 900))
+        self.assertEqual(room.image_variants['source'], self.image_path)
+        expected = [fmt for fmt in ('avif', 'webp') if features.check(fmt)] + ['jpeg']
+        self.assertListEqual(list(room.image_variants['formats']), expected)
+
+        ratio = RoomRules.IMAGE_SIZE[1] / RoomRules.IMAGE_SIZE[0]
+        for names in room.image_variants['formats'].values():
+            self.assertListEqual(list(names), [str(width) for width in RoomRules.IMAGE_WIDTHS])
+            for width, name in names.items():
+                with room.image.storage.open(name) as variant, Image.open(variant) as img:
+                    self.assertTupleEqual(img.size, (int(width), round(int(width) * ratio)))
+
+    def test_nao_amplia_imagens_pequenas(self):
+        """testa se larguras maiores que a original não são geradas"""
+        Image.new('RGB', (600, 450), 'teal').save(Room.objects.get(pk=1).image.path)
+        create_room_image_variants(1)
+        variants = Room.objects.get(pk=1).image_variants
+        self.assertListEqual(list(variants['formats']['jpeg']), ['280', '560'])
+
+    def test_troca_de_imagem_remove_variantes_antigas(self):
+        """testa se as variantes da imagem anterior são removidas e se uma
+        segunda execução sem troca de imagem não faz nada"""
+        create_room_image_variants(1)
+        storage = Room.objects.get(pk=1).image.storage
+        old_names = list(Room.objects.get(pk=1).image_variants['formats']['jpeg'].values())
+        self.assertFalse(create_room_image_variants(1))
+
+        Image.new('RGB', (1200, 900), 'navy').save(os.path.join(storage.location, 'rooms/new.jpg'))
+        Room.objects.filter(pk=1).update(image='rooms/new.jpg')
+        self.assertTrue(create_room_image_variants(1))
+
+        self.assertEqual(Room.objects.get(pk=1).image_variants['source'], 'rooms/new.jpg')
+        self.assertFalse(any(storage.exists(name) for name in old_names))
+
+    def test_descarta_variantes_caso_a_imagem_mude_durante_o_processamento(self):
+        """testa se as variantes geradas são descartadas quando a imagem é
+        trocada enquanto a task processa a anterior"""
+        generated, create_variants = {}, supportimages.create_variants
+
+        def create_and_change_image(*args):
+            generated.update(create_variants(*args))
+            Room.objects.filter(pk=1).update(image='rooms/other.jpg')
+            return generated
+
+        with patch('utils.supportimages.create_variants', side_effect=create_and_change_image):
+            self.assertFalse(create_room_image_variants(1))
+
+        room = Room.objects.get(pk=1)
+        self.assertDictEqual(room.image_variants, {})
+        names = [name for names in generated['formats'].values() for name in names.values()]
+        self.assertFalse(any(room.image.storage.exists(name) for name in names))
@@ -1,13 +1,16 @@
 from datetime import datetime, timedelta
 from decimal import Decimal
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.core.management import call_command
 from django.urls import reverse
 from reservations.models import Room, Benefit, Reservation
 from reservations.views import Rooms
+from home import context_processors
 from clients.models import Client
 from utils.supportmodels import ReserveErrorMessages, ReserveRules
-from utils.supportviews import ReserveMessages
+from utils.supportviews import ReserveMessages, RoomSearchMessages
 from django_q.models import Schedule
 from utils.supporttest import get_message
 from unittest.mock import patch
@@ -113,6 +116,129 @@ class TestRooms(Base, RoomTestMixin):
         expected = list(Room.objects.all().order_by('-daily_price'))
         self.assertListEqual(result, expected)
 
+    def _create_rooms(self, n):
+        for i in range(n):
+            room = Room.objects.create(
+                room_class=self.room1.room_class,
+                number=f'{900 + i}',
+                size=20,
+                daily_price=Decimal('150'),
+                short_desc=f'quarto extra {i}',
+                hotel=self.room1.hotel,
+            )
+            room.benefit.set(Benefit.objects.all())
+
+    def test_quantidade_de_queries_nao_depende_de_quartos_e_beneficios(self):
+        """testa se a listagem faz a mesma quantidade de queries independente
+        da quantidade de quartos e benefícios"""
+        context_processors.hotel()
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(self.url)
+
+        for i in range(3):
+            Benefit.objects.create(name=f'beneficio {i}', short_desc=f'beneficio extra {i}')
+        self._create_rooms(3)
+
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(self.url)
+
+        self.assertEqual(len(after), len(before))
+
+    def test_beneficios_do_quarto_pre_calculados(self):
+        """testa se cada quarto recebe o conjunto de ids dos seus benefícios"""
+        response = self.client.get(self.url)
+        for room in response.context[self.rooms_context_name]:
+            with self.subTest(room=room):
+                expected = set(room.benefit.values_list('pk', flat=True))
+                self.assertSetEqual(room.benefit_ids, expected)
+
+    def test_listagem_paginada(self):
+        """testa se os quartos são paginados de acordo com paginate_by"""
+        self._create_rooms(Rooms.paginate_by)
+        total = Room.objects.count()
+
+        first = self.client.get(self.url)
+        last = self.client.get(self.url, {'page': 2})
+
+        self.assertEqual(len(first.context[self.rooms_context_name]), Rooms.paginate_by)
+        self.assertEqual(len(last.context[self.rooms_context_name]), total - Rooms.paginate_by)
+
+
+class TestRoomSearch(Base):
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('rooms_search')
+        self.checkin = datetime.now().date() + timedelta(days=1)
+        self.search = {
+            'checkin': self.checkin.strftime('%Y-%m-%d'),
+            'checkout': (self.checkin + timedelta(days=2)).strftime('%Y-%m-%d'),
+            'adults': 1,
+            'children': 0,
+        }
+
+    def test_template(self):
+        """testa se a busca renderiza o template de quartos"""
+        response = self.client.get(self.url, self.search)
+        self.assertTemplateUsed(response, 'rooms.html')
+
+    def test_quartos_com_noites_ocupadas_nao_sao_listados(self):
+        """testa se quartos com reserva ativa ou agendada no período não
+        são retornados pela busca"""
+        Reservation.objects.create(
+            checkin=self.checkin + timedelta(days=1),
+            checkout=self.checkin + timedelta(days=3),
+            client=self.user,
+            room=self.room1,
+            status='S',
+        )
+        response = self.client.get(self.url, self.search)
+        result = list(response.context['rooms'])
+        expected = list(Room.objects.exclude(pk=self.room1.pk).order_by('-daily_price'))
+        self.assertListEqual(result, expected)
+
+    def test_quartos_sem_capacidade_para_os_hospedes_nao_sao_listados(self):
+        """testa se apenas quartos que comportam os adultos e crianças
+        informados são retornados"""
+        self.search.update(adults=2, children=1)
+        response = self.client.get(self.url, self.search)
+        result = list(response.context['rooms'])
+        expected = list(
+            Room.objects.filter(adult_capacity__gte=2, child_capacity__gte=1).order_by('-daily_price')
+        )
+        self.assertListEqual(result, expected)
+
+    def test_busca_invalida_nao_retorna_quartos_e_exibe_msg_correta(self):
+        """testa se datas ou hóspedes inválidos não retornam quartos e
+        adicionam a mensagem correta"""
+        yesterday = datetime.now().date() - timedelta(days=1)
+        cases = (
+            ('checkin', yesterday.strftime('%Y-%m-%d'), ReserveErrorMessages.INVALID_CHECKIN_DATE),
+            ('checkout', self.search['checkin'], ReserveErrorMessages.INVALID_STAYED_DAYS),
+            ('adults', 0, RoomSearchMessages.INVALID_GUESTS),
+            ('children', 'x', RoomSearchMessages.INVALID_GUESTS),
+        )
+        for field, value, msg in cases:
+            with self.subTest(field=field, value=value):
+                response = self.client.get(self.url, {**self.search, field: value})
+                self.assertEqual(get_message(response), msg)
+                self.assertQuerysetEqual(response.context['rooms'], [])
+
+    def test_quarto_indisponivel_nao_listado_para_check_in_hoje(self):
+        """testa se um quarto indisponível, ocupado ou em checkout, não é
+        listado para check-in hoje, assim como a reserva o recusa, e continua
+        listado para check-ins futuros sem noites ocupadas"""
+        Room.objects.filter(pk=self.room1.pk).update(available=False)
+        today = datetime.now().date()
+
+        result = Room.free_rooms(today, today + timedelta(days=2))
+        self.assertNotIn(self.room1, result)
+        self.assertIn(self.room1, Room.free_rooms(self.checkin, self.checkin + timedelta(days=2)))
+
+    def test_quantidade_de_queries_nao_depende_da_quantidade_de_quartos(self):
+        """testa se os quartos livres são buscados com uma única query"""
+        with self.assertNumQueries(1):
+            list(Room.free_rooms(self.checkin, self.checkin + timedelta(days=2)))
+
 
 class TestRoom(Base, RoomTestMixin):
     def setUp(self):
@@ -242,16 +368,15 @@ class TestReserve(Base):
         self.assertEqual(result, expected)
     
     @patch('reservations.views.support.verify_captcha')
-    def test_django_q_schedule_e_criado_quando_reserva_e_iniciada(self, fake_captcha):
-        """testa se a Schedule de liberar quarto é criada corretamente"""
+    def test_django_q_schedule_nao_e_criado_quando_reserva_e_iniciada(self, fake_captcha):
+        """testa se nenhuma Schedule por reserva é criada, já que as reservas
+        expiradas são liberadas por release_expired_holds"""
         fake_captcha.return_value = True
         self.client.force_login(self.user)
+        schedules = Schedule.objects.count()
         self.client.post(self.url, self.valid_data)
-        last_schedule = Schedule.objects.last()
-        
-        result = last_schedule.func
-        expected = 'reservations.tasks.release_room'
-        self.assertEqual(result, expected)
+
+        self.assertEqual(Schedule.objects.count(), schedules)
 
     def test_cliente_que_ja_tem_reserva_com_status_ativa_ou_agendada_e_redirecionado_para_quartos_com_msg_correta(self):
         """testa se um cliente tentar acessar pagina de realizar reserva
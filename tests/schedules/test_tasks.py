@@ -0,0 +1,83 @@
+from datetime import timedelta
+from unittest.mock import patch
+from django.test import TestCase
+from django.core import mail
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.utils.timezone import now
+from clients.models import Client
+from reservations.models import Reservation, Room
+from schedules.tasks import activate_scheduled_reservations, schedule_reservation
+
+
+class TestActivateScheduledReservations(TestCase):
+    def setUp(self) -> None:
+        call_command('loaddata', 'tests/fixtures/hotel_fixture.json')
+        call_command('loaddata', 'tests/fixtures/classe_fixture.json')
+        call_command('loaddata', 'tests/fixtures/beneficio_fixture.json')
+        call_command('loaddata', 'tests/fixtures/quarto_fixture.json')
+        call_command('loaddata', 'tests/fixtures/cliente_fixture.json')
+        call_command('loaddata', 'tests/fixtures/reserva_fixture.json')
+
+        self.today = now().date()
+        Reservation.objects.update(status='F', active=False)
+        Room.objects.update(available=True)
+
+    def _schedule(self, pks, checkin):
+        Reservation.objects.filter(pk__in=pks).update(
+            status='S', checkin=checkin, checkout=checkin + timedelta(days=1)
+        )
+
+    def test_ativa_reservas_agendadas_com_checkin_hoje(self):
+        """testa se as reservas agendadas com checkin hoje são ativadas e os
+        quartos marcados como indisponíveis"""
+        self._schedule([1, 2], self.today)
+
+        result = activate_scheduled_reservations()
+
+        self.assertEqual(result, 2)
+        for reservation in Reservation.objects.filter(pk__in=[1, 2]):
+            with self.subTest(reservation=reservation):
+                self.assertListEqual(
+                    [reservation.status, reservation.active, reservation.room.available],
+                    ['A', True, False],
+                )
+
+    def test_nao_ativa_reservas_agendadas_para_o_futuro(self):
+        """testa se as reservas com checkin futuro continuam agendadas"""
+        self._schedule([1], self.today + timedelta(days=1))
+
+        self.assertEqual(activate_scheduled_reservations(), 0)
+        reservation = Reservation.objects.get(pk=1)
+        self.assertListEqual([reservation.status, reservation.room.available], ['S', True])
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_envia_email_aos_clientes_e_resumo_aos_admins_na_mesma_conexao(self):
+        """testa se cada cliente recebe um email e os admins um único resumo,
+        usando uma única conexão"""
+        self._schedule([1, 2], self.today)
+        Client.objects.filter(pk=1).update(is_staff=True)
+
+        with patch('utils.supporttasks.get_connection', wraps=get_connection) as mock_connection:
+            activate_scheduled_reservations()
+
+        mock_connection.assert_called_once()
+        summaries = [m for m in mail.outbox if m.subject == 'Agendamentos de reserva']
+        self.assertEqual(len(summaries), 1)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_ativacao_em_quantidade_constante_de_queries(self):
+        """testa se a quantidade de queries não depende da quantidade de
+        reservas agendadas"""
+        self._schedule(Reservation.objects.values_list('pk', flat=True), self.today)
+
+        with self.assertNumQueries(6):
+            activate_scheduled_reservations()
+
+
+class TestScheduleReservation(TestCase):
+    def test_reserva_inexistente_registrada_no_log(self):
+        """testa se a task legada registra no log a reserva inexistente"""
+        with self.assertLogs('djangoLogger', 'ERROR') as logs:
+            schedule_reservation(18)
+        self.assertIn('reservation 18 does not exists', logs.output[0])
@@ -1,3 +1,4 @@
+import time
 from datetime import datetime, timedelta
 from unittest.mock import patch
 from django.core.exceptions import ValidationError
@@ -81,6 +82,8 @@ class TestSchedules(Base, CommonTestsMixin):
         """agendamento é criado se os dados enviados são validos"""
         fake_captcha.return_value = True
         stripe_session.url = 'http://fakestripesession.com/'
+        stripe_session.id = 'cs_test_session'
+        stripe_session.expires_at = int(time.time()) + 30 * 60
 
         self.client.force_login(self.user)
         response = self.client.post(self.url, self.schedule_form_data)
@@ -197,16 +200,17 @@ class TestScheduleSuccess(Base, CommonTestsMixin):
         result = response.context.get('payment')
         self.assertEqual(result, self.payment)
     
-    def test_pagamento_salvo_corretamente(self):
-        """testa se o status do pagamento é alterado para finalizado e
-        a o status da reserva para agendado corretamente
+    def test_pagina_de_sucesso_nao_altera_pagamento_nem_reserva(self):
+        """testa se a página de sucesso apenas exibe o pagamento, que é
+        finalizado e a reserva agendada pelo webhook do stripe
         """
+        status = self.reservation.status
         self._response()
         self.payment.refresh_from_db()
 
         self.assertEqual(
             [self.payment.status, self.payment.reservation.status],
-            ['F', 'S']
+            ['P', status]
         )
     
     def test_pagamento_com_status_diferente_de_processando_renderiza_novamente_pagina_sem_criar_task(self):
@@ -222,11 +226,10 @@ class TestScheduleSuccess(Base, CommonTestsMixin):
             Schedule.objects.filter(name=self.schedule_task_name).exists()
         )
     
-    def test_cria_schedule_task_corretamente(self):
-        """testa se ao finalizar pagamento cria a task de agendamento para
-        ativar a reserva na data agendada
+    def test_nao_cria_schedule_task_por_agendamento(self):
+        """testa se ao finalizar pagamento nenhuma schedule por agendamento é
+        criada, já que a ativação é feita por activate_scheduled_reservations
         """
-        self._response()        
-        self.assertTrue(
-            Schedule.objects.filter(name=self.schedule_task_name).exists()
-        )
+        schedules = Schedule.objects.count()
+        self._response()
+        self.assertEqual(Schedule.objects.count(), schedules)
@@ -1,7 +1,7 @@
+from unittest.mock import patch
 from django.test import TestCase
 from services.models import Service
 from PIL import Image
-from utils.supportmodels import ServicesRules
 from django.core.management import call_command
 from home.models import Hotel
 from tempfile import gettempdir
@@ -13,20 +13,19 @@ class TestService(TestCase):
         call_command('loaddata', 'tests/fixtures/hotel_fixture.json')
         self.hotel = Hotel.objects.first()
 
-    def test_imagem_e_redimensionada_apos_salvar(self):
-        img = Image.open('media/test/room_test.jpg')
-        tmp_img = img.resize((600, 600), resample=Image.Resampling.NEAREST)
+    @patch('utils.supportimages.enqueue_task')
+    def test_logo_original_mantido_e_variantes_enfileiradas_apos_salvar(self, mock_enqueue):
+        with Image.open('media/test/room_test.jpg') as img:
+            original_size = img.size
 
-        tmp_img_path = 'media/test/tmp_img.jpg'
-        tmp_img.save(tmp_img_path)
-        tmp_img_path = tmp_img_path.replace('media/', '')
-        img.close()
-        tmp_img.close()
-        
-        service = Service(name='service 1', presentation_text='presentation', logo=tmp_img_path, hotel=self.hotel)
-        service.save()
+        service = Service(name='service 1', presentation_text='presentation', logo='test/room_test.jpg', hotel=self.hotel)
+        with self.captureOnCommitCallbacks(execute=True):
+            service.save()
         service.refresh_from_db()
-        self.assertTupleEqual((service.logo.width, service.logo.height), ServicesRules.IMG_SIZE)
+
+        self.assertTupleEqual((service.logo.width, service.logo.height), original_size)
+        task = 'services.tasks.create_service_logo_variants'
+        mock_enqueue.assert_called_once_with(task, service.pk, task_name=f'{task}_{service.pk}')
     
     def test_metodo_str_retorna_nome_do_servico(self):
         service = Service(name='service 1', presentation_text='presentation', logo="", hotel=self.hotel)
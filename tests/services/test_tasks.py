@@ -0,0 +1,38 @@
+import os
+import tempfile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from PIL import Image
+from home.models import Hotel
+from services.models import Service
+from services.tasks import create_service_logo_variants
+from utils.supportmodels import ServicesRules
+
+
+class TestCreateServiceLogoVariants(TestCase):
+    def setUp(self):
+        call_command('loaddata', 'tests/fixtures/hotel_fixture.json')
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+        os.makedirs(os.path.join(media.name, 'services'))
+        Image.new('RGBA', (800, 800), (0, 128, 128, 100)).save(os.path.join(media.name, 'services/logo.png'))
+        self.service = Service.objects.create(
+            name='service 1', presentation_text='presentation', logo='services/logo.png', hotel=Hotel.objects.first()
+        )
+
+    def test_gera_variantes_do_logo_mantendo_a_transparencia(self):
+        """testa se o fallback de logos com transparência é png e se as
+        variantes seguem a proporção e as larguras de `ServicesRules`"""
+        self.assertTrue(create_service_logo_variants(self.service.pk))
+        self.service.refresh_from_db()
+
+        self.assertTupleEqual((self.service.logo.width, self.service.logo.height), (800, 800))
+        png = self.service.logo_variants['formats']['png']
+        self.assertListEqual(list(png), [str(width) for width in ServicesRules.IMG_WIDTHS])
+        with self.service.logo.storage.open(png['560']) as variant, Image.open(variant) as img:
+            self.assertTupleEqual(img.size, ServicesRules.IMG_SIZE)
+            self.assertEqual(img.mode, 'RGBA')
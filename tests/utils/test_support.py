@@ -0,0 +1,363 @@
+import json
+from datetime import date
+import logging
+import tempfile
+from pathlib import Path
+from unittest import skipUnless
+from unittest.mock import patch
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+import stripe
+from django.core.management import call_command
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.test import TestCase, override_settings
+from utils.support import CaptchaVerifier, configure_stripe
+from utils.supportdb import apply_sqlite_pragmas, close_unusable_connections, sqlite_pragma_statements
+from utils.supportlogging import QueueLogHandler
+from reservations.models import Room
+
+
+class StubRecaptchaHandler(BaseHTTPRequestHandler):
+    """responde como o endpoint siteverify do google com o corpo e atraso
+    configurados no servidor"""
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests += 1
+        self.server.connections.add(self.client_address)
+        time.sleep(self.server.delay)
+        body = json.dumps(self.server.verdict).encode()
+        try:
+            self.send_response(self.server.status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # o cliente desistiu por timeout
+
+    def log_message(self, *args):
+        pass
+
+
+class StubRecaptchaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubRecaptchaHandler)
+        StubRecaptchaHandler.protocol_version = 'HTTP/1.1'
+        self.verdict = {'success': True, 'score': .9}
+        self.status = 200
+        self.delay = 0
+        self.requests = 0
+        self.connections = set()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}/siteverify'
+
+
+class TestCaptchaVerifier(TestCase):
+    def setUp(self):
+        self.server = StubRecaptchaServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.verifier = CaptchaVerifier(
+            url=self.server.url, secret='secret',
+            timeout=.2, failure_threshold=2, cooldown=60,
+        )
+        self.addCleanup(self.verifier.http.close)
+
+    def test_captcha_valido_e_invalido(self):
+        """testa o veredicto de acordo com success e score da resposta"""
+        for verdict, expected in (
+            ({'success': True, 'score': .9}, True),
+            ({'success': True, 'score': .5}, False),
+            ({'success': False}, False),
+        ):
+            with self.subTest(verdict=verdict):
+                self.server.verdict = verdict
+                self.assertEqual(self.verifier.verify(f'token-{verdict}'), expected)
+
+    def test_captcha_vazio_nao_faz_requisicao(self):
+        """testa se um captcha vazio é recusado sem consultar o endpoint"""
+        self.assertFalse(self.verifier.verify(''))
+        self.assertEqual(self.server.requests, 0)
+
+    def test_conexao_reutilizada_entre_verificacoes(self):
+        """testa se as verificações reutilizam a mesma conexão keep-alive"""
+        for i in range(3):
+            self.verifier.verify(f'token-{i}')
+
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_timeout_retorna_fail_open(self):
+        """testa se uma resposta lenta é interrompida pelo timeout e o
+        resultado segue a configuração fail_open"""
+        self.server.delay = .5
+        for fail_open in (False, True):
+            with self.subTest(fail_open=fail_open):
+                self.verifier.fail_open = fail_open
+                start = time.monotonic()
+                self.assertEqual(self.verifier.verify(f'token-{fail_open}'), fail_open)
+                self.assertLess(time.monotonic() - start, .5)
+
+    def test_circuito_abre_apos_falhas_consecutivas(self):
+        """testa se após as falhas consecutivas o endpoint deixa de ser
+        consultado até o fim do cooldown"""
+        self.server.status = 500
+        self.verifier.verify('token-1')
+        self.verifier.verify('token-2')
+
+        self.server.status = 200
+        self.assertTrue(self.verifier.is_open)
+        self.assertFalse(self.verifier.verify('token-3'))
+        self.assertEqual(self.server.requests, 2)
+
+        self.verifier._open_until = 0
+        self.assertTrue(self.verifier.verify('token-4'))
+
+    def test_veredicto_negativo_reaproveitado_na_sessao(self):
+        """testa se um novo envio do mesmo captcha recusado na mesma sessão
+        reaproveita o veredicto, e se ele expira após o ttl"""
+        self.server.verdict = {'success': True, 'score': .1}
+        session = {}
+        self.assertFalse(self.verifier.verify('token', session))
+        self.assertFalse(self.verifier.verify('token', session))
+        self.assertEqual(self.server.requests, 1)
+
+        self.verifier.verdict_ttl = 0
+        self.verifier.verify('other', session)
+        self.verifier.verify('other', session)
+        self.assertEqual(self.server.requests, 3)
+
+    def test_veredicto_positivo_nao_reaproveitado(self):
+        """testa se um captcha aceito é verificado de novo em cada envio, para
+        que o google recuse o token de uso único reenviado"""
+        session = {}
+        self.assertTrue(self.verifier.verify('token', session))
+        self.server.verdict = {'success': False, 'error-codes': ['timeout-or-duplicate']}
+        self.assertFalse(self.verifier.verify('token', session))
+        self.assertEqual(self.server.requests, 2)
+        self.assertNotIn(True, [verdict for verdict, _ in session[CaptchaVerifier.SESSION_KEY].values()])
+
+
+class TestConfigureStripe(TestCase):
+    @override_settings(STRIPE_API_BASE='http://127.0.0.1:12111', STRIPE_TIMEOUT=4)
+    def test_cliente_stripe_compartilhado_com_timeout_e_url_base(self):
+        """testa se o stripe usa a url base e o cliente http configurados"""
+        configure_stripe()
+        self.addCleanup(configure_stripe)
+
+        self.assertEqual(stripe.api_base, 'http://127.0.0.1:12111')
+        self.assertIsInstance(stripe.default_http_client, stripe.http_client.RequestsClient)
+        self.assertEqual(stripe.default_http_client._timeout, 4)
+
+
+class TestSqlitePragmas(TestCase):
+    def _pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_aplicados_na_conexao(self):
+        """testa se os pragmas de SQLITE_PRAGMAS são aplicados na conexão"""
+        self.assertEqual(self._pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self._pragma('busy_timeout'), 5000)
+        self.assertEqual(self._pragma('temp_store'), 2)  # MEMORY
+
+    def test_sqlite_pragma_statements(self):
+        """testa se os comandos PRAGMA são gerados na ordem informada"""
+        self.assertEqual(
+            sqlite_pragma_statements({'journal_mode': 'wal', 'busy_timeout': 100}),
+            ['PRAGMA journal_mode = wal', 'PRAGMA busy_timeout = 100'],
+        )
+
+    @override_settings(SQLITE_TUNED=False, SQLITE_PRAGMAS={'busy_timeout': 1})
+    def test_sqlite_tuned_desativado_nao_altera_conexao(self):
+        """testa se com SQLITE_TUNED=0 a conexão mantém a configuração padrão"""
+        apply_sqlite_pragmas(None, connection)
+        self.assertEqual(self._pragma('busy_timeout'), 5000)
+
+    def test_benchmark_sqlite(self):
+        """testa se o benchmark escreve a vazão das duas configurações"""
+        out = StringIO()
+        call_command('benchmark_sqlite', writers=2, readers=1, bookings=5, stdout=out)
+        self.assertIn('default: 10 bookings', out.getvalue())
+        self.assertIn('tuned: 10 bookings', out.getvalue())
+
+
+class TestDatabaseProfile(TestCase):
+    def test_fecha_conexao_que_nao_responde(self):
+        """testa se a conexão persistente que não responde é fechada no início
+        da requisição"""
+        connection.ensure_connection()
+        with patch.object(connection, 'is_usable', return_value=False), \
+                patch.object(connection, 'close') as close:
+            close_unusable_connections(None)
+        close.assert_called_once()
+
+    @override_settings(DB_HEALTH_CHECKS=False)
+    def test_health_check_desativado(self):
+        """testa se com DB_HEALTH_CHECKS=0 as conexões não são verificadas"""
+        with patch.object(connection, 'is_usable') as is_usable:
+            close_unusable_connections(None)
+        is_usable.assert_not_called()
+
+    @skipUnless(connection.vendor == 'postgresql', 'requer DB_ENGINE=postgresql')
+    def test_lock_timeout_postgresql(self):
+        """testa se o lock_timeout do postgresql é o DB_LOCK_TIMEOUT"""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT setting FROM pg_settings WHERE name = 'lock_timeout'")
+            self.assertEqual(int(cursor.fetchone()[0]), settings.DB_LOCK_TIMEOUT)
+
+
+class TestQueueLogHandler(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        self.logger = logging.getLogger('test.supportlogging')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+
+    def _handler(self, **kwargs):
+        handler = QueueLogHandler(self.dir / 'debug.log', **kwargs)
+        self.logger.addHandler(handler)
+        self.addCleanup(handler.close)
+        self.addCleanup(self.logger.removeHandler, handler)
+        return handler
+
+    def _lines(self):
+        return [
+            json.loads(line)
+            for path in sorted(self.dir.iterdir())
+            for line in path.read_text().splitlines()
+        ]
+
+    def test_escreve_json_lines(self):
+        """testa se cada registro é escrito como uma linha JSON"""
+        handler = self._handler()
+        self.logger.info('payment %s created', 1)
+        try:
+            raise ValueError('broken')
+        except ValueError:
+            self.logger.exception('failed')
+        handler.flush()
+
+        lines = self._lines()
+        self.assertEqual(lines[0]['message'], 'payment 1 created')
+        self.assertEqual(lines[0]['level'], 'INFO')
+        self.assertIn('ValueError: broken', lines[1]['exc'])
+
+    def test_queryset_nao_e_executado(self):
+        """testa se um queryset passado como argumento não executa a query"""
+        handler = self._handler()
+        with self.assertNumQueries(0):
+            self.logger.debug('rooms %s', Room.objects.all())
+        handler.flush()
+        self.assertEqual(self._lines()[0]['message'], 'rooms <QuerySet Room>')
+
+    def test_fila_cheia_descarta_sem_bloquear(self):
+        """testa se com a fila cheia o registro é descartado em vez de bloquear"""
+        handler = self._handler(queue_size=1)
+        handler.listener.stop()
+        for i in range(3):
+            self.logger.info('message %s', i)
+        self.assertEqual(handler.dropped, 2)
+
+    def test_rotaciona_por_tamanho(self):
+        """testa se o arquivo é rotacionado ao atingir max_bytes sem
+        sobrescrever rotações do mesmo dia"""
+        handler = self._handler(max_bytes=200, backup_count=0, rotate=True)
+        for i in range(10):
+            self.logger.info('message %s', i)
+        handler.flush()
+
+        self.assertGreater(len(list(self.dir.iterdir())), 2)
+        self.assertEqual(sorted(line['message'] for line in self._lines()), [f'message {i}' for i in range(10)])
+
+    def test_reabre_arquivo_rotacionado_externamente(self):
+        """testa se por padrão o handler não rotaciona e volta a escrever em
+        um arquivo novo depois que a rotação externa move o log"""
+        handler = self._handler(max_bytes=1)
+        self.logger.info('before')
+        handler.flush()
+        (self.dir / 'debug.log').rename(self.dir / 'debug.log.1')
+        self.logger.info('after')
+        handler.flush()
+
+        self.assertEqual(sorted(path.name for path in self.dir.iterdir()), ['debug.log', 'debug.log.1'])
+        self.assertEqual(json.loads((self.dir / 'debug.log').read_text())['message'], 'after')
+
+
+class TestSQLInstrumentationMiddleware(TestCase):
+    def setUp(self):
+        call_command('loaddata', 'tests/fixtures/hotel_fixture.json')
+        call_command('loaddata', 'tests/fixtures/beneficio_fixture.json')
+        call_command('loaddata', 'tests/fixtures/classe_fixture.json')
+        call_command('loaddata', 'tests/fixtures/quarto_fixture.json')
+
+    @override_settings(SQL_INSTRUMENTATION_SAMPLE_RATE=1, SQL_SERVER_TIMING=True, DEBUG=True)
+    def test_server_timing_com_queries_da_requisicao(self):
+        """testa se o header Server-Timing informa as queries executadas na requisição"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('rooms'))
+
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=\d+\.\d;desc="\d+ queries", app;dur=\d+\.\d$')
+        self.assertIn(f'desc="{len(queries)} queries"', timing)
+
+    @override_settings(SQL_INSTRUMENTATION_SAMPLE_RATE=1, SQL_SERVER_TIMING=True, DEBUG=False)
+    def test_server_timing_apenas_para_staff_fora_do_debug(self):
+        """testa se fora do DEBUG o header não é enviado para anônimos e
+        clientes comuns, apenas para staff"""
+        response = self.client.get(reverse('rooms'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+        user = get_user_model().objects.create_user(
+            username='timing', password='Timing@1234', email='timing@email.com',
+            phone='27988887777', cpf='12345678900', birthdate=date(1990, 1, 1),
+        )
+        self.client.force_login(user)
+        self.assertFalse(self.client.get(reverse('rooms')).has_header('Server-Timing'))
+
+        get_user_model().objects.filter(pk=user.pk).update(is_staff=True)
+        self.assertTrue(self.client.get(reverse('rooms')).has_header('Server-Timing'))
+
+    @override_settings(SQL_INSTRUMENTATION_SAMPLE_RATE=1, SQL_SERVER_TIMING=False, DEBUG=True)
+    def test_server_timing_desativado(self):
+        """testa se com SQL_SERVER_TIMING desativado o header não é enviado"""
+        self.assertFalse(self.client.get(reverse('rooms')).has_header('Server-Timing'))
+
+    @override_settings(SQL_INSTRUMENTATION_SAMPLE_RATE=0)
+    def test_requisicao_fora_da_amostra_nao_instrumentada(self):
+        """testa se requisições fora da amostra não recebem o header"""
+        response = self.client.get(reverse('rooms'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(SQL_INSTRUMENTATION_SAMPLE_RATE=1, SQL_QUERY_BUDGET=0)
+    def test_requisicao_acima_do_orcamento_registrada_no_log(self):
+        """testa se a requisição acima do orçamento de queries é registrada com
+        a view e a query mais lenta"""
+        with self.assertLogs('djangoLogger', 'WARNING') as logs:
+            self.client.get(reverse('rooms'))
+
+        self.assertIn('request over budget: GET', logs.output[0])
+        self.assertIn('(rooms)', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    @override_settings(SQL_INSTRUMENTATION_SAMPLE_RATE=1)
+    def test_requisicao_dentro_do_orcamento_nao_registrada(self):
+        """testa se nada é registrado quando a requisição está dentro do orçamento"""
+        with patch('utils.supportmiddleware.logging.Logger.warning') as warning:
+            self.client.get(reverse('rooms'))
+        warning.assert_not_called()
@@ -1,8 +1,16 @@
+import logging
+import os
+import tempfile
+import threading
+import time
 import requests
 from django.conf import settings
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
-from secrets import token_hex
+from reportlab.lib.utils import ImageReader
+from hashlib import sha256
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
 from payments.models import Payment
 from django.conf import settings
 import io
@@ -14,75 +22,211 @@ import stripe
 from stripe.checkout import Session
 from typing import Any
 from home.models import Hotel, Contact
-from PIL import Image
-from datetime import datetime, date
+from home import context_processors
+from datetime import datetime, date, timezone
 
 
-class PaymentPDFHandler:
-    """Cria o pdf com dados do pagamento e envia para o cliente via email.
+class ReceiptRenderer:
+    """Desenha comprovantes de pagamento em pdf. O logo é decodificado uma única
+    vez e compartilhado por todos os documentos do renderer. O cabeçalho
+    estático (logo, nome do hotel, título e layout) é registrado como um form
+    do reportlab em cada documento, reutilizado pelas páginas de um mesmo
+    documento em `render_many`, e cada pagamento desenha apenas suas linhas.
+
+    Use `get_receipt_renderer` para obter a instância compartilhada pelo processo.
     """
-    def __init__(self, payment: Payment, hotel_id=1) -> None:
-        self.payment = payment
-        self._pdf_suffix = token_hex(16)
-        self.pdf_name = f'comprovante_de_pagamento_{self.payment.pk}.pdf'
-        y = A4[1] * .5
-        self.pagesize = (A4[0], y)
-        self.buffer = io.BytesIO()
-        self._canvas = canvas.Canvas(self.buffer, pagesize=self.pagesize)
-        self.w, self.h = self.pagesize
-        self.hotel = Hotel.objects.get(pk=hotel_id)
-        self.hotel_contact = Contact.objects.get(hotel=self.hotel)
-    
-    def handle(self):
-        """template method that generate the pdf and sent by email to the client"""
-        self._draw_header()
-        self._draw_body()
-        self._save()
-        return self._send_email()
-        
-    def _rows_list(self):
+    HEADER_FORM = 'receipt_header'
+    PAGESIZE = (A4[0], A4[1] * .5)
+    FONT = 'Helvetica'
+
+    def __init__(self, hotel: Hotel, hotel_contact: Contact) -> None:
+        self.hotel = hotel
+        self.hotel_contact = hotel_contact
+        self.w, self.h = self.PAGESIZE
+        self._logo = ImageReader(self.hotel.logo.path) if self.hotel.logo else None
+
+    def render(self, payment: Payment) -> bytes:
+        """retorna o pdf do comprovante de um pagamento"""
+        return self.render_many([payment])
+
+    def render_many(self, payments) -> bytes:
+        """retorna um único pdf com uma página de comprovante por pagamento,
+        o cabeçalho é desenhado uma vez por documento e reutilizado em todas
+        as suas páginas"""
+        buffer = io.BytesIO()
+        _canvas = canvas.Canvas(buffer, pagesize=self.PAGESIZE)
+        self._draw_header_form(_canvas)
+        for payment in payments:
+            _canvas.doForm(self.HEADER_FORM)
+            self._draw_body(_canvas, payment)
+            _canvas.showPage()
+        _canvas.save()
+        return buffer.getvalue()
+
+    @staticmethod
+    def rows(payment: Payment) -> list[str]:
         """return all the rows of the pdf in list format"""
-        rows = [
-            f'Data de emissão: {self.payment.date.strftime("%h:%M:%S %d/%m/%Y")}',
-            f'Status: {self.payment.status}',
-            f'Pagador: {self.payment.reservation.client.complete_name}',
-            f'Recebedor: HOTEL'
-            f'Check-in: {self.payment.reservation.checkin.strftime("%d/%m/%Y")}',
-            f'Check-out: {self.payment.reservation.checkout.strftime("%d/%m/%Y")}',
-            f'Classe: {self.payment.reservation.room.room_class}',
-            f'Quarto: Nº{self.payment.reservation.room.number}',
-            f'Total: {self.payment.reservation.formatted_price()}',
+        return [
+            f'Data de emissão: {payment.date.strftime("%H:%M:%S %d/%m/%Y")}',
+            f'Status: {payment.status}',
+            f'Pagador: {payment.reservation.client.complete_name}',
+            'Recebedor: HOTEL',
+            f'Check-in: {payment.reservation.checkin.strftime("%d/%m/%Y")}',
+            f'Check-out: {payment.reservation.checkout.strftime("%d/%m/%Y")}',
+            f'Classe: {payment.reservation.room.room_class}',
+            f'Quarto: Nº{payment.reservation.room.number}',
+            f'Total: {payment.reservation.formatted_price()}',
         ]
-        return rows
-    
-    def _draw_header(self):
-        """draw the logo, hotel name, and title of the pdf"""
-        if self.hotel.logo:
-            self._canvas.drawInlineImage(str(self.hotel.logo.path), 30, self.h-40)
 
-        self._canvas.setFontSize(30)
-        self._canvas.drawString(65, self.h-38, self.hotel.name)
+    def _draw_header_form(self, _canvas: canvas.Canvas) -> None:
+        """register the logo, hotel name, and title of the pdf as a form of
+        this document. The form belongs to the canvas, only the decoded logo
+        is shared between documents"""
+        _canvas.beginForm(self.HEADER_FORM)
+        if self._logo is not None:
+            _canvas.drawImage(self._logo, 30, self.h-40)
 
-        self._canvas.setFontSize(20)
-        self._canvas.drawString(self.w-350, self.h-40, 'COMPROVANTE DE PAGAMENTO', wordSpace=0.5)
+        _canvas.setFont(self.FONT, 30)
+        _canvas.drawString(65, self.h-38, self.hotel.name)
 
-        self._canvas.line(30, self.h-50, self.w-30, self.h-50)
-    
-    def _draw_body(self):
+        _canvas.setFont(self.FONT, 20)
+        _canvas.drawString(self.w-350, self.h-40, 'COMPROVANTE DE PAGAMENTO', wordSpace=0.5)
+
+        _canvas.line(30, self.h-50, self.w-30, self.h-50)
+        _canvas.endForm()
+
+    def _draw_body(self, _canvas: canvas.Canvas, payment: Payment) -> None:
         """draw the payment information into the body of the pdf"""
-        self._canvas.setFontSize(15)
+        _canvas.setFont(self.FONT, 15)
         initial_offset = 85
         offset_y = initial_offset
-        for row in self._rows_list():
-            self._canvas.drawString(70, self.h-offset_y, row)
+        for row in self.rows(payment):
+            _canvas.drawString(70, self.h-offset_y, row)
             offset_y += initial_offset * .5
 
-    def _save(self):
-        """save the generated pdf in the buffer"""
-        self._canvas.save()
-        self.buffer.seek(0)
 
-    def _send_email(self):
+_receipt_renderer = None
+
+
+def get_receipt_renderer() -> ReceiptRenderer:
+    """retorna o `ReceiptRenderer` do processo atual. Ele é recriado apenas
+    quando o snapshot do hotel é renovado, ou seja, quando Hotel ou Contact
+    são alterados ou o snapshot expira."""
+    global _receipt_renderer
+    snapshot = context_processors.hotel()
+    if _receipt_renderer is None or _receipt_renderer[0] is not snapshot:
+        renderer = ReceiptRenderer(snapshot['hotel'], snapshot['hotel_contact'])
+        _receipt_renderer = (snapshot, renderer)
+    return _receipt_renderer[1]
+
+
+def private_storage() -> FileSystemStorage:
+    """storage em `PRIVATE_STORAGE_ROOT`, fora do MEDIA_ROOT servido
+    publicamente, para arquivos entregues apenas por views com permissão"""
+    return FileSystemStorage(location=settings.PRIVATE_STORAGE_ROOT, base_url=None)
+
+
+class ReceiptStore:
+    """Armazena os pdfs dos comprovantes no storage privado, endereçados pelo
+    hash do id e do status do pagamento, para que cada comprovante seja
+    renderizado uma única vez e reutilizado por emails e downloads. O
+    download passa pela view, que verifica o dono da reserva.
+    """
+    DIRECTORY = 'receipts'
+
+    def __init__(self, storage: FileSystemStorage | None = None, renderer: ReceiptRenderer | None = None) -> None:
+        self.storage = storage or private_storage()
+        self._renderer = renderer
+
+    @staticmethod
+    def key(payment: Payment) -> str:
+        """retorna o hash que identifica o comprovante do pagamento"""
+        return sha256(f'{payment.pk}:{payment.status}'.encode()).hexdigest()
+
+    def name(self, payment: Payment) -> str:
+        """retorna o caminho do comprovante no storage"""
+        return f'{self.DIRECTORY}/{self.key(payment)}.pdf'
+
+    def get_or_render(self, payment: Payment) -> bytes:
+        """retorna os bytes do comprovante armazenado, renderizando e
+        armazenando o pdf caso ainda não exista"""
+        name = self.name(payment)
+        if self.storage.exists(name):
+            with self.storage.open(name, 'rb') as pdf:
+                return pdf.read()
+
+        pdf = (self._renderer or get_receipt_renderer()).render(payment)
+        self.write(name, pdf)
+        return pdf
+
+    def refresh(self, payment: Payment) -> bytes:
+        """renderiza novamente o comprovante substituindo o armazenado, usado
+        quando o layout ou a marca do hotel mudam"""
+        pdf = (self._renderer or get_receipt_renderer()).render(payment)
+        self.write(self.name(payment), pdf)
+        return pdf
+
+    def write(self, name: str, content: bytes) -> None:
+        """grava o conteúdo em um arquivo temporário do mesmo diretório e o
+        move para `name` com `os.replace`, que é atômico: leituras
+        concorrentes encontram o arquivo anterior ou o novo, nunca um arquivo
+        ausente ou incompleto, e o nome não é alterado por colisão como no
+        `storage.save`"""
+        path = self.storage.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def open(self, payment: Payment) -> File:
+        """abre o comprovante armazenado para leitura, renderizando caso
+        ainda não exista"""
+        name = self.name(payment)
+        if not self.storage.exists(name):
+            self.get_or_render(payment)
+        return self.storage.open(name, 'rb')
+
+    def stat(self, payment: Payment) -> os.stat_result:
+        """retorna o stat do comprovante armazenado, renderizando caso ainda
+        não exista"""
+        name = self.name(payment)
+        if not self.storage.exists(name):
+            self.get_or_render(payment)
+        return os.stat(self.storage.path(name))
+
+    @staticmethod
+    def etag(payment: Payment, stat: os.stat_result) -> str:
+        """retorna o ETag do conteúdo armazenado. Muda sempre que o comprovante
+        é renderizado novamente, por exemplo após uma mudança de layout ou da
+        marca do hotel seguida de `regenerate_receipts`"""
+        return sha256(f'{payment.pk}:{stat.st_mtime_ns}:{stat.st_size}'.encode()).hexdigest()
+
+
+class PaymentPDFHandler:
+    """Cria o pdf com dados do pagamento e envia para o cliente via email.
+    """
+    def __init__(
+            self, payment: Payment,
+            renderer: ReceiptRenderer | None = None,
+            store: ReceiptStore | None = None
+        ) -> None:
+        self.payment = payment
+        self.renderer = renderer or get_receipt_renderer()
+        self.store = store or ReceiptStore(renderer=self.renderer)
+        self.pdf_name = f'comprovante_de_pagamento_{self.payment.pk}.pdf'
+
+    def handle(self):
+        """get the stored pdf, rendering it only once, and sent by email to the client"""
+        return self._send_email(self.store.get_or_render(self.payment))
+
+    def _send_email(self, pdf: bytes):
         """send the email with the generated pdf to the client and return 1 if
         the email was sent correctly
         """
@@ -90,15 +234,26 @@ class PaymentPDFHandler:
             subject='Comprovante de pagamento  da reserva',
             body=f'Seu comprovante de pagamento para a reserva do quarto Nº{self.payment.reservation.room.number}',
             to=[self.payment.reservation.client.email],
-            from_email=self.hotel_contact.email,
+            from_email=self.renderer.hotel_contact.email,
         )
-        msg.attach(self.pdf_name, self.buffer.getvalue(), 'application/pdf')
+        msg.attach(self.pdf_name, pdf, 'application/pdf')
         return msg.send(fail_silently=False)
 
 
-class ReservationStripePaymentCreator:
-    """Cria a session para pagamento da reserva pelo stripe"""
+def configure_stripe() -> None:
+    """configura o cliente http compartilhado do stripe, com conexões
+    keep-alive, timeout e retentativas, e a url base da api, que pode apontar
+    para um servidor falso em testes de carga"""
     stripe.api_key = settings.STRIPE_API_KEY_SECRET
+    stripe.api_base = settings.STRIPE_API_BASE
+    stripe.max_network_retries = settings.STRIPE_MAX_NETWORK_RETRIES
+    stripe.default_http_client = stripe.http_client.RequestsClient(timeout=settings.STRIPE_TIMEOUT)
+
+
+class ReservationStripePaymentCreator:
+    """Cria a session para pagamento da reserva pelo stripe, reaproveitando
+    a session guardada no pagamento pendente da reserva enquanto ela for válida"""
+    MIN_REMAINING = timedelta(minutes=1)
 
     def __init__(self, request, reservation, success_url_name, cancel_url_name) -> None:
         self.baseurl = f"http://{request.get_host()}"
@@ -112,17 +267,50 @@ class ReservationStripePaymentCreator:
         )
         self.reservation = reservation
 
-        params = self._create_params()
-        self._session = self._create_session(**params)
+        self._session = self._stored_session()
+        self.reused = self._session is not None
+
+    def bind(self, payment: Payment) -> Payment:
+        """guarda os dados da session no pagamento para que ela seja reaproveitada"""
+        payment.session_id = self.session.id
+        payment.session_url = self.session.url
+        payment.session_expires_at = datetime.fromtimestamp(self.session.expires_at, tz=timezone.utc)
+        return payment
+
+    def _stored_session(self) -> Session | None:
+        """retorna a session guardada no pagamento pendente da reserva caso
+        ainda não tenha expirado, sem consultar o stripe"""
+        payment = Payment.objects.filter(
+            reservation=self.reservation,
+            status='P',
+            session_expires_at__gt=now() + self.MIN_REMAINING,
+        ).exclude(session_id='').first()
+        if payment is None:
+            return None
+
+        return Session.construct_from(
+            {
+                'id': payment.session_id,
+                'url': payment.session_url,
+                'expires_at': int(payment.session_expires_at.timestamp()),
+            },
+            stripe.api_key,
+        )
     
     @property
-    def session(self):
+    def session(self) -> Session:
+        """session do stripe, criada apenas no primeiro acesso caso não haja
+        uma session válida para reaproveitar"""
+        if self._session is None:
+            params = self._create_params()
+            self._session = self._create_session(**params)
         return self._session
 
     def _create_params(self) -> dict[str, Any]:
         prod_name = f"Reserva: Quarto Nº{self.reservation.room.number}, classe {self.reservation.room.room_class}."
         params = {
             "mode": "payment",
+            "client_reference_id": str(self.reservation.pk),
             "success_url": self.success_url,
             "cancel_url": self.cancel_url,
             "expires_at": self.expires_at,
@@ -151,27 +339,6 @@ class ReservationStripePaymentCreator:
         return f'{self.__class__.__name__}({self.__dict__})'
 
 
-def resize_image(img_path, w, h=None):
-    """redimensiona imagem com tamanhos expecificados
-
-    Args:
-        img_path (Any): caminho da imagem
-        w (int): largura da imagem
-        h (int, optional): altura da imagem. Defaults to None.
-    """
-    img = Image.open(img_path)
-    original_w, original_h = img.size
-
-    if h is None: h = round(w * original_h / original_w)
-    if original_h <= h: h = original_h
-    
-    resized = img.resize((w, h), Image.Resampling.NEAREST)
-    resized.save(img_path, optimize=True, quality=70)
-
-    resized.close()
-    img.close()
-
-
 def fmt_date(value: str, fmt='%d/%m/%Y') -> str:
     """formata a data no formato especificado.
 
@@ -185,22 +352,150 @@ def fmt_date(value: str, fmt='%d/%m/%Y') -> str:
     return datetime.strftime(value, fmt)
 
 
-def verify_captcha(captcha_resp) -> bool:
+class CaptchaVerifier:
+    """Valida o google recaptcha v3 usando uma sessão http keep-alive
+    compartilhada pelo processo, com timeout, circuit breaker e cache dos
+    veredictos negativos na sessão do usuário. Os tokens do recaptcha são de
+    uso único, um veredicto positivo nunca é reaproveitado para que o mesmo
+    token não seja aceito novamente em outro envio.
+
+    Quando o endpoint falha `failure_threshold` vezes seguidas o circuito abre
+    por `cooldown` segundos e nenhuma requisição é feita, nesse período e em
+    cada falha o captcha é aceito se `fail_open` for True, ou recusado.
+    """
+    SESSION_KEY = 'recaptcha_verdicts'
+    MIN_SCORE = .8
+
+    def __init__(
+            self, url: str, secret: str,
+            timeout: float = 3,
+            fail_open: bool = False,
+            failure_threshold: int = 5,
+            cooldown: float = 30,
+            verdict_ttl: float = 120,
+        ) -> None:
+        self.url = url
+        self.secret = secret
+        self.timeout = timeout
+        self.fail_open = fail_open
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.verdict_ttl = verdict_ttl
+        self.http = requests.Session()
+        self._failures = 0
+        self._open_until = 0.
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger('djangoLogger')
+
+    @property
+    def is_open(self) -> bool:
+        """True enquanto o circuito estiver aberto"""
+        return time.monotonic() < self._open_until
+
+    def verify(self, captcha_resp, session=None) -> bool:
+        """valida a resposta do captcha
+
+        Args:
+            captcha_resp (Any): resposta do usuário para o captcha
+            session (SessionBase, optional): sessão do usuário usada para
+            guardar o veredicto. Defaults to None.
+
+        Returns:
+            bool: retorna True se o captcha é valido
+        """
+        if not captcha_resp:
+            return False
+
+        key = sha256(str(captcha_resp).encode()).hexdigest()
+        verdict = self._cached_verdict(session, key)
+        if verdict is not None:
+            return verdict
+
+        if self.is_open:
+            self.logger.warning('recaptcha circuit open, skipping verification')
+            return self.fail_open
+
+        try:
+            response = self.http.post(
+                self.url,
+                data={'response': captcha_resp, 'secret': self.secret},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            json_resp = response.json()
+        except (requests.RequestException, ValueError) as exc:
+            self._record_failure()
+            self.logger.warning('recaptcha verification failed: %s', exc)
+            return self.fail_open
+
+        self._record_success()
+        success = json_resp.get('success', False)
+        good_score = json_resp.get('score', 0) > self.MIN_SCORE
+        verdict = bool(success and good_score)
+        if not verdict:
+            self._cache_verdict(session, key, verdict)
+        return verdict
+
+    def _record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._open_until = time.monotonic() + self.cooldown
+                self._failures = 0
+                self.logger.error('recaptcha circuit opened for %ss', self.cooldown)
+
+    def _record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+
+    def _cached_verdict(self, session, key: str) -> bool | None:
+        if session is None:
+            return None
+        verdict = session.get(self.SESSION_KEY, {}).get(key)
+        if verdict is None or verdict[1] <= time.time():
+            return None
+        return verdict[0]
+
+    def _cache_verdict(self, session, key: str, verdict: bool) -> None:
+        if session is None:
+            return
+        now_ts = time.time()
+        verdicts = {
+            k: v for k, v in session.get(self.SESSION_KEY, {}).items() if v[1] > now_ts
+        }
+        verdicts[key] = [verdict, now_ts + self.verdict_ttl]
+        session[self.SESSION_KEY] = verdicts
+
+
+_captcha_verifier = None
+
+
+def get_captcha_verifier() -> CaptchaVerifier:
+    """retorna o `CaptchaVerifier` do processo atual, criado a partir das
+    configurações G_RECAPTCHA_* do settings"""
+    global _captcha_verifier
+    if _captcha_verifier is None:
+        _captcha_verifier = CaptchaVerifier(
+            url=settings.G_RECAPTCHA_VERIFY_URL,
+            secret=settings.G_RECAPTCHA_KEY_SECRET,
+            timeout=settings.G_RECAPTCHA_TIMEOUT,
+            fail_open=settings.G_RECAPTCHA_FAIL_OPEN,
+            failure_threshold=settings.G_RECAPTCHA_BREAKER_THRESHOLD,
+            cooldown=settings.G_RECAPTCHA_BREAKER_COOLDOWN,
+            verdict_ttl=settings.G_RECAPTCHA_VERDICT_TTL,
+        )
+    return _captcha_verifier
+
+
+def verify_captcha(captcha_resp, session=None) -> bool:
     """realiza a validação do google recaptcha v3
 
     Args:
         captcha_resp (Any): resposta do usuário para o captcha
+        session (SessionBase, optional): sessão do usuário, quando informada
+        o veredicto é reaproveitado em novos envios do mesmo captcha.
 
     Returns:
         bool: retorna True se o captcha é valido
     """
-    data = {
-        'response': captcha_resp,
-        'secret': settings.G_RECAPTCHA_KEY_SECRET
-    }
-    response = requests.post('https://www.google.com/recaptcha/api/siteverify', data=data)
-    json_resp = response.json()
-    success = json_resp.get('success', False)
-    good_score = json_resp.get('score', 0) > .8
-    is_valid = success and good_score
-    return True if is_valid else False
+    return get_captcha_verifier().verify(captcha_resp, session)
@@ -0,0 +1,50 @@
+import time
+from typing import Any
+
+from django.core.cache import cache
+
+CATALOG_VERSION_KEY = 'catalog:version'
+CATALOG_CACHE_TIMEOUT = 60 * 60  # 1 hour
+# com um cache local do processo (LocMemCache) a versão trocada por um
+# processo não chega aos demais, ela expira para que recebam as alterações
+CATALOG_VERSION_TTL = 60  # 1 minute
+
+
+def catalog_version() -> int:
+    """retorna a versão atual do catálogo (quartos, classes, benefícios e
+    serviços) usada para compor as keys de cache. Caso a versão tenha
+    expirado após `CATALOG_VERSION_TTL` segundos ou sido descartada pelo
+    backend de cache uma nova é criada."""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), CATALOG_VERSION_TTL)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version() -> None:
+    """invalida todos os caches do catálogo trocando a versão atual por
+    uma nova. Usa o timestamp para que uma versão nunca seja reutilizada."""
+    cache.set(CATALOG_VERSION_KEY, time.time_ns(), CATALOG_VERSION_TTL)
+
+
+def catalog_context() -> dict[str, Any]:
+    """dados necessários no context para usar o template tag `cache`
+    com keys versionadas do catálogo"""
+    return {
+        'catalog_version': catalog_version(),
+        'catalog_cache_timeout': CATALOG_CACHE_TIMEOUT,
+    }
+
+
+def invalidate_catalog(sender, update_fields=None, action='', **kwargs) -> None:
+    """receiver de signals que invalida o cache do catálogo. Saves que
+    alteram apenas a disponibilidade do quarto são ignorados pois ela
+    não faz parte dos fragmentos cacheados, assim como as etapas `pre_*`
+    do m2m_changed."""
+    if update_fields and set(update_fields) <= {'available'}:
+        return
+
+    if action.startswith('pre_'):
+        return
+    bump_catalog_version()
@@ -0,0 +1,46 @@
+import django
+from django.db import connections
+from django.conf import settings
+
+
+def sqlite_pragma_statements(pragmas: dict) -> list[str]:
+    """retorna os comandos PRAGMA para os pragmas informados"""
+    return [f'PRAGMA {pragma} = {value}' for pragma, value in pragmas.items()]
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs) -> None:
+    """receiver do signal connection_created que aplica `SQLITE_PRAGMAS` em
+    cada nova conexão sqlite: WAL para que leituras não bloqueiem escritas,
+    busy_timeout para aguardar o lock em vez de falhar com "database is locked",
+    synchronous NORMAL, que com WAL só perde durabilidade em queda de energia,
+    e mmap e cache maiores. Desativado com SQLITE_TUNED=0.
+    """
+    if connection.vendor != 'sqlite' or not settings.SQLITE_TUNED:
+        return
+
+    with connection.cursor() as cursor:
+        for statement in sqlite_pragma_statements(settings.SQLITE_PRAGMAS):
+            cursor.execute(statement)
+
+
+def close_unusable_connections(sender, **kwargs) -> None:
+    """receiver do signal request_started que fecha as conexões persistentes
+    (CONN_MAX_AGE) que deixaram de responder, por exemplo após um restart do
+    servidor postgresql, para que a requisição abra uma conexão nova em vez de
+    falhar. No sqlite `is_usable` não faz query. Desativado com DB_HEALTH_CHECKS=0.
+    """
+    if not settings.DB_HEALTH_CHECKS:
+        return
+
+    for connection in connections.all():
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+
+
+def init_pool_worker() -> None:
+    """initializer dos processos de um ProcessPoolExecutor: configura o django
+    e descarta, sem fechar, as conexões herdadas do processo pai para que cada
+    processo abra a sua"""
+    django.setup()
+    for connection in connections.all():
+        connection.connection = None
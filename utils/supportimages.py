@@ -0,0 +1,157 @@
+import logging
+import os
+from io import BytesIO
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Model
+from django.db.models.fields.files import FieldFile
+from PIL import Image, ImageOps, features
+from utils.supportcache import bump_catalog_version
+from utils.supporttasks import enqueue_task
+
+# formato do Pillow, extensão, mime type e opções de cada formato gerado.
+# A ordem é a de preferência nos <source> do <picture>
+FORMATS = {
+    'avif': ('AVIF', 'avif', 'image/avif', {'quality': 60}),
+    'webp': ('WEBP', 'webp', 'image/webp', {'quality': 80, 'method': 6}),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg', {'quality': 80, 'optimize': True, 'progressive': True}),
+    'png': ('PNG', 'png', 'image/png', {'optimize': True}),
+}
+MODERN_FORMATS = ('avif', 'webp')
+VARIANTS_DIR = 'variants'
+
+
+def output_formats(image: Image.Image) -> list[str]:
+    """formatos modernos suportados pelo Pillow instalado seguidos do formato
+    de fallback, png para imagens com transparência e jpeg para as demais"""
+    formats = [name for name in MODERN_FORMATS if features.check(name)]
+    transparent = image.mode in ('RGBA', 'LA', 'P') or 'transparency' in image.info
+    return formats + ['png' if transparent else 'jpeg']
+
+
+def variant_widths(widths, original_width: int) -> list[int]:
+    """larguras menores ou iguais à original, sem ampliar a imagem. Caso todas
+    sejam maiores usa a largura original"""
+    return sorted({width for width in widths if width <= original_width}) or [original_width]
+
+
+def variant_name(name: str, width: int, extension: str) -> str:
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, VARIANTS_DIR, f'{stem}-{width}w.{extension}')
+
+
+def create_variants(field_file: FieldFile, widths, size: tuple[int, int] | None = None) -> dict:
+    """gera as variantes da imagem em cada largura e formato e as salva no
+    storage do campo ao lado da original, que não é alterada.
+
+    Args:
+        field_file (FieldFile): imagem original
+        widths (Iterable[int]): larguras das variantes
+        size (tuple[int, int], optional): a proporção é recortada para a de
+        `size`. Defaults to None, que mantém a proporção original.
+
+    Returns:
+        dict: `source` com o nome da original e `formats` com o nome de cada
+        variante por formato e largura
+    """
+    storage = field_file.storage
+    formats = {}
+    with field_file.open('rb'), Image.open(field_file) as original:
+        image = ImageOps.exif_transpose(original)
+        image.load()
+
+    for fmt in output_formats(image):
+        pil_format, extension, _, options = FORMATS[fmt]
+        if fmt == 'jpeg':
+            source = image.convert('RGB')
+        else:
+            source = image if image.mode in ('RGB', 'RGBA') else image.convert('RGBA')
+
+        formats[fmt] = {}
+        for width in variant_widths(widths, image.width):
+            if size is not None:
+                height = round(width * size[1] / size[0])
+                resized = ImageOps.fit(source, (width, height), Image.Resampling.LANCZOS)
+            else:
+                height = round(width * image.height / image.width)
+                resized = source.resize((width, height), Image.Resampling.LANCZOS)
+
+            content = BytesIO()
+            resized.save(content, pil_format, **options)
+            name = storage.save(variant_name(field_file.name, width, extension), ContentFile(content.getvalue()))
+            formats[fmt][str(width)] = name
+    return {'source': field_file.name, 'formats': formats}
+
+
+def delete_variants(storage, variants: dict) -> None:
+    for names in variants.get('formats', {}).values():
+        for name in names.values():
+            storage.delete(name)
+
+
+def variants_outdated(field_file: FieldFile, variants: dict) -> bool:
+    """True quando as variantes não correspondem ao arquivo atual do campo"""
+    return (field_file.name or '') != variants.get('source', '')
+
+
+def variants_state(instances, field: str) -> str:
+    """arquivo atual do campo e origem das variantes de cada instância, usado
+    na key dos fragmentos cacheados. A task roda no worker e a versão do
+    catálogo trocada por ela não chega aos processos web com um cache local,
+    assim o fragmento renderizado com as variantes pendentes deixa de ser
+    usado assim que elas são geradas"""
+    if isinstance(instances, Model):
+        instances = [instances]
+    return ','.join(
+        f"{getattr(instance, field).name}:{getattr(instance, f'{field}_variants').get('source', '')}"
+        for instance in instances
+    )
+
+
+def enqueue_variants(instance: Model, field: str, variants_field: str, task: str) -> None:
+    """enfileira, após o commit, a task que gera as variantes caso o arquivo
+    do campo tenha mudado. Saves que não alteram o arquivo não fazem nada"""
+    if not variants_outdated(getattr(instance, field), getattr(instance, variants_field)):
+        return
+    pk = instance.pk
+    transaction.on_commit(lambda: enqueue_task(task, pk, task_name=f'{task}_{pk}'))
+
+
+def update_variants(model, pk: int, field: str, variants_field: str, widths, size=None) -> bool:
+    """gera as variantes do arquivo atual do campo, guarda seus nomes e remove
+    as variantes anteriores. Caso o arquivo seja trocado durante o
+    processamento as variantes geradas são descartadas, a task enfileirada
+    pela troca gera as novas.
+
+    Returns:
+        bool: True se as variantes foram atualizadas
+    """
+    logger = logging.getLogger('djangoLogger')
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None:
+        return False
+
+    field_file, previous = getattr(instance, field), getattr(instance, variants_field)
+    if not variants_outdated(field_file, previous):
+        return False
+
+    variants = create_variants(field_file, widths, size) if field_file else {}
+    updated = model.objects.filter(pk=pk, **{field: field_file.name}).update(**{variants_field: variants})
+    if not updated:
+        delete_variants(field_file.storage, variants)
+        logger.info('%s %s image changed while processing, variants discarded', model.__name__, pk)
+        return False
+
+    delete_variants(field_file.storage, previous)
+    # update() não dispara os signals que invalidam os fragmentos cacheados.
+    # Nos demais processos a key dos fragmentos muda com `variants_state`
+    bump_catalog_version()
+    logger.info('%s %s image variants updated: %s', model.__name__, pk, list(variants.get('formats', {})))
+    return True
+
+
+def srcset(variants: dict, fmt: str, storage) -> str:
+    """valor do atributo srcset com a url e a largura de cada variante do formato"""
+    names = variants.get('formats', {}).get(fmt, {})
+    return ', '.join(f'{storage.url(name)} {width}w' for width, name in names.items())
@@ -0,0 +1,153 @@
+import copy
+import json
+import logging
+import os
+import queue
+import weakref
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler, WatchedFileHandler
+from django.db.models.query import QuerySet
+
+
+def describe_arg(arg):
+    """substitui querysets por uma descrição que não executa a query. Os
+    demais argumentos são mantidos"""
+    if isinstance(arg, QuerySet):
+        return f'<QuerySet {arg.model.__name__}>'
+    return arg
+
+
+class JsonFormatter(logging.Formatter):
+    """formata cada registro como uma linha JSON"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'path': record.pathname,
+            'func': record.funcName,
+            'line': record.lineno,
+            'process': record.process,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SizedTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """TimedRotatingFileHandler que também rotaciona quando o arquivo atinge
+    `max_bytes`. Rotações no mesmo intervalo recebem um contador no nome para
+    não sobrescrever o arquivo anterior. Cada processo rotaciona por conta
+    própria, use apenas quando um único processo escreve no arquivo"""
+    def __init__(self, filename, max_bytes: int = 0, **kwargs) -> None:
+        super().__init__(filename, **kwargs)
+        self.max_bytes = max_bytes
+
+    def shouldRollover(self, record: logging.LogRecord) -> int:
+        if super().shouldRollover(record):
+            return 1
+        if self.max_bytes > 0 and self.stream is not None:
+            self.stream.seek(0, 2)
+            return int(self.stream.tell() >= self.max_bytes)
+        return 0
+
+    def rotation_filename(self, default_name: str) -> str:
+        name, count = default_name, 0
+        while os.path.exists(name):
+            count += 1
+            name = f'{default_name}.{count:03d}'
+        return name
+
+
+_queue_handlers = weakref.WeakSet()
+
+
+def _restart_queue_handlers() -> None:
+    """a thread do listener não existe no processo filho criado por fork, cada
+    handler recebe uma fila e um listener novos"""
+    for handler in _queue_handlers:
+        handler.start()
+
+
+os.register_at_fork(after_in_child=_restart_queue_handlers)
+
+
+class QueueLogHandler(QueueHandler):
+    """handler não bloqueante: a requisição apenas formata a mensagem e a
+    coloca em uma fila limitada. Uma thread em background serializa em JSON e
+    escreve no arquivo. Com a fila cheia o registro é descartado e contado em
+    `dropped` em vez de bloquear a requisição.
+
+    Por padrão o arquivo é escrito com WatchedFileHandler e a rotação fica com
+    uma ferramenta externa (logrotate), pois os processos web e do qcluster
+    compartilham o arquivo e rotacioná-lo em cada um perde ou duplica rotações.
+    Com `rotate=True` o próprio handler rotaciona por tamanho e por tempo, o que
+    só é seguro com um único processo escrevendo no arquivo.
+    """
+    def __init__(
+            self,
+            filename,
+            max_bytes: int = 10 * 1024 * 1024,
+            when: str = 'midnight',
+            backup_count: int = 7,
+            queue_size: int = 10000,
+            rotate: bool = False,
+    ) -> None:
+        super().__init__(None)
+        self.queue_size = queue_size
+        self.dropped = 0
+        if rotate:
+            self.target = SizedTimedRotatingFileHandler(
+                filename, max_bytes=max_bytes, when=when, backupCount=backup_count,
+                encoding='utf-8', delay=True,
+            )
+        else:
+            self.target = WatchedFileHandler(filename, encoding='utf-8', delay=True)
+        self.target.setFormatter(JsonFormatter())
+        self.listener = None
+        self.start()
+        _queue_handlers.add(self)
+
+    def start(self) -> None:
+        self.queue = queue.Queue(self.queue_size)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """monta a mensagem na thread da requisição, pois os argumentos podem
+        mudar depois, sem executar querysets. Serialização e escrita ficam
+        para a thread do listener"""
+        record = copy.copy(record)
+        if isinstance(record.args, dict):
+            record.args = {key: describe_arg(value) for key, value in record.args.items()}
+        elif record.args:
+            record.args = tuple(describe_arg(arg) for arg in record.args)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.target.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self) -> None:
+        """aguarda a thread do listener escrever os registros já enfileirados"""
+        if self.listener._thread is not None:
+            self.queue.join()
+        self.target.flush()
+
+    def close(self) -> None:
+        if self.listener._thread is not None:
+            self.listener.stop()
+        self.target.close()
+        _queue_handlers.discard(self)
+        super().close()
@@ -0,0 +1,80 @@
+import logging
+import random
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from django.http import HttpRequest, HttpResponse
+
+
+class QueryStats:
+    """execute wrapper que conta as queries, soma o tempo gasto no banco e
+    guarda a query mais lenta. Veja `connection.execute_wrapper`"""
+    def __init__(self) -> None:
+        self.count = 0
+        self.duration = 0.0
+        self.slowest_duration = 0.0
+        self.slowest_sql = ''
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            if elapsed > self.slowest_duration:
+                self.slowest_duration = elapsed
+                self.slowest_sql = sql
+
+
+class SQLInstrumentationMiddleware:
+    """mede, em uma amostra das requisições (SQL_INSTRUMENTATION_SAMPLE_RATE),
+    a quantidade de queries, o tempo total no banco, a query mais lenta e o
+    tempo da view. Com SQL_SERVER_TIMING o resultado é enviado no header
+    `Server-Timing`, fora do DEBUG apenas para usuários staff, e as
+    requisições acima de SQL_QUERY_BUDGET queries ou SQL_TIME_BUDGET ms são
+    registradas no log. Requisições fora da amostra não são instrumentadas.
+    """
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+        self.logger = logging.getLogger('djangoLogger')
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if random.random() >= settings.SQL_INSTRUMENTATION_SAMPLE_RATE:
+            return self.get_response(request)
+
+        stats = QueryStats()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - start) * 1000
+        db_ms = stats.duration * 1000
+
+        if self.expose_timing(request):
+            timing = f'db;dur={db_ms:.1f};desc="{stats.count} queries", app;dur={total_ms:.1f}'
+            if response.has_header('Server-Timing'):
+                timing = f'{response["Server-Timing"]}, {timing}'
+            response['Server-Timing'] = timing
+
+        if stats.count > settings.SQL_QUERY_BUDGET or total_ms > settings.SQL_TIME_BUDGET:
+            match = request.resolver_match
+            self.logger.warning(
+                'request over budget: %s %s (%s) %s queries, %.1fms sql, %.1fms total, slowest %.1fms: %s',
+                request.method, request.path, match.view_name if match else '-',
+                stats.count, db_ms, total_ms, stats.slowest_duration * 1000, stats.slowest_sql,
+            )
+        return response
+
+    @staticmethod
+    def expose_timing(request: HttpRequest) -> bool:
+        """os tempos revelam detalhes internos, fora do DEBUG só vão para staff"""
+        if not settings.SQL_SERVER_TIMING:
+            return False
+        if settings.DEBUG:
+            return True
+        user = getattr(request, 'user', None)
+        return bool(user and user.is_staff)
@@ -11,6 +11,7 @@ class BenefitErrorMessages:
 
 class RoomRules:
     IMAGE_SIZE = 560, 420
+    IMAGE_WIDTHS = 280, 560, 1120
     IMAGE_AVAILABLE_FORMATS = ['jpg', 'png']
     MAX_ADULTS = 5
     MIN_ADULTS = 1
@@ -135,3 +136,4 @@ class PaymentErrorMessages:
 
 class ServicesRules:
     IMG_SIZE = 560, 420
+    IMG_WIDTHS = 140, 280, 560
@@ -0,0 +1,75 @@
+import pickle
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Model
+from django_q.tasks import async_task
+
+TASK_PAYLOAD_MAX_BYTES = 1024
+
+
+def enqueue_task(func: str, *args, task_name: str, **kwargs) -> str:
+    """enfileira a task no django-q garantindo que os argumentos sejam
+    pequenos, ids e valores simples, e não instâncias de models que seriam
+    serializadas inteiras na fila do broker.
+
+    Args:
+        func (str): caminho da função da task, ex: 'payments.tasks.create_payment_pdf'
+        task_name (str): nome da task
+
+    Raises:
+        ValueError: caso algum argumento seja uma instância de model ou os
+        argumentos serializados passem de `TASK_PAYLOAD_MAX_BYTES`
+
+    Returns:
+        str: id da task criada
+    """
+    if any(isinstance(arg, Model) for arg in (*args, *kwargs.values())):
+        raise ValueError(f'task {task_name} received a model instance. Pass its id instead.')
+
+    size = len(pickle.dumps((args, kwargs)))
+    if size > TASK_PAYLOAD_MAX_BYTES:
+        raise ValueError(
+            f'task {task_name} payload has {size} bytes, '
+            f'the limit is {TASK_PAYLOAD_MAX_BYTES}. Pass ids instead of model instances.'
+        )
+    return async_task(func, *args, task_name=task_name, **kwargs)
+
+
+def send_reservation_emails(reservations, client_subject: str, client_body: str,
+                            summary_subject: str, summary_header: str) -> int:
+    """envia um email para cada cliente das reservas e um único resumo com
+    todas elas para os admins, tudo pela mesma conexão.
+
+    Args:
+        reservations (list[Reservation]): reservas com client e room carregados
+        client_subject (str): assunto do email dos clientes
+        client_body (str): corpo do email dos clientes
+        summary_subject (str): assunto do resumo dos admins
+        summary_header (str): primeira linha do resumo, antes das reservas
+
+    Returns:
+        int: quantidade de emails enviados
+    """
+    messages = [
+        EmailMessage(client_subject, client_body, settings.DEFAULT_FROM_EMAIL, [reservation.client.email])
+        for reservation in reservations
+        if reservation.client is not None and reservation.client.email
+    ]
+
+    admin_emails = list(
+        get_user_model().objects.filter(is_staff=True).exclude(email='').values_list('email', flat=True)
+    )
+    if admin_emails:
+        summary = '\n'.join(
+            f'- Reserva de {reservation.client.complete_name} para o quarto Nº{reservation.room.number}'
+            for reservation in reservations
+            if reservation.client is not None and reservation.room is not None
+        )
+        messages.append(
+            EmailMessage(summary_subject, f'{summary_header}\n{summary}', settings.DEFAULT_FROM_EMAIL, admin_emails)
+        )
+
+    with get_connection(fail_silently=False) as connection:
+        connection.send_messages(messages)
+    return len(messages)
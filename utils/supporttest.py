@@ -1,7 +1,43 @@
+import hmac
+import json
+import time
+from hashlib import sha256
 from django.contrib.messages import get_messages
+from django.urls import reverse
 
 
 def get_message(response):
     msgs = get_messages(response.wsgi_request)
     msg_list = list(msgs)
     return msg_list[0].message if msg_list else ''
+
+
+def replay_stripe_event(client, fixture: str, secret: str, event: dict | None = None, session: dict | None = None):
+    """envia para o webhook do stripe o evento do fixture
+    `tests/fixtures/stripe/<fixture>.json` assinado com `secret` da mesma
+    forma que o stripe assina.
+
+    Args:
+        client (Client): client de testes do django
+        fixture (str): nome do fixture sem a extensão
+        secret (str): segredo do webhook
+        event (dict, optional): campos do evento a sobrescrever
+        session (dict, optional): campos da session do checkout a sobrescrever
+
+    Returns:
+        HttpResponse: resposta do webhook
+    """
+    with open(f'tests/fixtures/stripe/{fixture}.json') as file:
+        payload = json.load(file)
+    payload.update(event or {})
+    payload['data']['object'].update(session or {})
+
+    body = json.dumps(payload)
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f'{timestamp}.{body}'.encode(), sha256).hexdigest()
+    return client.post(
+        reverse('stripe_webhook'),
+        data=body,
+        content_type='application/json',
+        HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}',
+    )
@@ -23,6 +23,7 @@ class CheckoutMessages:
         'Não foi possível concluir o pagamento devido a um erro inesperado '
         'tente novamente ou contate o suporte caso o problema persista.'
     )
+    EXPIRED_RESERVATION = 'O prazo para pagamento da reserva expirou, faça uma nova reserva.'
 
 
 class ReserveSupport:
@@ -34,6 +35,10 @@ class ReserveMessages:
     ALREADY_HAVE_A_RESERVATION = 'Você já possui uma reserva ativa ou agendada'
 
 
+class RoomSearchMessages:
+    INVALID_GUESTS = 'Quantidade de hóspedes inválida.'
+
+
 class PaymentCancelMessages:
     PAYMENT_DOES_NOT_EXISTS = 'Pagamento não existe.'
     UNEXPECTED_ERROR = 'Tivemos um erro inesperado. Tente novamente mais tarde ou contate o desenvolvedor.'